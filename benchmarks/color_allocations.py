@@ -0,0 +1,110 @@
+"""
+Micro-benchmark: number of colors allocated per hit by the shading of Scene.color_at
+"Before" shades each hit by summing Color objects, the way Scene.color_at used to. "After" is Scene.color_at itself,
+which adds every term into a single ColorAccumulator
+Run with: python -m benchmarks.color_allocations
+"""
+from contextlib import contextmanager
+
+from basics import Vector
+
+from class_lib.color import Color, ColorAccumulator, BLACK, WHITE, METAL, TEAL
+from class_lib.imaging import Camera, Scene
+from class_lib.light import AmbientLight, Illumination, LightSourceAtInfinity, PointLightSource
+from class_lib.solid_objects import Material
+from class_lib.solids.sphere import SmoothSphere
+from class_lib.useful_functions import reflected_vector
+
+NUM_HITS = 2000
+
+
+@contextmanager
+def count_allocations(counter):
+    """Counts how many Color and ColorAccumulator objects are created inside the context"""
+    originals = {cls: cls.__init__ for cls in (Color, ColorAccumulator)}
+
+    def counting_init(original_init):
+        def new_init(self, *args, **kwargs):
+            counter[0] += 1
+            original_init(self, *args, **kwargs)
+
+        return new_init
+
+    for cls, original_init in originals.items():
+        cls.__init__ = counting_init(original_init)
+    try:
+        yield
+    finally:
+        for cls, original_init in originals.items():
+            cls.__init__ = original_init
+
+
+def legacy_color_at(scene, chip, incoming_ray):
+    """Direct lighting of a chip, with one new Color for each sum and product (as Scene.color_at used to do it)"""
+    color = BLACK
+    color += chip.material.ambient_light_reflectivity ** scene.illumination.ambient_light.intensity
+    for light_source in scene.illumination.light_sources:
+        new_ray = light_source.ray_to_light_source(chip.position)
+        if (incoming_ray.direction * chip.normal) * (new_ray.direction * chip.normal) > 0:
+            continue
+        if not scene.ray_is_obstructed(new_ray, light_source.distance_to_point(chip.position)):
+            diffuse_multiplier = abs(new_ray.direction * chip.normal)
+            diffuse_multiplier *= light_source.attenuator_by_distance_sq(chip.position)
+            color += diffuse_multiplier * chip.material.diffuse_light_reflectivity ** light_source.intensity
+            h = (- incoming_ray.direction + new_ray.direction).unit
+            r = reflected_vector(new_ray.direction, chip.normal)
+            specular_multiplier = chip.material.specular_multiplier * (
+                    max(h * r, 0) ** chip.material.specular_coefficient)
+            specular_multiplier *= light_source.attenuator_by_distance_sq(chip.position)
+            color += specular_multiplier * light_source.intensity
+    return color
+
+
+def build_scene():
+    """Two opaque, non-reflective spheres lit by three light sources, so that each hit is shaded without recursion"""
+    objects = [SmoothSphere(Vector(0, 0, 0), 1, Material(diffuse_light_reflectivity=METAL, specular_multiplier=.5)),
+               SmoothSphere(Vector(0, 1.5, 0), .4, Material(diffuse_light_reflectivity=TEAL))]
+    light_sources = [LightSourceAtInfinity(direction=Vector(2, 1, 3)),
+                     LightSourceAtInfinity(intensity=Color('#002255'), direction=Vector(0, -1, 0)),
+                     PointLightSource(intensity=Color('#ffff00'), position=Vector(2, 2, -2))]
+    illumination = Illumination(ambient_light=AmbientLight(intensity=WHITE * 0.3), light_sources=light_sources)
+    camera = Camera(resolution=(40, 50), position=Vector(5, 0, 0), direction=Vector(-1, 0, 0))
+    return Scene(camera, objects, illumination)
+
+
+def sample_hits(scene, num_hits):
+    """Chips hit by camera rays, with the rays hitting them"""
+    camera = scene.camera
+    hits = []
+    for row in range(camera.image_height):
+        for col in range(camera.image_width):
+            ray = camera.get_ray(row, col)
+            for obj in scene.objects:
+                distance = obj.intersection_distance(ray)
+                if distance:
+                    hits.append((obj.chip_at(ray.position_at_time(distance)), ray))
+                    break
+    return (hits * (num_hits // len(hits) + 1))[:num_hits]
+
+
+def measure(shade, hits):
+    """Average number of colors allocated per hit"""
+    counter = [0]
+    with count_allocations(counter):
+        for chip, ray in hits:
+            shade(chip, ray)
+    return counter[0] / len(hits)
+
+
+def main():
+    scene = build_scene()
+    hits = sample_hits(scene, NUM_HITS)
+    before = measure(lambda chip, ray: legacy_color_at(scene, chip, ray), hits)
+    after = measure(lambda chip, ray: scene.color_at(chip, ray, recursion_depth=0), hits)
+    print(f'Colors allocated per hit ({len(hits)} hits, {len(scene.illumination.light_sources)} light sources)')
+    print(f'Before (Color arithmetic):  {before:.2f}')
+    print(f'After (ColorAccumulator):   {after:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark: speed of each backend of the intersection kernels (see class_lib.kernels), after checking that every
+available backend finds the same hits as the reference one
+Kernels are timed on a packet of random rays, then a scene is rendered with the vectorized engine and each backend.
+The first call of the numba backend compiles its kernels, so it is made before timing
+Run with: python -m benchmarks.kernel_backends [--rays 100000] [--scene mentos] [--resolution 90x120]
+"""
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+from sys import exit
+from time import perf_counter
+
+from numpy import abs as array_abs
+from numpy.random import default_rng
+
+from class_lib.imaging import Scene
+from class_lib.kernels import available_backends, backend_parity_errors, get_backend, random_kernel_arguments
+from class_lib.scene_registry import get_scene
+
+
+def best_time(function, repeats=3):
+    times = []
+    for _ in range(repeats):
+        start_time = perf_counter()
+        function()
+        times.append(perf_counter() - start_time)
+    return min(times)
+
+
+def main(arguments=None):
+    parser = ArgumentParser(description="Check and measure the backends of the intersection kernels")
+    parser.add_argument('--rays', type=int, default=100000, help="Number of rays of the packet given to each kernel")
+    parser.add_argument('--scene', default='mentos', help="Scene rendered with each backend")
+    parser.add_argument('--resolution', default='90x120', help="Resolution of the render, as HEIGHTxWIDTH")
+    arguments = parser.parse_args(arguments)
+
+    errors = backend_parity_errors()
+    if errors:
+        print("Backends disagree:\n" + '\n'.join(errors))
+        return 1
+    backends = available_backends()
+    print(f"Backends {', '.join(backends)} find the same hits.")
+
+    kernel_arguments = random_kernel_arguments(default_rng(0), arguments.rays)
+    print(f"\n{'kernel':>12s}" + ''.join(f"{name + ' (ms)':>14s}" for name in backends))
+    for kernel, arguments_list in kernel_arguments.items():
+        times = []
+        for name in backends:
+            function = getattr(get_backend(name), kernel)
+            function(*arguments_list[0])  # Compiles numba kernels
+            times.append(best_time(lambda: function(*arguments_list[0])))
+        print(f"{kernel:>12s}" + ''.join(f"{1000 * time:14.2f}" for time in times))
+
+    resolution = tuple(int(n) for n in arguments.resolution.split('x'))
+    scene = get_scene(arguments.scene, seed=0)
+    print(f"\nVectorized render of {arguments.scene} at {arguments.resolution}:")
+    reference_pixels = None
+    for name in backends:
+        backend_scene = Scene(scene.camera.with_resolution(resolution), scene.objects, scene.illumination,
+                              use_bvh=scene.use_bvh, kernel_backend=name)
+        with redirect_stdout(StringIO()):
+            render_time = best_time(lambda: backend_scene.render_image(vectorized=True), repeats=2)
+            pixels = backend_scene.render_image(vectorized=True).pixels
+        if reference_pixels is None:
+            reference_pixels = pixels
+        print(f"{name:>12s} {render_time:8.3f} s, largest color difference with {backends[0]}: "
+              f"{array_abs(pixels - reference_pixels).max():.2g}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,88 @@
+"""
+Benchmark: how render time scales with the number of objects and light sources, and with the fraction of reflective
+and refractive objects, on seeded random scenes (see class_lib.scene_generator)
+Each dimension is varied on its own, the others keeping their default value, and a table is printed per dimension.
+Intersection tests and mean recursion depth are given as well, to tell the cost of the intersection path (which
+grows with the number of objects and lights) from that of the shading path (which grows with recursion)
+Run with: python -m benchmarks.scalability [--engine scalar] [--no-bvh] [--max-objects 100000] [--save results.json]
+"""
+import json
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+from sys import exit
+from time import perf_counter
+
+from class_lib.scene_generator import SceneGenerator
+
+DEFAULTS = {'num_objects': 100, 'num_lights': 2, 'reflective_fraction': 0.2, 'refractive_fraction': 0.1}
+DIMENSIONS = {
+    'num_objects': (10, 100, 1000, 10000, 100000),
+    'num_lights': (1, 2, 4, 8),
+    'reflective_fraction': (0, 0.25, 0.5, 1),
+    'refractive_fraction': (0, 0.25, 0.5, 1),
+}
+
+
+def measure(scene_parameters, resolution, seed, render_options):
+    """Render time and statistics of a random scene with given parameters"""
+    start_time = perf_counter()
+    scene = SceneGenerator(seed).scene(resolution=resolution, use_bvh=render_options['use_bvh'],
+                                       **scene_parameters)
+    generation_time = perf_counter() - start_time
+    with redirect_stdout(StringIO()):
+        _, stats = scene.render_image(num_workers=render_options['num_workers'],
+                                      vectorized=render_options['vectorized'], collect_stats=True)
+    depths = stats.depth_histogram[:-1]
+    return {
+        **scene_parameters,
+        'generation_time': generation_time,
+        'render_time': stats.stage_times['total'],
+        'rays': stats.total_rays,
+        'intersection_tests': stats.total_intersection_tests,
+        'mean_recursion_depth': sum(d * n for d, n in enumerate(depths)) / max(sum(depths), 1),
+    }
+
+
+def print_table(dimension, rows):
+    print(f"\n{dimension:>20s} {'render (s)':>11s} {'rays':>10s} {'tests':>12s} {'tests/ray':>10s} {'depth':>6s}")
+    for row in rows:
+        print(f"{row[dimension]:>20} {row['render_time']:11.3f} {row['rays']:10d} {row['intersection_tests']:12d} "
+              f"{row['intersection_tests'] / max(row['rays'], 1):10.1f} {row['mean_recursion_depth']:6.2f}")
+
+
+def main(arguments=None):
+    parser = ArgumentParser(description="Measure how rendering scales on random scenes")
+    parser.add_argument('--dimensions', help=f"Comma separated dimensions to vary ({', '.join(DIMENSIONS)})")
+    parser.add_argument('--max-objects', type=int, default=10000,
+                        help="Largest number of objects tried (up to 100000)")
+    parser.add_argument('--resolution', default='36x48', help="Resolution of the images, as HEIGHTxWIDTH")
+    parser.add_argument('--engine', choices=('scalar', 'vectorized'), default='vectorized')
+    parser.add_argument('--no-bvh', action='store_true', help="Test every object against every ray")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes rendering each image")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help="Save results as JSON to this file")
+    arguments = parser.parse_args(arguments)
+
+    resolution = tuple(int(n) for n in arguments.resolution.split('x'))
+    render_options = {'use_bvh': not arguments.no_bvh, 'vectorized': arguments.engine == 'vectorized',
+                      'num_workers': arguments.workers}
+    dimensions = arguments.dimensions.split(',') if arguments.dimensions else list(DIMENSIONS)
+    results = {}
+    for dimension in dimensions:
+        values = DIMENSIONS[dimension]
+        if dimension == 'num_objects':
+            values = [value for value in values if value <= arguments.max_objects]
+        results[dimension] = [measure({**DEFAULTS, dimension: value}, resolution, arguments.seed, render_options)
+                              for value in values]
+        print_table(dimension, results[dimension])
+
+    if arguments.save:
+        with open(arguments.save, 'w') as results_file:
+            json.dump({'settings': {**render_options, 'resolution': resolution, 'seed': arguments.seed},
+                       'results': results}, results_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,135 @@
+"""
+Benchmark: render speed of every scene in pre_cooked_scenes, at a few fixed resolutions
+Each scene is rendered several times per resolution, and the fastest run gives its pixels/s and rays/s. Rays and peak
+memory are measured in a separate render, since counting and tracing allocations slow rendering down
+Results are printed and can be saved as JSON. When a baseline (results saved earlier) is given, the benchmark fails if
+any scene got slower than the baseline by more than a threshold
+Run with: python -m benchmarks.scenes [--baseline benchmarks/scene_baseline.json] [--save results.json]
+"""
+import json
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+from sys import exit
+from time import perf_counter
+from tracemalloc import get_traced_memory, start as start_tracing, stop as stop_tracing
+
+from class_lib.imaging import Scene
+from class_lib.scene_registry import get_scene, scene_names
+
+DEFAULT_RESOLUTIONS = ((45, 60), (90, 120))
+DEFAULT_REPEATS = 3
+DEFAULT_MAX_SLOWDOWN = 0.1
+
+
+def load_scenes(names=None):
+    """
+    Scenes of the pre_cooked_scenes modules, by module name. Modules describing an animation give their first frame
+    Random choices made by the modules are seeded, so that every run benchmarks the same scenes
+    """
+    return {name: get_scene(name, seed=0) for name in scene_names() if not names or name in names}
+
+
+def benchmark_scene(scene, resolution, repeats, render_options):
+    """Speed and memory usage of rendering a scene at given resolution (height, width)"""
+    scene = scene.with_camera(scene.camera.with_resolution(resolution))
+    num_pixels = resolution[0] * resolution[1]
+    times = []
+    for _ in range(repeats):
+        start_time = perf_counter()
+        with redirect_stdout(StringIO()):
+            scene.render_image(**render_options)
+        times.append(perf_counter() - start_time)
+
+    start_tracing()
+    with redirect_stdout(StringIO()):
+        _, stats = scene.render_image(collect_stats=True, **render_options)
+    _, peak_memory = get_traced_memory()
+    stop_tracing()
+
+    best_time = min(times)
+    return {
+        'height': resolution[0],
+        'width': resolution[1],
+        'times': times,
+        'best_time': best_time,
+        'pixels_per_second': num_pixels / best_time,
+        'rays': stats.total_rays,
+        'rays_per_second': stats.total_rays / best_time,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def run_benchmarks(scenes, resolutions, repeats, render_options):
+    """Benchmark every scene at every resolution. Results are keyed by 'scene@HEIGHTxWIDTH'"""
+    results = {}
+    for name, scene in scenes.items():
+        for resolution in resolutions:
+            key = f'{name}@{resolution[0]}x{resolution[1]}'
+            results[key] = benchmark_scene(scene, resolution, repeats, render_options)
+            result = results[key]
+            print(f"{key:32s} {result['pixels_per_second']:10.0f} pixels/s {result['rays_per_second']:10.0f} rays/s "
+                  f"{result['peak_memory_bytes'] / 2 ** 20:8.1f} MiB peak")
+    return results
+
+
+def compare_to_baseline(results, baseline, max_slowdown):
+    """
+    Print the change in speed of each benchmark present in both results and baseline
+    Returns the keys of the benchmarks which got slower by more than max_slowdown (0.1 for 10%)
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        slowdown = baseline[key]['pixels_per_second'] / result['pixels_per_second'] - 1
+        failed = slowdown > max_slowdown
+        if failed:
+            regressions.append(key)
+        print(f"{key:32s} {-slowdown:+8.1%} {'SLOWER' if failed else 'ok'}")
+    return regressions
+
+
+def parse_resolutions(text):
+    """Resolutions given as 'HEIGHTxWIDTH,HEIGHTxWIDTH,...'"""
+    return tuple(tuple(int(n) for n in resolution.split('x')) for resolution in text.split(','))
+
+
+def main(arguments=None):
+    parser = ArgumentParser(description="Benchmark the rendering of the pre-cooked scenes")
+    parser.add_argument('--scenes', help="Comma separated module names (all scenes by default)")
+    parser.add_argument('--resolutions', type=parse_resolutions, default=DEFAULT_RESOLUTIONS,
+                        help="Comma separated resolutions, such as 45x60,90x120")
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, help="Renders per scene and resolution")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes rendering each image")
+    parser.add_argument('--vectorized', action='store_true', help="Render with the packet engine")
+    parser.add_argument('--bvh', action='store_true', help="Use bounding volume hierarchies")
+    parser.add_argument('--save', help="Save results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON file with earlier results to compare to")
+    parser.add_argument('--max-slowdown', type=float, default=DEFAULT_MAX_SLOWDOWN,
+                        help="Fail if a scene is slower than the baseline by more than this fraction")
+    arguments = parser.parse_args(arguments)
+
+    scenes = load_scenes(arguments.scenes.split(',') if arguments.scenes else None)
+    if arguments.bvh:
+        scenes = {name: Scene(scene.camera, scene.objects, scene.illumination, use_bvh=True)
+                  for name, scene in scenes.items()}
+    render_options = {'num_workers': arguments.workers, 'vectorized': arguments.vectorized}
+    results = run_benchmarks(scenes, arguments.resolutions, arguments.repeats, render_options)
+
+    if arguments.save:
+        with open(arguments.save, 'w') as results_file:
+            json.dump({'settings': {**render_options, 'bvh': arguments.bvh, 'repeats': arguments.repeats},
+                       'results': results}, results_file, indent=2)
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare_to_baseline(results, baseline, arguments.max_slowdown)
+        if regressions:
+            print(f"{len(regressions)} benchmarks slower than baseline by more than {arguments.max_slowdown:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,307 @@
+from collections import deque
+from contextlib import redirect_stdout
+from io import BytesIO, StringIO
+from multiprocessing import Pool
+from struct import pack
+from time import perf_counter
+from zlib import compress
+
+from PIL.Image import fromarray
+from numpy import uint8
+
+from class_lib.image_writers import PNG_SIGNATURE, png_chunk, up_filtered_rows
+from class_lib.parallel import default_num_workers
+from class_lib.temporal_coherence import TemporalCoherentRenderer
+
+
+class ApngWriter:
+    """Writes frames to an animated PNG file as soon as they are given, so that they need not be kept in memory"""
+
+    def __init__(self, file_name, num_frames, frame_duration=100, loop=0):
+        """
+        Initialize APNG writer
+        :param file_name: Path of the file to write
+        :param num_frames: Number of frames of the animation (the file is fixed on close if fewer frames are given)
+        :param frame_duration: Time each frame is displayed, in milliseconds
+        :param loop: Number of times the animation is played (0 for forever)
+        """
+        self.__file = open(file_name, 'wb')
+        self.__num_frames = num_frames
+        self.__frame_duration = frame_duration
+        self.__loop = loop
+        self.__frames_written = 0
+        self.__sequence_number = 0
+        self.__actl_position = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __write_chunk(self, chunk_type, data):
+        self.__file.write(png_chunk(chunk_type, data))
+
+    @staticmethod
+    def __compressed_pixels(pixels):
+        """Image data of a frame: rows of RGB bytes, each one minus the one above ('Up' filter), zlib compressed"""
+        return compress(up_filtered_rows(pixels))
+
+    def add_frame(self, pixels):
+        """Append a frame, given as a height x width x 3 array of 8 bit colors"""
+        height, width = pixels.shape[:2]
+        if self.__frames_written == 0:
+            self.__file.write(PNG_SIGNATURE)
+            self.__write_chunk(b'IHDR', pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            self.__actl_position = self.__file.tell()
+            self.__write_chunk(b'acTL', pack('>II', self.__num_frames, self.__loop))
+        self.__write_chunk(b'fcTL', pack('>IIIIIHHBB', self.__sequence_number, width, height, 0, 0,
+                                         self.__frame_duration, 1000, 0, 0))
+        self.__sequence_number += 1
+        data = ApngWriter.__compressed_pixels(pixels)
+        if self.__frames_written == 0:
+            self.__write_chunk(b'IDAT', data)
+        else:
+            self.__write_chunk(b'fdAT', pack('>I', self.__sequence_number) + data)
+            self.__sequence_number += 1
+        self.__frames_written += 1
+
+    def close(self):
+        if self.__file.closed:
+            return
+        if self.__frames_written != self.__num_frames and self.__actl_position is not None:
+            self.__file.seek(self.__actl_position)
+            self.__write_chunk(b'acTL', pack('>II', self.__frames_written, self.__loop))
+            self.__file.seek(0, 2)
+        self.__write_chunk(b'IEND', b'')
+        self.__file.close()
+
+
+class GifWriter:
+    """
+    Writes frames to an animated GIF file as soon as they are given, so that they need not be kept in memory
+    Each frame is reduced to 256 colors by Pillow, and stored with its own color table
+    """
+
+    def __init__(self, file_name, frame_duration=100, loop=0):
+        """
+        Initialize GIF writer
+        :param file_name: Path of the file to write
+        :param frame_duration: Time each frame is displayed, in milliseconds (GIF rounds it to hundredths of a second)
+        :param loop: Number of times the animation is repeated (0 for forever)
+        """
+        self.__file = open(file_name, 'wb')
+        self.__frame_duration = frame_duration
+        self.__loop = loop
+        self.__frames_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @staticmethod
+    def __skip_sub_blocks(data, position):
+        """Position after a sequence of data sub-blocks, which ends with an empty one"""
+        while data[position] != 0:
+            position += data[position] + 1
+        return position + 1
+
+    @staticmethod
+    def __single_frame_parts(pixels):
+        """
+        Encode a frame as a standalone GIF, and extract its image descriptor (with the color table made local), color
+        table and compressed image data
+        """
+        buffer = BytesIO()
+        fromarray(pixels.astype(uint8)).save(buffer, format='GIF')
+        data = buffer.getvalue()
+        screen_flags = data[10]
+        position = 13
+        color_table = b''
+        if screen_flags & 0x80:
+            table_size = 3 * 2 ** ((screen_flags & 0x07) + 1)
+            color_table = data[position:position + table_size]
+            position += table_size
+        while data[position] == 0x21:  # Extension blocks are skipped
+            position = GifWriter.__skip_sub_blocks(data, position + 2)
+        if data[position] != 0x2C:
+            raise ValueError("Unexpected block in GIF encoded by Pillow")
+        descriptor = bytearray(data[position:position + 10])
+        position += 10
+        if not descriptor[9] & 0x80:
+            descriptor[9] |= 0x80 | (screen_flags & 0x07)
+        image_data_start = position
+        position = GifWriter.__skip_sub_blocks(data, position + 1)  # First byte is the minimum LZW code size
+        return bytes(descriptor), color_table, data[image_data_start:position]
+
+    def add_frame(self, pixels):
+        """Append a frame, given as a height x width x 3 array of 8 bit colors"""
+        height, width = pixels.shape[:2]
+        if self.__frames_written == 0:
+            self.__file.write(b'GIF89a' + pack('<HHBBB', width, height, 0, 0, 0))
+            self.__file.write(b'\x21\xff\x0bNETSCAPE2.0' + pack('<BBHB', 3, 1, self.__loop, 0))
+        descriptor, color_table, image_data = GifWriter.__single_frame_parts(pixels)
+        delay = round(self.__frame_duration / 10)
+        # Graphic control extension: frame is left in place (disposal method 1), and displayed during delay
+        self.__file.write(b'\x21\xf9\x04' + pack('<BHBB', 0x04, delay, 0, 0))
+        self.__file.write(descriptor + color_table + image_data)
+        self.__frames_written += 1
+
+    def close(self):
+        if not self.__file.closed:
+            self.__file.write(b'\x3b')
+            self.__file.close()
+
+
+def animation_writer(file_name, num_frames, frame_duration=100, loop=0):
+    """Writer for an animated GIF or PNG (APNG) file, chosen from the extension of the file name"""
+    extension = file_name.lower().rsplit('.', 1)[-1]
+    if extension == 'gif':
+        return GifWriter(file_name, frame_duration, loop)
+    if extension in ('png', 'apng'):
+        return ApngWriter(file_name, num_frames, frame_duration, loop)
+    raise ValueError(f"Unsupported animation format: '{extension}'. Use .gif, .png or .apng")
+
+
+class AnimationReport:
+    """Progress and throughput of an animation being rendered"""
+
+    def __init__(self, num_frames):
+        self.num_frames = num_frames
+        self.frame_render_times = []
+        self.num_pixels = 0
+        self.num_traced_pixels = 0
+        self.__start_time = perf_counter()
+        self.elapsed_time = 0
+
+    def add_frame(self, render_time, num_pixels, num_traced_pixels=None):
+        self.frame_render_times.append(render_time)
+        self.num_pixels += num_pixels
+        self.num_traced_pixels += num_pixels if num_traced_pixels is None else num_traced_pixels
+        self.elapsed_time = perf_counter() - self.__start_time
+
+    @property
+    def frames_done(self):
+        return len(self.frame_render_times)
+
+    @property
+    def frames_per_second(self):
+        return self.frames_done / self.elapsed_time if self.elapsed_time else 0
+
+    @property
+    def pixels_per_second(self):
+        return self.num_pixels / self.elapsed_time if self.elapsed_time else 0
+
+    @property
+    def time_left(self):
+        """Estimated time to finish the animation, in seconds"""
+        if not self.frames_done:
+            return None
+        return (self.num_frames - self.frames_done) / self.frames_per_second
+
+    @property
+    def mean_frame_render_time(self):
+        """Mean time to render a frame in a worker (larger than 1 / frames_per_second if there are several workers)"""
+        return sum(self.frame_render_times) / self.frames_done if self.frames_done else 0
+
+    @property
+    def traced_fraction(self):
+        """Fraction of the pixels which were traced, instead of being copied from the previous frame"""
+        return self.num_traced_pixels / self.num_pixels if self.num_pixels else 0
+
+    def progress_line(self):
+        return (f"Frame {self.frames_done}/{self.num_frames} done - {self.frames_per_second:.2f} frames/s, "
+                f"{self.pixels_per_second:.0f} pixels/s, {self.time_left:.0f} s left")
+
+    def __str__(self):
+        return (f"Rendered {self.frames_done} frames in {self.elapsed_time:.1f} s: {self.frames_per_second:.2f} "
+                f"frames/s, {self.pixels_per_second:.0f} pixels/s, {self.mean_frame_render_time:.2f} s per frame "
+                f"per worker, {self.traced_fraction:.0%} of pixels traced")
+
+
+# Scene factory and rendering options of the current worker process, set once by the pool initializer
+_worker_scene_at_frame = None
+_worker_render_options = None
+
+
+def _init_worker(scene_at_frame, render_options):
+    global _worker_scene_at_frame, _worker_render_options
+    _worker_scene_at_frame = scene_at_frame
+    _worker_render_options = render_options
+
+
+def _render_frame(frame_index):
+    """Pixels of a frame (as 8 bit colors, which are much cheaper to send back than Colors) and time to render them"""
+    start_time = perf_counter()
+    with redirect_stdout(StringIO()):  # Progress of each frame would be interleaved with that of other workers
+        image = _worker_scene_at_frame(frame_index).render_image(**_worker_render_options)
+    return image.as_uint8_array(), perf_counter() - start_time
+
+
+def _rendered_frames(num_frames, num_workers):
+    """
+    Yields the pixels, render time and number of traced pixels (None if all) of each frame, in order, keeping few
+    finished frames waiting in memory
+    """
+    if num_workers == 1:
+        for frame_index in range(num_frames):
+            yield _render_frame(frame_index) + (None,)
+        return
+    max_pending_frames = 2 * num_workers
+    with Pool(processes=num_workers, initializer=_init_worker,
+              initargs=(_worker_scene_at_frame, _worker_render_options)) as pool:
+        pending_frames = deque()
+        next_frame = 0
+        while pending_frames or next_frame < num_frames:
+            while next_frame < num_frames and len(pending_frames) < max_pending_frames:
+                pending_frames.append(pool.apply_async(_render_frame, (next_frame,)))
+                next_frame += 1
+            yield pending_frames.popleft().get() + (None,)
+
+
+def _coherent_frames(num_frames, num_workers, tile_size):
+    """Same as _rendered_frames, but frames are rendered in turn, each one re-tracing few pixels of the previous one"""
+    renderer = TemporalCoherentRenderer(tile_size, num_workers)
+    for frame_index in range(num_frames):
+        start_time = perf_counter()
+        image = renderer.render(_worker_scene_at_frame(frame_index))
+        yield image.as_uint8_array(), perf_counter() - start_time, renderer.retraced_pixels
+
+
+def render_animation(scene_at_frame, num_frames, file_name, frame_duration=100, loop=0, num_workers=None,
+                     vectorized=False, tile_size=None, temporal_coherence=False):
+    """
+    Render the frames of an animation in a pool of processes, and write them in order to an animated GIF or PNG file
+    as soon as they are ready. Returns an AnimationReport
+    :param scene_at_frame: Picklable function (defined at module level) returning the Scene of a given frame index
+    :param num_frames: Number of frames
+    :param file_name: Path of the animation file. Its extension (.gif, .png or .apng) gives the format
+    :param frame_duration: Time each frame is displayed, in milliseconds
+    :param loop: Number of times the animation is played (0 for forever)
+    :param num_workers: Number of processes rendering frames (one frame per process). If None, uses one per CPU core
+    :param vectorized: If true, each tile of a frame is traced as a single packet of rays, with NumPy arrays
+    :param tile_size: Side of the square tiles frames are split into. If None, 32 for frames rendered on their own, and
+    8 with temporal coherence
+    :param temporal_coherence: If true, frames are rendered one after the other with the packet engine (tiles of each
+    frame are shared between workers), only re-tracing the pixels which may differ from the previous frame. Frames are
+    identical to the ones rendered on their own with vectorized set to true
+    """
+    if num_workers is None:
+        num_workers = default_num_workers()
+    if tile_size is None:
+        tile_size = 8 if temporal_coherence else 32
+    _init_worker(scene_at_frame, {'vectorized': vectorized, 'tile_size': tile_size})
+    if temporal_coherence:
+        frames = _coherent_frames(num_frames, num_workers, tile_size)
+    else:
+        frames = _rendered_frames(num_frames, max(1, min(num_workers, num_frames)))
+    report = AnimationReport(num_frames)
+    with animation_writer(file_name, num_frames, frame_duration, loop) as writer:
+        for pixels, render_time, num_traced_pixels in frames:
+            writer.add_frame(pixels)
+            report.add_frame(render_time, pixels.shape[0] * pixels.shape[1], num_traced_pixels)
+            print(report.progress_line())
+    print(report)
+    return report
@@ -0,0 +1,78 @@
+from numpy import full, nonzero, repeat, zeros
+from numpy.random import default_rng
+
+
+def _differ(object_ids, other_object_ids, normals, other_normals, colors, other_colors, color_threshold,
+            normal_threshold):
+    """Whether samples (given by arrays which are broadcast together) see different objects, normals or colors"""
+    return (object_ids != other_object_ids) | \
+        (((normals * other_normals).sum(axis=-1) < 1 - normal_threshold) & (object_ids >= 0)) | \
+        (abs(colors - other_colors).max(axis=-1) > color_threshold)
+
+
+def edge_pixels(colors, object_ids, normals, color_threshold, normal_threshold):
+    """
+    Pixels which differ from one of their four neighbours: they see a different object, a normal at a larger angle than
+    given by normal_threshold (1 minus the cosine of the angle), or a color which differs by more than color_threshold
+    in any component
+    :param colors: Colors of the pixels (height x width x 3 array)
+    :param object_ids: Index of the object seen through each pixel, -1 for the background (height x width array)
+    :param normals: Unit normal of the surface seen through each pixel, zero for the background (height x width x 3)
+    Returns a boolean height x width array
+    """
+    edges = zeros(object_ids.shape, dtype=bool)
+    for first, second in (((slice(None, -1), slice(None)), (slice(1, None), slice(None))),  # Vertical neighbours
+                          ((slice(None), slice(None, -1)), (slice(None), slice(1, None)))):  # Horizontal neighbours
+        differ = _differ(object_ids[first], object_ids[second], normals[first], normals[second], colors[first],
+                         colors[second], color_threshold, normal_threshold)
+        edges[first] |= differ
+        edges[second] |= differ
+    return edges
+
+
+def adaptive_supersampling(height, width, sample_points, max_samples=16, color_threshold=0.05, normal_threshold=0.1,
+                           seed=0):
+    """
+    Colors of every pixel of an image (height x width x 3 array), anti-aliased by supersampling edges only:
+    - Every pixel is sampled once, at its center
+    - Pixels which differ from a neighbour (see edge_pixels) get three more samples, at random points of the pixel
+    - Those whose new samples differ from their center sample (in object, normal or color) get more samples, up to
+    max_samples per pixel
+    Each pixel's color is the mean of its samples. Also returns the number of samples taken for each pixel
+    :param sample_points: Function which, given arrays of rows and columns and arrays of offsets (between -0.5 and 0.5)
+    from the center of those pixels, returns the colors seen at those points, the index of the object seen (-1 for the
+    background) and the unit normal of its surface (zero for the background)
+    :param max_samples: Maximum number of samples per pixel. 1 disables anti-aliasing
+    :param seed: Seed of the jitter, so that the same scene is always rendered the same
+    """
+    rows, columns = nonzero(full((height, width), True))
+    colors, object_ids, normals = sample_points(rows, columns, zeros(len(rows)), zeros(len(rows)))
+    colors, object_ids, normals = colors.reshape((height, width, 3)), object_ids.reshape((height, width)), \
+        normals.reshape((height, width, 3))
+    sample_counts = full((height, width), 1)
+    if max_samples <= 1:
+        return colors, sample_counts
+
+    rng = default_rng(seed)
+    color_sums = colors.copy()
+    rows, columns = nonzero(edge_pixels(colors, object_ids, normals, color_threshold, normal_threshold))
+    first_round = min(4, max_samples) - 1
+    for num_samples in (first_round, max_samples - 1 - first_round):
+        if len(rows) == 0 or num_samples <= 0:
+            break
+        # Random points of the pixels, so that edges do not show the regular pattern of a grid of samples
+        row_offsets, column_offsets = rng.random((2, len(rows) * num_samples)) - 0.5
+        sample_colors, sample_ids, sample_normals = sample_points(
+            repeat(rows, num_samples), repeat(columns, num_samples), row_offsets, column_offsets)
+        sample_colors = sample_colors.reshape((len(rows), num_samples, 3))
+        color_sums[rows, columns] += sample_colors.sum(axis=1)
+        sample_counts[rows, columns] += num_samples
+
+        # Pixels whose new samples agree with their center sample are not sampled any more
+        sample_ids = sample_ids.reshape((len(rows), num_samples))
+        sample_normals = sample_normals.reshape((len(rows), num_samples, 3))
+        disagreeing = _differ(object_ids[rows, columns][:, None], sample_ids, normals[rows, columns][:, None],
+                              sample_normals, colors[rows, columns][:, None], sample_colors, color_threshold,
+                              normal_threshold).any(axis=1)
+        rows, columns = rows[disagreeing], columns[disagreeing]
+    return color_sums / sample_counts[..., None], sample_counts
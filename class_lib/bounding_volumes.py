@@ -0,0 +1,263 @@
+from math import inf
+
+from numpy import arange, array, errstate, full, maximum, minimum, where, zeros
+
+from class_lib.solid_objects import Hit
+from globals import MIN_DIST
+
+# Boxes are slightly enlarged, so that rounding errors never make a ray miss the box of an object it hits
+BOX_PADDING = 1e-7
+
+
+class BoundingBox:
+    """Axis-aligned box, given by its minimum and maximum corners (x, y, z)"""
+
+    def __init__(self, minimum_corner, maximum_corner, padding=BOX_PADDING):
+        self.minimum_corner = tuple(c - padding for c in minimum_corner)
+        self.maximum_corner = tuple(c + padding for c in maximum_corner)
+
+    @staticmethod
+    def around_local_box(coordinate_system, local_minimum_corner, local_maximum_corner):
+        """Smallest axis-aligned box containing a box given in the coordinates of a coordinate system"""
+        local_center = [(a + b) / 2 for a, b in zip(local_minimum_corner, local_maximum_corner)]
+        local_half_sides = [(b - a) / 2 for a, b in zip(local_minimum_corner, local_maximum_corner)]
+        axes = (coordinate_system.i_prime, coordinate_system.j_prime, coordinate_system.k_prime)
+        origin = coordinate_system.origin
+        center = [origin.x, origin.y, origin.z]
+        half_sides = [0, 0, 0]
+        for axis, local_coord, local_half_side in zip(axes, local_center, local_half_sides):
+            for i, axis_coord in enumerate((axis.x, axis.y, axis.z)):
+                center[i] += axis_coord * local_coord
+                half_sides[i] += abs(axis_coord) * local_half_side
+        return BoundingBox([c - h for c, h in zip(center, half_sides)], [c + h for c, h in zip(center, half_sides)])
+
+    @staticmethod
+    def union(boxes):
+        """Smallest box containing all given boxes"""
+        minimum_corner = tuple(min(box.minimum_corner[i] for box in boxes) for i in range(3))
+        maximum_corner = tuple(max(box.maximum_corner[i] for box in boxes) for i in range(3))
+        return BoundingBox(minimum_corner, maximum_corner, padding=0)
+
+    @property
+    def center(self):
+        return tuple((a + b) / 2 for a, b in zip(self.minimum_corner, self.maximum_corner))
+
+    def ray_distances(self, ray_p0, ray_dir):
+        """
+        Distances along the ray at which it enters and leaves the box (slab method)
+        Ray is given by tuples (x, y, z). If the ray misses the box, the entry distance is larger than the exit one
+        """
+        t_near, t_far = -inf, inf
+        for p, d, lower, upper in zip(ray_p0, ray_dir, self.minimum_corner, self.maximum_corner):
+            if d == 0:
+                if p < lower or p > upper:
+                    return inf, -inf
+                continue
+            t1 = (lower - p) / d
+            t2 = (upper - p) / d
+            if t1 > t2:
+                t1, t2 = t2, t1
+            if t1 > t_near:
+                t_near = t1
+            if t2 < t_far:
+                t_far = t2
+        return t_near, t_far
+
+    def rays_distances(self, ray_p0s, ray_dirs):
+        """Vectorized version of ray_distances, for arrays of rays (one per row)"""
+        lower, upper = array(self.minimum_corner), array(self.maximum_corner)
+        parallel = ray_dirs == 0
+        with errstate(divide='ignore', invalid='ignore'):
+            t1 = (lower - ray_p0s) / ray_dirs
+            t2 = (upper - ray_p0s) / ray_dirs
+        # Rays parallel to a slab are either always or never inside it
+        inside_slab = (ray_p0s >= lower) & (ray_p0s <= upper)
+        t_near = where(parallel, where(inside_slab, -inf, inf), minimum(t1, t2)).max(axis=1)
+        t_far = where(parallel, where(inside_slab, inf, -inf), maximum(t1, t2)).min(axis=1)
+        return t_near, t_far
+
+
+class BoundingSphere:
+    """
+    Sphere containing an object, so that rays which pass far from it can be rejected with a few multiplications, before
+    they are converted to the object's coordinate system
+    """
+
+    def __init__(self, center, radius, padding=BOX_PADDING):
+        """
+        Initialize bounding sphere
+        :param center: Center (x, y, z)
+        :param radius: Radius
+        :param padding: Added to the radius, so that rounding errors never make a ray miss the sphere of an object it hits
+        """
+        self.center = tuple(center)
+        self.radius = radius + padding
+        self.__radius_sq = self.radius * self.radius
+
+    def may_be_hit_by_ray(self, ray_p0, ray_dir):
+        """False if the ray (initial point and unit direction, as Vectors) certainly misses the sphere"""
+        cx, cy, cz = self.center
+        to_center_x, to_center_y, to_center_z = cx - ray_p0.x, cy - ray_p0.y, cz - ray_p0.z
+        distance_sq = to_center_x * to_center_x + to_center_y * to_center_y + to_center_z * to_center_z
+        if distance_sq <= self.__radius_sq:
+            return True  # Ray starts inside the sphere
+        # Distance along the ray to the point closest to the center, which must be ahead and inside the sphere
+        t = to_center_x * ray_dir.x + to_center_y * ray_dir.y + to_center_z * ray_dir.z
+        return t > 0 and distance_sq - t * t <= self.__radius_sq
+
+    def may_be_hit_by_rays(self, ray_p0s, ray_dirs):
+        """Vectorized version of may_be_hit_by_ray, for arrays of rays (one per row)"""
+        to_center = array(self.center) - ray_p0s
+        distances_sq = (to_center * to_center).sum(axis=1)
+        t = (to_center * ray_dirs).sum(axis=1)
+        return (distances_sq <= self.__radius_sq) | ((t > 0) & (distances_sq - t * t <= self.__radius_sq))
+
+
+class _Node:
+    """Node of a bounding volume hierarchy. Leaves hold objects (with their index in the scene), other nodes children"""
+
+    def __init__(self, box, children=(), objects=()):
+        self.box = box
+        self.children = children
+        self.objects = objects
+
+
+class BoundingVolumeHierarchy:
+    """
+    Tree of bounding boxes around the objects of a scene, so that a ray is only tested against the objects whose boxes
+    it crosses. Unbounded objects (infinite planes, for example) are kept in a list which is always tested
+    """
+
+    def __init__(self, objects, max_leaf_size=2):
+        self.__max_leaf_size = max_leaf_size
+        self.__unbounded_objects = []
+        bounded_objects = []
+        for obj_index, obj in enumerate(objects):
+            box = obj.bounding_box()
+            if box is None:
+                self.__unbounded_objects.append((obj_index, obj))
+            else:
+                bounded_objects.append((obj_index, obj, box))
+        self.__root = self.__build(bounded_objects) if bounded_objects else None
+
+    def __build(self, bounded_objects):
+        """Recursively split objects in two halves, along the axis in which their centers are most spread out"""
+        box = BoundingBox.union([b for _, _, b in bounded_objects])
+        if len(bounded_objects) <= self.__max_leaf_size:
+            return _Node(box, objects=[(obj_index, obj) for obj_index, obj, _ in bounded_objects])
+        centers = [b.center for _, _, b in bounded_objects]
+        spreads = [max(c[i] for c in centers) - min(c[i] for c in centers) for i in range(3)]
+        axis = spreads.index(max(spreads))
+        bounded_objects = sorted(bounded_objects, key=lambda item: item[2].center[axis])
+        middle = len(bounded_objects) // 2
+        return _Node(box, children=(self.__build(bounded_objects[:middle]), self.__build(bounded_objects[middle:])))
+
+    def nearest_hit(self, ray):
+        """Nearest hit of ray, as a Hit (whose object is None if the ray hits nothing)"""
+        hit = Hit()
+        for obj_index, obj in self.__unbounded_objects:
+            obj.record_hit(ray, hit, obj_index)
+        if self.__root is None:
+            return hit
+
+        ray_p0 = (ray.initial_point.x, ray.initial_point.y, ray.initial_point.z)
+        ray_dir = (ray.direction.x, ray.direction.y, ray.direction.z)
+        nodes_to_visit = [self.__root]
+        while nodes_to_visit:
+            node = nodes_to_visit.pop()
+            t_near, t_far = node.box.ray_distances(ray_p0, ray_dir)
+            if t_near > t_far or t_far < MIN_DIST or t_near > hit.distance:
+                continue
+            nodes_to_visit.extend(node.children)
+            for obj_index, obj in node.objects:
+                obj.record_hit(ray, hit, obj_index)
+        return hit
+
+    def ray_is_obstructed(self, ray, light_source_distance):
+        """Returns true if there is an object obstructing the light source and causing a shadow"""
+        return self.occluder_index(ray, light_source_distance) is not None
+
+    def occluder_index(self, ray, light_source_distance):
+        """Index of an object obstructing the light source, or None if there is none"""
+        for obj_index, obj in self.__unbounded_objects:
+            distance = obj.intersection_distance(ray)
+            if distance and distance <= light_source_distance:
+                return obj_index
+        if self.__root is None:
+            return None
+
+        ray_p0 = (ray.initial_point.x, ray.initial_point.y, ray.initial_point.z)
+        ray_dir = (ray.direction.x, ray.direction.y, ray.direction.z)
+        nodes_to_visit = [self.__root]
+        while nodes_to_visit:
+            node = nodes_to_visit.pop()
+            t_near, t_far = node.box.ray_distances(ray_p0, ray_dir)
+            if t_near > t_far or t_far < MIN_DIST or t_near > light_source_distance:
+                continue
+            nodes_to_visit.extend(node.children)
+            for obj_index, obj in node.objects:
+                distance = obj.intersection_distance(ray)
+                if distance and distance <= light_source_distance:
+                    return obj_index
+        return None
+
+    def nearest_objects_hit_by_rays(self, ray_initial_points, ray_directions):
+        """
+        Vectorized version of nearest_hit, for arrays of rays (one per row)
+        Returns index of the object (-1 if there is none) and its distance to ray origin
+        """
+        minimum_distances = full(len(ray_initial_points), inf)
+        object_indexes = full(len(ray_initial_points), -1)
+
+        def test_objects(objects, rays):
+            for obj_index, obj in objects:
+                distances = obj.intersection_distances(ray_initial_points[rays], ray_directions[rays])
+                closer = (distances < minimum_distances[rays]) | (
+                        (distances == minimum_distances[rays]) & (obj_index < object_indexes[rays]))
+                minimum_distances[rays[closer]] = distances[closer]
+                object_indexes[rays[closer]] = obj_index
+
+        def visit(node, rays):
+            t_near, t_far = node.box.rays_distances(ray_initial_points[rays], ray_directions[rays])
+            rays = rays[(t_near <= t_far) & (t_far >= MIN_DIST) & (t_near <= minimum_distances[rays])]
+            if len(rays) == 0:
+                return
+            test_objects(node.objects, rays)
+            for child in node.children:
+                visit(child, rays)
+
+        all_rays = arange(len(ray_initial_points))
+        test_objects(self.__unbounded_objects, all_rays)
+        if self.__root is not None:
+            visit(self.__root, all_rays)
+        return object_indexes, minimum_distances
+
+    def rays_are_obstructed(self, ray_initial_points, ray_directions, light_source_distances):
+        """Vectorized version of ray_is_obstructed"""
+        obstructed = zeros(len(ray_initial_points), dtype=bool)
+
+        def test_objects(objects, rays):
+            for _, obj in objects:
+                rays = rays[~obstructed[rays]]
+                if len(rays) == 0:
+                    return
+                distances = obj.intersection_distances(ray_initial_points[rays], ray_directions[rays])
+                obstructed[rays] = (distances < inf) & (distances <= light_source_distances[rays])
+
+        def visit(node, rays):
+            rays = rays[~obstructed[rays]]
+            if len(rays) == 0:
+                return
+            t_near, t_far = node.box.rays_distances(ray_initial_points[rays], ray_directions[rays])
+            rays = rays[(t_near <= t_far) & (t_far >= MIN_DIST) & (t_near <= light_source_distances[rays])]
+            if len(rays) == 0:
+                return
+            test_objects(node.objects, rays)
+            for child in node.children:
+                visit(child, rays)
+
+        all_rays = arange(len(ray_initial_points))
+        test_objects(self.__unbounded_objects, all_rays)
+        if self.__root is not None:
+            visit(self.__root, all_rays)
+        return obstructed
@@ -1,6 +1,8 @@
 class Color:
     """Class for RGB colors"""
 
+    __slots__ = ('__red', '__green', '__blue')  # No per-instance dict: colors are created in the innermost loops
+
     def __init__(self, *args, **kwargs):
         """
         Initialize new color
@@ -90,6 +92,32 @@ class Color:
         return f'{{{self.__red}, {self.__green}, {self.__blue}}}'
 
 
+class ColorAccumulator:
+    """
+    Mutable RGB buffer, to which several colors can be added without creating a new Color for each sum or product
+    """
+
+    __slots__ = ('red', 'green', 'blue')
+
+    def __init__(self):
+        self.red, self.green, self.blue = 0, 0, 0
+
+    def add_scaled(self, color, multiplier):
+        """Adds color multiplied by given scalar"""
+        self.red += color.red * multiplier
+        self.green += color.green * multiplier
+        self.blue += color.blue * multiplier
+
+    def add_product(self, color, other_color, multiplier=1):
+        """Adds the component-wise product of two colors, multiplied by given scalar"""
+        self.red += multiplier * (color.red * other_color.red)
+        self.green += multiplier * (color.green * other_color.green)
+        self.blue += multiplier * (color.blue * other_color.blue)
+
+    def as_color(self):
+        return Color(self.red, self.green, self.blue)
+
+
 # Constant colors
 BLACK = Color(red=0, green=0, blue=0)
 WHITE = Color('#ffffff')
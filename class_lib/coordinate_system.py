@@ -1,13 +1,32 @@
 from math import cos, sin
 
 from basics import Vector
+from numpy import array
 
 
 class CoordinateSystem:
+    version = 0  # Number of times an attribute was set
+
     def __init__(self, origin=Vector(0, 0, 0), orientation=Vector(0, 0, 1), angle=0):
         self.origin = origin
         self.k_prime, self.i_prime, self.j_prime = CoordinateSystem.unit_base_axis(orientation, angle)
 
+    def __setattr__(self, name, value):
+        """Count changes, so that objects know when the values they computed from their coordinate system are stale"""
+        super().__setattr__(name, value)
+        super().__setattr__('version', self.version + 1)
+
+    def __getstate__(self):
+        return {name: value for name, value in self.__dict__.items() if name != 'version'}
+
+    @staticmethod
+    def from_axes(origin, i_prime, j_prime, k_prime):
+        """Coordinate system with given origin and axes, which are used as they are"""
+        coordinate_system = CoordinateSystem.__new__(CoordinateSystem)
+        coordinate_system.origin = origin
+        coordinate_system.i_prime, coordinate_system.j_prime, coordinate_system.k_prime = i_prime, j_prime, k_prime
+        return coordinate_system
+
     @staticmethod
     def unit_base_axis(i_prime, tilt):
         """Returns a coordinate system (i', j' and k') given i'"""
@@ -36,5 +55,37 @@ class CoordinateSystem:
         pz = direction * self.k_prime
         return Vector(px, py, pz)
 
+    def convert_ray(self, initial_point, direction):
+        """
+        Initial point and direction of a ray converted to this coordinate system, like convert_position and
+        convert_direction, but with plain floats instead of intermediate vectors, since it runs for every intersection
+        test of the scalar renderer
+        """
+        i, j, k = self.i_prime, self.j_prime, self.k_prime
+        px, py, pz = initial_point.x - self.origin.x, initial_point.y - self.origin.y, initial_point.z - self.origin.z
+        dx, dy, dz = direction.x, direction.y, direction.z
+        return (Vector(px * i.x + py * i.y + pz * i.z, px * j.x + py * j.y + pz * j.z, px * k.x + py * k.y + pz * k.z),
+                Vector(dx * i.x + dy * i.y + dz * i.z, dx * j.x + dy * j.y + dz * j.z, dx * k.x + dy * k.y + dz * k.z))
+
     def deconvert_direction(self, direction):
         return self.i_prime * direction.x + self.j_prime * direction.y + self.k_prime * direction.z
+
+    def __base_matrix(self):
+        """Matrix whose rows are i', j' and k'"""
+        return array([(axis.x, axis.y, axis.z) for axis in (self.i_prime, self.j_prime, self.k_prime)])
+
+    def convert_positions(self, positions):
+        """Vectorized version of convert_position, for an array of positions (one per row)"""
+        return self.convert_directions(positions - array((self.origin.x, self.origin.y, self.origin.z)))
+
+    def deconvert_positions(self, positions):
+        """Vectorized version of deconvert_position, for an array of positions (one per row)"""
+        return array((self.origin.x, self.origin.y, self.origin.z)) + self.deconvert_directions(positions)
+
+    def convert_directions(self, directions):
+        """Vectorized version of convert_direction, for an array of directions (one per row)"""
+        return directions @ self.__base_matrix().T
+
+    def deconvert_directions(self, directions):
+        """Vectorized version of deconvert_direction, for an array of directions (one per row)"""
+        return directions @ self.__base_matrix()
@@ -0,0 +1,111 @@
+from os.path import splitext
+from time import perf_counter
+
+from numpy import array, interp, log1p, percentile, stack, zeros
+
+from class_lib.imaging import Image
+from class_lib.parallel import default_num_workers, render_tiles_in_parallel, split_into_tiles
+from class_lib.render_stats import RenderStats
+
+COST_METRICS = ('intersections', 'time')
+
+# False colors from cheap to expensive pixels: black, purple, red, orange and white
+HEATMAP_COLOR_STOPS = array([[0, 0, 0], [.35, .05, .55], [.85, .15, .25], [1, .65, 0], [1, 1, 1]])
+
+
+class CostTileRenderer:
+    """
+    Picklable function rendering a tile with the scalar ray tracer, and measuring the cost of each pixel
+    Returns the colors of the pixels (row by row) and an array with their costs
+    """
+
+    def __init__(self, scene, metric='intersections'):
+        """
+        Initialize tile renderer
+        :param scene: Scene to render
+        :param metric: Either 'intersections' (number of intersection tests of each pixel, including those of its
+        secondary and shadow rays) or 'time' (seconds spent tracing each pixel)
+        """
+        if metric not in COST_METRICS:
+            raise ValueError(f"Unknown cost metric: '{metric}'. Use one of {', '.join(COST_METRICS)}")
+        self.__scene = scene
+        self.__metric = metric
+
+    def __call__(self, tile):
+        top, left, bottom, right = tile
+        camera = self.__scene.camera
+        colors = []
+        costs = zeros((bottom - top, right - left))
+        stats = RenderStats()
+        counting_intersections = self.__metric == 'intersections'
+        with stats.collecting():
+            for row in range(top, bottom):
+                colors.append([])
+                for col in range(left, right):
+                    start = stats.total_intersection_tests if counting_intersections else perf_counter()
+                    colors[-1].append(self.__scene.ray_trace(camera.get_ray(row, col)))
+                    end = stats.total_intersection_tests if counting_intersections else perf_counter()
+                    costs[row - top, col - left] = end - start
+        return colors, costs
+
+
+def render_with_costs(scene, metric='intersections', num_workers=1, tile_size=32):
+    """
+    Render scene with the scalar ray tracer, measuring the cost of each pixel
+    Returns the image and a height x width array of costs
+    :param scene: Scene to render
+    :param metric: Either 'intersections' or 'time' (see CostTileRenderer)
+    :param num_workers: Number of processes rendering the image. If None, uses one per CPU core
+    :param tile_size: Side of the square tiles the image is split into
+    """
+    camera = scene.camera
+    image = Image(camera.image_height, camera.image_width)
+    costs = zeros((camera.image_height, camera.image_width))
+    tiles = split_into_tiles(camera.image_height, camera.image_width, tile_size)
+    render_tile = CostTileRenderer(scene, metric)
+    if num_workers is None:
+        num_workers = default_num_workers()
+    if num_workers > 1:
+        rendered_tiles = render_tiles_in_parallel(render_tile, tiles, num_workers)
+    else:
+        rendered_tiles = ((tile, render_tile(tile)) for tile in tiles)
+    for (top, left, bottom, right), (tile_colors, tile_costs) in rendered_tiles:
+        image.set_tile((top, left, bottom, right), tile_colors)
+        costs[top:bottom, left:right] = tile_costs
+    print("Done rendering.")
+    return image, costs
+
+
+def heatmap_pixels(costs, log_scale=True, saturation_percentile=99.5):
+    """
+    False colors of an array of costs, as a height x width x 3 array of floats between 0 and 1
+    :param costs: Cost of each pixel
+    :param log_scale: If true, colors follow the logarithm of the costs, so that cheap pixels can still be told apart
+    :param saturation_percentile: Costs above this percentile all get the color of the most expensive pixels, so that
+    a few outliers (caused by the operating system, when timing) do not make the rest of the image dark
+    """
+    values = log1p(costs) if log_scale else costs.astype(float)
+    highest = percentile(values, saturation_percentile) if values.size else 0
+    levels = values / highest if highest > 0 else zeros(values.shape)
+    stops = [i / (len(HEATMAP_COLOR_STOPS) - 1) for i in range(len(HEATMAP_COLOR_STOPS))]
+    return stack([interp(levels, stops, HEATMAP_COLOR_STOPS[:, channel]) for channel in range(3)], axis=-1)
+
+
+def heatmap_file_name(file_name, metric):
+    """Name of the heatmap saved next to an image: 'scene.png' gives 'scene_intersections_heatmap.png'"""
+    stem, extension = splitext(file_name)
+    return f'{stem}_{metric}_heatmap{extension or ".png"}'
+
+
+def render_with_heatmap(scene, file_name, metric='intersections', num_workers=1, tile_size=32):
+    """
+    Render scene, and save both the image and a false color heatmap of the cost of each pixel next to it
+    Returns the image and the array of costs
+    """
+    image, costs = render_with_costs(scene, metric, num_workers, tile_size)
+    image.save_as_png(file_name)
+    heatmap = Image(*costs.shape)
+    heatmap.set_tile((0, 0) + costs.shape, heatmap_pixels(costs))
+    heatmap.save_as_png(heatmap_file_name(file_name, metric))
+    print(f"Pixel cost ({metric}): mean {costs.mean():.4g}, max {costs.max():.4g}, total {costs.sum():.4g}")
+    return image, costs
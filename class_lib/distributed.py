@@ -0,0 +1,251 @@
+"""
+Distributed rendering: a coordinator hands out tiles of a scene over TCP to workers, possibly on other machines, and
+assembles the image from the tiles they send back
+Start a worker on another machine with: python -m class_lib.distributed HOST PORT AUTHKEY
+"""
+from multiprocessing import Process
+from multiprocessing.connection import Client, Listener
+from os import getpid, urandom
+from queue import Empty, Queue
+from socket import gethostname
+from sys import argv
+from threading import Event, Lock, Thread
+from time import monotonic, perf_counter
+
+from class_lib.imaging import Image
+from class_lib.parallel import split_into_tiles
+from class_lib.ray_packets import PacketTracer
+
+HEARTBEAT_INTERVAL = 1.0  # Seconds between two heartbeats of a worker
+POLL_INTERVAL = 0.1  # Seconds a coordinator thread waits for a message before looking for new tiles to send
+
+
+class WorkerStats:
+    """Tiles rendered by a worker, and how fast"""
+
+    def __init__(self, name):
+        self.name = name
+        self.tiles = 0
+        self.pixels = 0
+        self.busy_time = 0  # Seconds spent rendering, as measured by the worker
+        self.alive = True
+        self.__connection_time = monotonic()
+        self.connected_time = 0
+
+    def add_tile(self, tile, render_time):
+        top, left, bottom, right = tile
+        self.tiles += 1
+        self.pixels += (bottom - top) * (right - left)
+        self.busy_time += render_time
+        self.connected_time = monotonic() - self.__connection_time
+
+    @property
+    def pixels_per_second(self):
+        return self.pixels / self.busy_time if self.busy_time else 0
+
+    def __str__(self):
+        status = 'alive' if self.alive else 'lost'
+        return (f"{self.name}: {self.tiles} tiles, {self.pixels} pixels, {self.pixels_per_second:.0f} pixels/s, "
+                f"busy {self.busy_time:.1f} s of {self.connected_time:.1f} s ({status})")
+
+
+class RenderCoordinator:
+    """
+    Hands out tiles of a scene to the workers which connect to it, and assembles the image from their results
+    Each worker gets the scene once, then a few tiles at a time. Workers send heartbeats while rendering, so a worker
+    which disconnects or stays silent for longer than the heartbeat timeout is considered dead, and its unfinished
+    tiles are handed out again to the other workers. If every worker which connected is dead, and none connects within
+    the heartbeat timeout, rendering fails
+    """
+
+    MAX_TILES_IN_FLIGHT = 2  # Tiles sent to a worker before it returns any, so that it never waits for the next one
+
+    def __init__(self, scene, address=('localhost', 0), authkey=None, tile_size=32, vectorized=False,
+                 heartbeat_timeout=10.0):
+        """
+        Initialize coordinator, which starts listening for workers right away
+        :param scene: Scene to render
+        :param address: Host and port to listen on. Port 0 picks a free port (see the address property)
+        :param authkey: Secret key workers must know to connect (random if None, see the authkey property)
+        :param tile_size: Side of the square tiles the image is split into
+        :param vectorized: If true, workers trace each tile as a single packet of rays, with NumPy arrays
+        :param heartbeat_timeout: Seconds without any message after which a worker is considered dead
+        """
+        self.__scene = scene
+        self.__authkey = authkey if authkey is not None else urandom(16)
+        self.__listener = Listener(address, authkey=self.__authkey)
+        self.__tile_size = tile_size
+        self.__vectorized = vectorized
+        self.__heartbeat_timeout = heartbeat_timeout
+        self.__pending_tiles = Queue()
+        self.__results = Queue()
+        self.__done_tiles = set()
+        self.__finished = Event()
+        self.__threads = []
+        self.__names_lock = Lock()
+        self.worker_stats = {}
+
+    @property
+    def address(self):
+        return self.__listener.address
+
+    @property
+    def authkey(self):
+        return self.__authkey
+
+    def __accept_workers(self):
+        while not self.__finished.is_set():
+            try:
+                connection = self.__listener.accept()
+            except OSError:
+                if self.__finished.is_set():
+                    return  # Listener was closed
+                continue  # Failed handshake (wrong authkey, for example)
+            thread = Thread(target=self.__serve_worker, args=(connection,), daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def __register_worker(self, name):
+        with self.__names_lock:
+            unique_name, suffix = name, 1
+            while unique_name in self.worker_stats:
+                suffix += 1
+                unique_name = f'{name}#{suffix}'
+            stats = self.worker_stats[unique_name] = WorkerStats(unique_name)
+        return stats
+
+    def __serve_worker(self, connection):
+        """Send tiles to a worker and receive its results, until the image is done or the worker dies"""
+        tiles_in_flight = set()
+        stats = None
+        try:
+            _, name = connection.recv()
+            stats = self.__register_worker(name)
+            connection.send(('scene', self.__scene, self.__vectorized))
+            last_message_time = monotonic()
+            while not self.__finished.is_set():
+                while len(tiles_in_flight) < RenderCoordinator.MAX_TILES_IN_FLIGHT:
+                    try:
+                        tile = self.__pending_tiles.get_nowait()
+                    except Empty:
+                        break
+                    if tile not in self.__done_tiles:  # Tiles handed out again might have been finished meanwhile
+                        connection.send(('tile', tile))
+                        tiles_in_flight.add(tile)
+                if connection.poll(POLL_INTERVAL):
+                    message = connection.recv()
+                    last_message_time = monotonic()
+                    if message[0] == 'result':
+                        _, tile, colors, render_time = message
+                        tiles_in_flight.discard(tile)
+                        stats.add_tile(tile, render_time)
+                        self.__results.put((tile, colors))
+                elif monotonic() - last_message_time > self.__heartbeat_timeout:
+                    raise TimeoutError
+            connection.send(('done',))
+        except (EOFError, OSError, TimeoutError):
+            if stats is not None:
+                stats.alive = False
+                print(f"Lost worker {stats.name}, handing out its {len(tiles_in_flight)} tiles again")
+            for tile in tiles_in_flight:
+                self.__pending_tiles.put(tile)
+        finally:
+            connection.close()
+
+    def render(self):
+        """
+        Render the scene with the workers which are, or will be, connected. Returns the image
+        Waits for the first worker as long as it takes. Raises RuntimeError if every worker is lost before the image is
+        done, and no other one sends a result within the heartbeat timeout
+        """
+        camera = self.__scene.camera
+        image = Image(camera.image_height, camera.image_width)
+        tiles = split_into_tiles(camera.image_height, camera.image_width, self.__tile_size)
+        for tile in tiles:
+            self.__pending_tiles.put(tile)
+        accepting_thread = Thread(target=self.__accept_workers, daemon=True)
+        accepting_thread.start()
+        print(f"Waiting for workers on {self.address[0]}:{self.address[1]}")
+
+        try:
+            while len(self.__done_tiles) < len(tiles):
+                try:
+                    tile, colors = self.__results.get(timeout=self.__heartbeat_timeout)
+                except Empty:
+                    workers = list(self.worker_stats.values())
+                    if workers and not any(stats.alive for stats in workers):
+                        raise RuntimeError(f"Lost every worker, with {len(tiles) - len(self.__done_tiles)} tiles left "
+                                           f"to render")
+                    continue
+                if tile in self.__done_tiles:
+                    continue  # Tile was rendered by two workers
+                image.set_tile(tile, colors)
+                self.__done_tiles.add(tile)
+                if len(tiles) > 50 and len(self.__done_tiles) % 50 == 0:
+                    print(f"Rendered tile {len(self.__done_tiles)}/{len(tiles)}")  # To give an idea of the time left
+        finally:
+            self.__finished.set()
+            self.__listener.close()
+            for thread in self.__threads:
+                thread.join(timeout=self.__heartbeat_timeout)
+        print("Done rendering.")
+        for stats in self.worker_stats.values():
+            print(stats)
+        return image
+
+
+def _send_heartbeats(connection, send_lock, stopped):
+    while not stopped.wait(HEARTBEAT_INTERVAL):
+        try:
+            with send_lock:
+                connection.send(('heartbeat',))
+        except OSError:
+            return
+
+
+def run_worker(address, authkey, name=None):
+    """
+    Connect to a coordinator and render the tiles it sends, until the image is done
+    :param address: Host and port of the coordinator
+    :param authkey: Secret key of the coordinator
+    :param name: Name of the worker in the coordinator's statistics (host name and process id by default)
+    """
+    connection = Client(tuple(address), authkey=authkey)
+    send_lock = Lock()
+    stopped = Event()
+    try:
+        connection.send(('hello', name or f'{gethostname()}-{getpid()}'))
+        _, scene, vectorized = connection.recv()
+        render_tile = PacketTracer(scene).render_tile if vectorized else scene.render_tile
+        Thread(target=_send_heartbeats, args=(connection, send_lock, stopped), daemon=True).start()
+        while True:
+            message = connection.recv()
+            if message[0] != 'tile':
+                break
+            tile = message[1]
+            start_time = perf_counter()
+            colors = render_tile(tile)
+            with send_lock:
+                connection.send(('result', tile, colors, perf_counter() - start_time))
+    except (EOFError, OSError):
+        pass  # Coordinator is gone
+    finally:
+        stopped.set()
+        connection.close()
+
+
+def render_on_local_workers(scene, num_workers=2, tile_size=32, vectorized=False):
+    """Render scene with a coordinator and worker processes on this machine (mostly to try distributed rendering)"""
+    coordinator = RenderCoordinator(scene, tile_size=tile_size, vectorized=vectorized)
+    workers = [Process(target=run_worker, args=(coordinator.address, coordinator.authkey, f'local-{i}'))
+               for i in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    image = coordinator.render()
+    for worker in workers:
+        worker.join()
+    return image
+
+
+if __name__ == '__main__':
+    run_worker((argv[1], int(argv[2])), argv[3].encode())
@@ -0,0 +1,170 @@
+from abc import ABC, abstractmethod
+from os import remove
+from struct import pack
+from zlib import compressobj, crc32
+
+from numpy import clip, float32, rint, uint8, zeros
+from numpy.lib.format import open_memmap
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def as_uint8(pixels):
+    """Pixel colors mapped from floats between 0 and 1 to ints between 0 and 255"""
+    scaled_up_values = rint(pixels * 255)
+    return clip(scaled_up_values, 0, 255, out=scaled_up_values).astype(uint8)
+
+
+def png_chunk(chunk_type, data):
+    """PNG chunk of given type (such as b'IDAT') and data, with its length and checksum"""
+    return pack('>I', len(data)) + chunk_type + data + pack('>I', crc32(chunk_type + data))
+
+
+def up_filtered_rows(pixels, previous_row=None):
+    """
+    Rows of RGB bytes (height x width x 3 array of 8 bit colors) as PNG image data with the 'Up' filter: each row
+    minus the one above, preceded by the filter type
+    :param pixels: Rows to filter
+    :param previous_row: Row above the first one (as bytes of the flattened row), if the rows continue an image
+    """
+    rows = pixels.reshape((pixels.shape[0], -1))
+    differences = zeros((rows.shape[0], rows.shape[1] + 1), dtype=uint8)
+    differences[:, 0] = 2
+    differences[:, 1:] = rows
+    differences[1:, 1:] -= rows[:-1]
+    if previous_row is not None:
+        differences[0, 1:] -= previous_row
+    return differences.tobytes()
+
+
+class _StreamingWriter(ABC):
+    """
+    Writes the rows of an image to a file as soon as they are given, from top to bottom
+    The file is only finished once every row is written. Otherwise, closing the writer removes it and raises
+    ValueError, so that an interrupted render does not leave a truncated image which looks valid
+    """
+
+    def __init__(self, file_name, height, width):
+        self.file_name = file_name
+        self.height = height
+        self.width = width
+        self.rows_written = 0
+        self.__closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, *_):
+        if exception_type is None:
+            self.close()
+        elif not self.__closed:
+            self.__closed = True
+            self.__abort()
+
+    def write_rows(self, pixels):
+        """Append rows, given as an array of floats between 0 and 1, with one row of RGB colors per row of the image"""
+        if pixels.shape[1] != self.width or self.rows_written + pixels.shape[0] > self.height:
+            raise ValueError(f"Rows of shape {pixels.shape} do not fit in the rest of a {self.height} x {self.width} "
+                             f"image ({self.rows_written} rows written)")
+        self._write(pixels)
+        self.rows_written += pixels.shape[0]
+
+    def close(self):
+        """Finish the file. Raises ValueError, and removes the file, if some rows were not written"""
+        if self.__closed:
+            return
+        self.__closed = True
+        if self.rows_written < self.height:
+            self.__abort()
+            raise ValueError(f"Only {self.rows_written} of the {self.height} rows of {self.file_name} were written")
+        self._finish()
+
+    def __abort(self):
+        self._release()
+        remove(self.file_name)
+
+    @abstractmethod
+    def _write(self, pixels):
+        """Write rows, which fit in the rest of the image"""
+
+    @abstractmethod
+    def _finish(self):
+        """Write the end of the file, once every row is written, and close it"""
+
+    @abstractmethod
+    def _release(self):
+        """Close the file, without finishing it"""
+
+
+class PpmWriter(_StreamingWriter):
+    """Writes a binary PPM (P6) file"""
+
+    def __init__(self, file_name, height, width):
+        super().__init__(file_name, height, width)
+        self.__file = open(file_name, 'wb')
+        self.__file.write(f'P6 {width} {height}\n255\n'.encode())
+
+    def _write(self, pixels):
+        self.__file.write(as_uint8(pixels).tobytes())
+
+    def _finish(self):
+        self.__file.close()
+
+    def _release(self):
+        self.__file.close()
+
+
+class PngWriter(_StreamingWriter):
+    """Writes a PNG file, compressing rows as they are given"""
+
+    def __init__(self, file_name, height, width):
+        super().__init__(file_name, height, width)
+        self.__file = open(file_name, 'wb')
+        self.__file.write(PNG_SIGNATURE + png_chunk(b'IHDR', pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        self.__compressor = compressobj()
+        self.__last_row = None  # Needed to filter the first of the next rows
+
+    def _write(self, pixels):
+        rows = as_uint8(pixels)
+        data = self.__compressor.compress(up_filtered_rows(rows, self.__last_row))
+        self.__last_row = rows[-1].reshape(-1)
+        if data:
+            self.__file.write(png_chunk(b'IDAT', data))
+
+    def _finish(self):
+        self.__file.write(png_chunk(b'IDAT', self.__compressor.flush()) + png_chunk(b'IEND', b''))
+        self.__file.close()
+
+    def _release(self):
+        self.__file.close()
+
+
+class RawWriter(_StreamingWriter):
+    """
+    Writes the float pixel colors, without rounding them, to a memory-mapped NumPy array file (.npy), which can be read
+    back with numpy.load(file_name, mmap_mode='r')
+    """
+
+    def __init__(self, file_name, height, width):
+        super().__init__(file_name, height, width)
+        self.__pixels = open_memmap(file_name, mode='w+', dtype=float32, shape=(height, width, 3))
+
+    def _write(self, pixels):
+        self.__pixels[self.rows_written:self.rows_written + pixels.shape[0]] = pixels
+        self.__pixels.flush()  # So that written pages can be dropped from memory
+
+    def _finish(self):
+        self.__pixels.flush()
+        self.__pixels = None
+
+    def _release(self):
+        self.__pixels = None  # Unmaps the file, once no other reference to the array is left
+
+
+def image_writer(file_name, height, width):
+    """Streaming writer for a .png, .ppm (binary) or .npy (raw floats) file"""
+    extension = file_name.lower().rsplit('.', 1)[-1]
+    writers = {'png': PngWriter, 'ppm': PpmWriter, 'npy': RawWriter}
+    if extension not in writers:
+        raise ValueError(f"Unsupported image file type: '{file_name}'. Use .png, .ppm or .npy")
+    return writers[extension](file_name, height, width)
@@ -1,48 +1,86 @@
-from math import sqrt, sin, cos
+from contextlib import nullcontext
+from math import ceil, floor, sqrt, sin, cos
 
 from PIL import Image as PillowImage
 from basics import Vector
-from numpy import array, uint8
+from numpy import array, float32, full, ndarray, zeros
 
-from class_lib.color import BLACK
+from class_lib.antialiasing import adaptive_supersampling
+from class_lib.bounding_volumes import BoundingVolumeHierarchy
+from class_lib.color import BLACK, Color, ColorAccumulator
 from class_lib.coordinate_system import CoordinateSystem
+from class_lib.image_writers import PpmWriter, as_uint8, image_writer
+from class_lib.kernels import DEFAULT_BACKEND
 from class_lib.light import Ray
-from class_lib.useful_functions import reflected_vector
-from globals import MAX_RECURSION_COUNTER
+from class_lib.occluders import OccluderCache
+from class_lib.parallel import split_into_tiles, render_tiles_in_parallel, render_tiles_in_order, \
+    default_num_workers
+from class_lib.progressive import progressive_levels
+from class_lib.ray_packets import PacketTracer
+from class_lib.render_stats import CollectingTileRenderer, RenderStats
+from class_lib.solid_objects import Hit
+from class_lib.useful_functions import hashed_random, reflected_vector, as_array, unit_rows
+from globals import MAX_RECURSION_COUNTER, MIN_DIST
 
 
 class Image:
-    """2D-Array of color pixels"""
+    """2D-Array of color pixels, stored as a contiguous height x width x 3 array of floats (RGB)"""
 
     def __init__(self, height=320, width=200):
         self.__width = width
         self.__height = height
-        self.__pixels = [[None for _ in range(width)] for _ in range(height)]
+        self.__pixels = zeros((height, width, 3), dtype=float32)  # Pixels which are not set are black
+
+    @property
+    def height(self):
+        return self.__height
+
+    @property
+    def width(self):
+        return self.__width
+
+    @property
+    def pixels(self):
+        """Array of pixel colors (not a copy)"""
+        return self.__pixels
 
     def get_pixel(self, row, column):
         """Gets pixel color from given row and column"""
-        pix = self.__pixels[row][column]
-        if pix:
-            return pix
-        return BLACK  # Default color returned if pixel has not been set
+        return Color(*self.__pixels[row, column].tolist())
 
     def set_pixel(self, row, column, color):
         """Sets pixel to given color"""
-        self.__pixels[row][column] = color
+        self.__pixels[row, column] = (color.red, color.green, color.blue)
+
+    def set_tile(self, tile, colors):
+        """
+        Sets all pixels inside tile (top, left, bottom, right)
+        :param tile: Tile (top, left, bottom, right), bottom and right being exclusive
+        :param colors: Either an array of colors with the tile's shape, or lists of Color objects, row by row
+        """
+        top, left, bottom, right = tile
+        if not isinstance(colors, ndarray):
+            colors = [[(color.red, color.green, color.blue) for color in row] for row in colors]
+        self.__pixels[top:bottom, left:right] = colors
+
+    def as_uint8_array(self):
+        """Pixel colors mapped from floats between 0 and 1 to ints between 0 and 255"""
+        return as_uint8(self.__pixels)
 
     def as_pillow_image(self):
-        new_pixel_map = [[self.get_pixel(i, j).as_int_tuple() for j in range(self.__width)] for i in
-                         range(self.__height)]
-        pixel_array = array(new_pixel_map, dtype=uint8)
-        return PillowImage.fromarray(pixel_array)
+        return PillowImage.fromarray(self.as_uint8_array())
 
     def save_as_png(self, file_name):
         """Save image as png file"""
         new_image = self.as_pillow_image()
         new_image.save(file_name)
 
-    def save_as_ppm(self, file_name):
-        """Save image as PPM file"""
+    def save_as_ppm(self, file_name, binary=False):
+        """Save image as PPM file, either plain (text) or binary, which is much smaller and faster to write"""
+        if binary:
+            with PpmWriter(file_name, self.__height, self.__width) as writer:
+                writer.write_rows(self.__pixels)
+            return
         with open(file_name, 'w') as img_file:
             # Write header
             # Indicate that it is a ppm file, and give width and height
@@ -50,20 +88,21 @@ class Image:
             # Maximum value
             img_file.write('255\n')
             # Write values
-            for i in range(self.__height):
-                for j in range(self.__width):
-                    img_file.write(self.get_pixel(i, j).ppm_string() + '\t')
-                img_file.write('\n')
+            for row in self.as_uint8_array().tolist():
+                img_file.write(''.join(f'{r} {g} {b}\t' for r, g, b in row) + '\n')
 
 
 class Camera:
     """Camera positioned in 3d space"""
 
+    __ray_grid = None  # Unit directions of the rays through every pixel, once cached (see cache_ray_grid)
+
     def __init__(self, resolution=(20, 30), position=Vector(10, 0, 0), direction=Vector(-1, 0, 0), zoom=1,
                  tilt_angle=0):
         """Initialize new camera. Attention: Resolution is given like a matrix = height, width"""
         self.__resolution = resolution
         self.__position = position
+        self.__given_direction = direction  # Normalizing a unit vector again may change it, so it is kept as given
         self.__direction = direction.unit
         self.__zoom = zoom
         self.__tilt_angle = tilt_angle
@@ -77,11 +116,47 @@ class Camera:
 
         i_prime, j_prime, k_prime = CoordinateSystem.unit_base_axis(self.__direction, self.__tilt_angle)
 
+        # Direction increments from one row to the next, and from one column to the next
         self.v_vertical = -delta * k_prime
         self.v_horizontal = -delta * j_prime
         self.offset_vertical = r_ver / 2
         self.offset_horizontal = r_hor / 2
 
+        # Pixel position is split into a part which only depends on the row, and one which only depends on the column
+        screen_center = self.__position + self.__direction
+        self.__row_positions = [screen_center + (row - self.offset_vertical) * self.v_vertical
+                                for row in range(self.image_height)]
+        self.__column_offsets = [(column - self.offset_horizontal) * self.v_horizontal
+                                 for column in range(self.image_width)]
+        self.__row_positions_array = array([as_array(p) for p in self.__row_positions]).reshape((-1, 3))
+        self.__column_offsets_array = array([as_array(c) for c in self.__column_offsets]).reshape((-1, 3))
+
+    def __getstate__(self):
+        """Attributes of the camera, without the cached ray grid, which is quicker to compute again than to send"""
+        return {name: value for name, value in self.__dict__.items() if name != '_Camera__ray_grid'}
+
+    @property
+    def position(self):
+        return self.__position
+
+    @property
+    def direction(self):
+        return self.__direction
+
+    @property
+    def zoom(self):
+        return self.__zoom
+
+    @property
+    def tilt_angle(self):
+        return self.__tilt_angle
+
+    @property
+    def parameters(self):
+        """Arguments the camera was created with, as a dict, so that it can be created again exactly the same"""
+        return {'resolution': tuple(self.__resolution), 'position': self.__position,
+                'direction': self.__given_direction, 'zoom': self.__zoom, 'tilt_angle': self.__tilt_angle}
+
     @property
     def image_height(self):
         return self.__resolution[0]
@@ -90,83 +165,423 @@ class Camera:
     def image_width(self):
         return self.__resolution[1]
 
+    def with_resolution(self, resolution):
+        """Camera with the same position, direction, zoom and tilt, but a different resolution (height, width)"""
+        return Camera(**{**self.parameters, 'resolution': resolution})
+
     def __pixel_pos(self, row, column) -> Vector:
         """Pixel position given its row and column"""
-        return self.__position + self.__direction + (row - self.offset_vertical) * self.v_vertical + (
-                column - self.offset_horizontal) * self.v_horizontal
+        return self.__row_positions[row] + self.__column_offsets[column]
 
-    def get_ray(self, row, column):
-        """Ray from camera through given pixel"""
+    def get_ray(self, row, column, row_offset=0, column_offset=0):
+        """
+        Ray from camera through given pixel
+        :param row_offset: Offset from the pixel center, in pixels (between -0.5 and 0.5 to stay inside the pixel)
+        :param column_offset: Same as row_offset, for columns
+        """
         p0 = self.__position
-        direction = self.__pixel_pos(row, column) - self.__position
+        pixel_position = self.__pixel_pos(row, column)
+        if row_offset or column_offset:
+            pixel_position = pixel_position + row_offset * self.v_vertical + column_offset * self.v_horizontal
+        direction = pixel_position - self.__position
         return Ray(p0, direction)
 
+    def __compute_ray_directions(self, tile):
+        top, left, bottom, right = tile
+        # Same order of operations as get_ray, so that rounding errors are the same as well
+        pixel_positions = self.__row_positions_array[top:bottom, None, :] + \
+                          self.__column_offsets_array[None, left:right, :]
+        return unit_rows((pixel_positions - as_array(self.__position)).reshape((-1, 3)))
+
+    def pixel_ray_directions(self, rows, columns):
+        """Unit directions of the rays from camera through the pixels given by arrays of rows and columns"""
+        pixel_positions = self.__row_positions_array[rows] + self.__column_offsets_array[columns]
+        return unit_rows(pixel_positions - as_array(self.__position))
+
+    def subpixel_ray_directions(self, rows, columns, row_offsets, column_offsets):
+        """
+        Unit directions of the rays from camera through points of the pixels given by arrays of rows and columns
+        :param row_offsets: Offsets of the points from the pixel centers, in pixels (between -0.5 and 0.5)
+        :param column_offsets: Same as row_offsets, for columns
+        """
+        pixel_positions = self.__row_positions_array[rows] + self.__column_offsets_array[columns] + \
+            row_offsets[:, None] * as_array(self.v_vertical) + column_offsets[:, None] * as_array(self.v_horizontal)
+        return unit_rows(pixel_positions - as_array(self.__position))
+
+    def cache_ray_grid(self):
+        """Compute the rays through every pixel once, and keep them for the later renders with this camera"""
+        if self.__ray_grid is None:
+            self.__ray_grid = self.__compute_ray_directions(
+                (0, 0, self.image_height, self.image_width)).reshape((self.image_height, self.image_width, 3))
+
+    def ray_directions(self, tile=None):
+        """
+        Unit directions of the rays from camera through each pixel, row by row (one direction per row of the array)
+        :param tile: Tile (top, left, bottom, right). If None, gives the directions for the whole image
+        """
+        if tile is None:
+            tile = (0, 0, self.image_height, self.image_width)
+        if self.__ray_grid is not None:
+            top, left, bottom, right = tile
+            return self.__ray_grid[top:bottom, left:right].reshape((-1, 3))
+        return self.__compute_ray_directions(tile)
+
+    def pixels_around_points(self, points):
+        """
+        Smallest tile (top, left, bottom, right) containing every pixel through which the camera sees one of the given
+        points (array with one point per row), with a margin of one pixel. Since the projection of a convex solid is the
+        convex hull of the projections of its vertices, the tile around the corners of a box contains the whole box
+        Gives the whole image if a point is not in front of the camera, and None if the points are out of the image
+        """
+        whole_image = (0, 0, self.image_height, self.image_width)
+        relative_positions = points - as_array(self.__position)
+        depths = relative_positions @ as_array(self.__direction)
+        if (depths < MIN_DIST).any():
+            return whole_image
+        v_vertical, v_horizontal = as_array(self.v_vertical), as_array(self.v_horizontal)
+        rows = self.offset_vertical + relative_positions @ v_vertical / (depths * (v_vertical @ v_vertical))
+        columns = self.offset_horizontal + relative_positions @ v_horizontal / (depths * (v_horizontal @ v_horizontal))
+        top, bottom = max(0, floor(rows.min()) - 1), min(self.image_height, ceil(rows.max()) + 2)
+        left, right = max(0, floor(columns.min()) - 1), min(self.image_width, ceil(columns.max()) + 2)
+        if top >= bottom or left >= right:
+            return None
+        return top, left, bottom, right
+
+    def iter_ray_directions(self, tile_size=32):
+        """Yields each tile of the image with the unit directions of the rays through its pixels"""
+        for tile in split_into_tiles(self.image_height, self.image_width, tile_size):
+            yield tile, self.ray_directions(tile)
+
 
 class Scene:
     """Collection of objects, light sources, and a camera"""
 
-    def __init__(self, camera, objects, illumination):
+    def __init__(self, camera, objects, illumination, use_bvh=False, min_ray_weight=0.0, russian_roulette=False,
+                 kernel_backend=DEFAULT_BACKEND, roulette_seed=0):
+        """
+        Initialize new scene
+        :param camera: Camera
+        :param objects: Solid objects
+        :param illumination: Illumination
+        :param use_bvh: If true, rays are only tested against objects whose bounding boxes they cross, which is faster
+        for scenes with many objects
+        :param min_ray_weight: Reflected and refracted rays whose weight (largest fraction of the color they see which
+        can reach the camera, given the reflective indexes and refractive attenuations along their path) is below
+        this are not traced. About 0.5 / 255 only drops rays which could not change an 8-bit color, unless the
+        colors they see are brighter than white
+        :param russian_roulette: If true, rays whose weight is below min_ray_weight are still traced with a probability
+        proportional to their weight, and their color is boosted accordingly, so that colors are right on average
+        :param roulette_seed: Seed of the random choices of the Russian roulette. Each choice only depends on it and on
+        the ray, so the same scene is always rendered the same, whatever the engine's tiles, processes or order
+        :param kernel_backend: Name of the backend of the kernels intersecting packets of rays with solids ('python',
+        'numpy' or 'numba', see class_lib.kernels). Falls back to 'numpy' if it cannot be loaded when rays are traced
+        """
         self.__camera = camera
         self.__objects = objects
         self.__background_color = BLACK
         self.__illumination = illumination
+        self.__use_bvh = use_bvh
+        self.__min_ray_weight = min_ray_weight
+        self.__russian_roulette = russian_roulette
+        self.__kernel_backend = kernel_backend
+        self.__roulette_seed = roulette_seed
+        self.__bvh = None
+        self.__occluder_cache = None
+
+    @property
+    def camera(self):
+        return self.__camera
+
+    def with_camera(self, camera):
+        """Scene with the same objects, illumination and options, seen through another camera"""
+        return self.with_options(camera=camera)
+
+    def with_options(self, **options):
+        """
+        Scene with the same objects and illumination, and the same camera and options as this one, except those given
+        (camera, or any option of the constructor, such as use_bvh or min_ray_weight)
+        """
+        arguments = {'camera': self.__camera, 'use_bvh': self.__use_bvh, 'min_ray_weight': self.__min_ray_weight,
+                     'russian_roulette': self.__russian_roulette, 'kernel_backend': self.__kernel_backend,
+                     'roulette_seed': self.__roulette_seed}
+        unknown_options = set(options) - set(arguments)
+        if unknown_options:
+            raise TypeError(f"Unknown scene options: {', '.join(sorted(unknown_options))}")
+        arguments.update(options)
+        return Scene(objects=self.__objects, illumination=self.__illumination, **arguments)
+
+    @property
+    def objects(self):
+        return self.__objects
+
+    @property
+    def use_bvh(self):
+        return self.__use_bvh
+
+    @property
+    def min_ray_weight(self):
+        return self.__min_ray_weight
 
-    def ray_is_obstructed(self, ray, light_source_distance):
+    @property
+    def russian_roulette(self):
+        return self.__russian_roulette
+
+    @property
+    def kernel_backend(self):
+        return self.__kernel_backend
+
+    @property
+    def roulette_seed(self):
+        return self.__roulette_seed
+
+    @property
+    def illumination(self):
+        return self.__illumination
+
+    @property
+    def background_color(self):
+        return self.__background_color
+
+    @property
+    def bounding_volume_hierarchy(self):
+        """Bounding volume hierarchy of the objects (built once, on first use), or None if it is not used"""
+        return self.build_bounding_volume_hierarchy()
+
+    def build_bounding_volume_hierarchy(self):
+        """Build the bounding volume hierarchy now, if it is used and not built yet. Returns it, or None"""
+        if self.__use_bvh and self.__bvh is None:
+            self.__bvh = BoundingVolumeHierarchy(self.__objects)
+        return self.__bvh
+
+    @property
+    def occluder_cache(self):
+        """Cache of the objects which cast shadows from each light source (created on first use)"""
+        if self.__occluder_cache is None:
+            self.__occluder_cache = OccluderCache(self.__objects, self.bounding_volume_hierarchy)
+        return self.__occluder_cache
+
+    def ray_is_obstructed(self, ray, light_source_distance, light_source=None):
         """
         Returns true if there is an object obstructing the light source and causing a shadow
+        If the light source is given, its most likely occluders are tested first
         """
+        if light_source is not None:
+            return self.occluder_cache.ray_is_obstructed(ray, light_source_distance, light_source)
+        if self.__use_bvh:
+            return self.bounding_volume_hierarchy.ray_is_obstructed(ray, light_source_distance)
         for obj in self.__objects:
             distance = obj.intersection_distance(ray)
             if distance and distance <= light_source_distance:
                 return True
         return False
 
-    def __nearest_object_hit_by_ray(self, ray):
+    def __nearest_hit(self, ray):
         """
         Find closest object which intersects ray
-        Returns object itself, and its distance to ray origin
+        Returns a Hit, which is also the chip of material at the point hit, or None if the ray hits nothing
         """
-        save_object_index = None
-        minimum_distance = -1
-        for obj_index, obj in enumerate(self.__objects):
-            distance = obj.intersection_distance(ray)
-            if not distance:
-                continue
-            if distance < minimum_distance or minimum_distance < 0:
-                minimum_distance = distance
-                save_object_index = obj_index
-        if save_object_index is not None:
-            return self.__objects[save_object_index], minimum_distance
-        return None, None
-
-    def render_image(self):
-        """Produce image"""
+        if self.__use_bvh:
+            hit = self.bounding_volume_hierarchy.nearest_hit(ray)
+        else:
+            hit = Hit()
+            for obj_index, obj in enumerate(self.__objects):
+                obj.record_hit(ray, hit, obj_index)
+        if hit.obj is None:
+            return None
+        hit.set_surface(ray)
+        return hit
+
+    def render_tile(self, tile):
+        """Colors of all pixels inside tile (top, left, bottom, right), row by row"""
+        top, left, bottom, right = tile
+        return [[self.ray_trace(self.__camera.get_ray(row, col)) for col in range(left, right)]
+                for row in range(top, bottom)]
+
+    def render_image(self, num_workers=1, tile_size=32, vectorized=False, tile_cache=None, collect_stats=False):
+        """
+        Produce image
+        :param num_workers: Number of processes rendering the image. If None, uses one per CPU core
+        :param tile_size: Side of the square tiles the image is split into when rendering in parallel or vectorized
+        :param vectorized: If true, each tile is traced as a single packet of rays, with NumPy arrays
+        :param tile_cache: Optional TileCache. Tiles which cannot be affected by the changes made to the scene since
+        they were cached are reused, the others are traced with NumPy arrays (as if vectorized was true)
+        :param collect_stats: If true, returns the image together with RenderStats (ray and intersection counts,
+        recursion depths and time per stage). Tiles traced by a tile cache in other processes are not counted
+        """
+        if collect_stats:
+            stats = RenderStats()
+            with stats.collecting(), stats.timing('total'):
+                with stats.timing('acceleration structures'):
+                    self.build_bounding_volume_hierarchy()
+                image = self.render_image(num_workers, tile_size, vectorized, tile_cache)
+            return image, stats
+        if num_workers is None:
+            num_workers = default_num_workers()
+        if num_workers > 1 or vectorized or tile_cache is not None:
+            return self.__render_image_by_tiles(num_workers, tile_size, vectorized, tile_cache)
+
         image = Image(self.__camera.image_height, self.__camera.image_width)
 
-        # Loop through all pixels
-        # TODO: Split up this loop between cores, to make program more efficient.
-        #  Or should I actually create different images, and then merge them at the end?
-        for row in range(self.__camera.image_height):
-            if self.__camera.image_height > 200 and (row + 1) % 50 == 0:
-                print(f"Rendering row {row + 1}/{self.__camera.image_height}")  # To give an idea of the time left
-            for col in range(self.__camera.image_width):
-                ray = self.__camera.get_ray(row, col)
-                pix_color = self.ray_trace(ray)
-                image.set_pixel(row, col, pix_color)
+        stats = RenderStats.active
+        with stats.timing('tracing') if stats is not None else nullcontext():
+            # Loop through all pixels
+            for row in range(self.__camera.image_height):
+                if self.__camera.image_height > 200 and (row + 1) % 50 == 0:
+                    print(f"Rendering row {row + 1}/{self.__camera.image_height}")  # To give an idea of the time left
+                for col in range(self.__camera.image_width):
+                    ray = self.__camera.get_ray(row, col)
+                    pix_color = self.ray_trace(ray)
+                    image.set_pixel(row, col, pix_color)
         print("Done rendering.")
         return image
 
-    def __get_ambient_light(self, chip):
-        return chip.material.ambient_light_reflectivity ** self.__illumination.ambient_light.intensity
+    def render_to_file(self, file_name, num_workers=1, tile_size=32, vectorized=False):
+        """
+        Produce image and write it to file one band of tiles at a time, as soon as the band is finished, so that memory
+        use depends on the width of the image, but not on its height
+        :param file_name: Name of a .png, .ppm (binary) or .npy (memory-mapped array of float colors) file
+        :param num_workers: Number of processes rendering the image. If None, uses one per CPU core
+        :param tile_size: Side of the square tiles the image is split into, and height of the bands written
+        :param vectorized: If true, each tile is traced as a single packet of rays, with NumPy arrays
+        """
+        height, width = self.__camera.image_height, self.__camera.image_width
+        if num_workers is None:
+            num_workers = default_num_workers()
+        tiles = split_into_tiles(height, width, tile_size)  # Row by row, so bands are finished from top to bottom
+        render_tile = PacketTracer(self).render_tile if vectorized else self.render_tile
+        if num_workers > 1:
+            rendered_tiles = render_tiles_in_order(render_tile, tiles, num_workers)
+        else:
+            rendered_tiles = ((tile, render_tile(tile)) for tile in tiles)
+        with image_writer(file_name, height, width) as writer:
+            band = None
+            for (top, left, bottom, right), colors in rendered_tiles:
+                if left == 0:
+                    band = Image(bottom - top, width)
+                band.set_tile((0, left, bottom - top, right), colors)
+                if right == width:
+                    writer.write_rows(band.pixels)
+                    if height > 200 and (bottom // tile_size) % 10 == 0:
+                        print(f"Rendered row {bottom}/{height}")  # To give an idea of the time left
+        print("Done rendering.")
+
+    def render_progressively(self, initial_step=8, color_threshold=0.05, vectorized=False):
+        """
+        Produce a quick preview of the image, then refine it. Yields an image at each refinement level
+        The first level only traces one pixel every initial_step rows and columns, and interpolates the others. Each
+        level halves the step, but only traces pixels near samples which hit different objects or differ in color
+        :param initial_step: Step between traced pixels in the first level (rounded down to a power of two)
+        :param color_threshold: Maximum difference in any color component between samples which are interpolated
+        :param vectorized: If true, pixels of each level are traced as a single packet of rays, with NumPy arrays
+        """
+        sample_pixels = self.__sample_pixels_vectorized if vectorized else self.__sample_pixels
+        height, width = self.__camera.image_height, self.__camera.image_width
+        for colors in progressive_levels(height, width, sample_pixels, initial_step, color_threshold):
+            image = Image(height, width)
+            image.set_tile((0, 0, height, width), colors)
+            yield image
+
+    def __sample_pixels(self, rows, columns):
+        """Colors of the pixels given by arrays of rows and columns, and index of the object hit (-1 if none)"""
+        object_indexes = {id(obj): obj_index for obj_index, obj in enumerate(self.__objects)}
+        colors = zeros((len(rows), 3))
+        indexes = zeros(len(rows), dtype=int)
+        for i, (row, column) in enumerate(zip(rows.tolist(), columns.tolist())):
+            color, nearest_object, _ = self.__ray_trace_with_object(self.__camera.get_ray(row, column))
+            colors[i] = (color.red, color.green, color.blue)
+            indexes[i] = object_indexes[id(nearest_object)] if nearest_object is not None else -1
+        return colors, indexes
+
+    def __sample_pixels_vectorized(self, rows, columns):
+        """Vectorized version of __sample_pixels"""
+        directions = self.__camera.pixel_ray_directions(rows, columns)
+        initial_points = full(directions.shape, as_array(self.__camera.position))
+        return PacketTracer(self).ray_trace_with_objects(initial_points, directions)
+
+    def render_antialiased(self, max_samples=16, color_threshold=0.05, normal_threshold=0.1, vectorized=False):
+        """
+        Produce image, anti-aliased by adaptive supersampling: every pixel is traced once, then pixels which see a
+        different object, normal or color than a neighbour get more rays through random points of the pixel, up to
+        max_samples (see antialiasing.adaptive_supersampling)
+        :param max_samples: Maximum number of rays per pixel
+        :param color_threshold: Maximum difference in any color component between neighbours which are not supersampled
+        :param normal_threshold: Maximum difference between the normals of neighbours which are not supersampled (1
+        minus the cosine of the angle between them)
+        :param vectorized: If true, rays are traced in packets, with NumPy arrays
+        """
+        sample_points = self.__sample_subpixels_vectorized if vectorized else self.__sample_subpixels
+        height, width = self.__camera.image_height, self.__camera.image_width
+        colors, sample_counts = adaptive_supersampling(height, width, sample_points, max_samples, color_threshold,
+                                                       normal_threshold)
+        print(f"Done rendering ({sample_counts.sum() / sample_counts.size:.2f} rays per pixel).")
+        image = Image(height, width)
+        image.set_tile((0, 0, height, width), colors)
+        return image
+
+    def __sample_subpixels(self, rows, columns, row_offsets, column_offsets):
+        """
+        Colors seen through the given points of the pixels given by arrays of rows and columns, index of the object
+        seen (-1 if none) and normal of its surface (zero if none)
+        """
+        object_indexes = {id(obj): obj_index for obj_index, obj in enumerate(self.__objects)}
+        colors = zeros((len(rows), 3))
+        indexes = zeros(len(rows), dtype=int)
+        normals = zeros((len(rows), 3))
+        for i, pixel in enumerate(zip(rows.tolist(), columns.tolist(), row_offsets.tolist(), column_offsets.tolist())):
+            color, nearest_object, normal = self.__ray_trace_with_object(self.__camera.get_ray(*pixel))
+            colors[i] = (color.red, color.green, color.blue)
+            if nearest_object is not None:
+                indexes[i] = object_indexes[id(nearest_object)]
+                normals[i] = (normal.x, normal.y, normal.z)
+            else:
+                indexes[i] = -1
+        return colors, indexes, normals
+
+    def __sample_subpixels_vectorized(self, rows, columns, row_offsets, column_offsets):
+        """Vectorized version of __sample_subpixels"""
+        directions = self.__camera.subpixel_ray_directions(rows, columns, row_offsets, column_offsets)
+        initial_points = full(directions.shape, as_array(self.__camera.position))
+        return PacketTracer(self).ray_trace_with_surfaces(initial_points, directions)
+
+    def __render_image_by_tiles(self, num_workers, tile_size, vectorized, tile_cache=None):
+        """Split image in tiles, render them (possibly in a pool of processes), and assemble them back together"""
+        image = Image(self.__camera.image_height, self.__camera.image_width)
+        tiles = split_into_tiles(self.__camera.image_height, self.__camera.image_width, tile_size)
+        num_tiles = len(tiles)
+        render_tile = PacketTracer(self).render_tile if vectorized else self.render_tile
+        stats = RenderStats.active if tile_cache is None else None
+        if stats is not None:
+            # Tiles are rendered with their own statistics, so that those of other processes are not lost
+            render_tile = CollectingTileRenderer(render_tile)
+        if tile_cache is not None:
+            rendered_tiles = tile_cache.render_tiles(self, tiles, num_workers)
+        elif num_workers > 1:
+            rendered_tiles = render_tiles_in_parallel(render_tile, tiles, num_workers)
+        else:
+            if vectorized:
+                self.__camera.cache_ray_grid()  # Reused by later renders with the same camera
+            rendered_tiles = ((tile, render_tile(tile)) for tile in tiles)
+        for tiles_done, (tile, colors) in enumerate(rendered_tiles, start=1):
+            if stats is not None:
+                colors, tile_stats = colors
+                stats.merge(tile_stats)
+            image.set_tile(tile, colors)
+            if num_tiles > 50 and tiles_done % 50 == 0:
+                print(f"Rendered tile {tiles_done}/{num_tiles}")  # To give an idea of the time left
+        print("Done rendering.")
+        return image
+
+    def __add_ambient_light(self, color, chip):
+        color.add_product(chip.material.ambient_light_reflectivity, self.__illumination.ambient_light.intensity)
 
     @staticmethod
-    def __get_diffuse_light(chip, ray_to_light_source, light_source):
+    def __add_diffuse_light(color, chip, ray_to_light_source, light_source):
         diffuse_multiplier = abs(ray_to_light_source.direction * chip.normal)
         diffuse_multiplier *= light_source.attenuator_by_distance_sq(chip.position)
-        return diffuse_multiplier * chip.material.diffuse_light_reflectivity ** light_source.intensity
+        color.add_product(chip.material.diffuse_light_reflectivity, light_source.intensity, diffuse_multiplier)
 
     @staticmethod
-    def __get_phong_blinn_light(chip, incoming_ray, ray_to_light_source, light_source):
+    def __add_phong_blinn_light(color, chip, incoming_ray, ray_to_light_source, light_source):
         h = (- incoming_ray.direction + ray_to_light_source.direction).unit
         r = reflected_vector(ray_to_light_source.direction, chip.normal)
         specular_multiplier = max(h * r, 0)
@@ -175,7 +590,7 @@ class Scene:
                 specular_multiplier ** chip.material.specular_coefficient)
 
         specular_multiplier *= light_source.attenuator_by_distance_sq(chip.position)
-        return specular_multiplier * light_source.intensity
+        color.add_scaled(light_source.intensity, specular_multiplier)
 
     @staticmethod
     def __get_refracted_ray(chip, incoming_ray, ray_is_coming_from_outside):
@@ -188,13 +603,41 @@ class Scene:
         new_direction = alpha * incoming_ray.direction + beta * chip.normal
         return Ray(chip.position, new_direction)
 
-    def color_at(self, chip, incoming_ray, recursion_depth):
-        """Find color at given point of the scene"""
-        color = BLACK
+    def path_survival(self, weight, position, incoming_direction, is_refraction=False):
+        """
+        Factor by which the color seen by a reflected or refracted ray of given weight must be multiplied, or 0 if the
+        ray is not traced (see min_ray_weight and russian_roulette)
+        :param position: Point where the ray starts
+        :param incoming_direction: Direction of the ray which hit that point
+        :param is_refraction: Whether the ray is refracted, rather than reflected
+        """
+        if weight >= self.__min_ray_weight:
+            return 1
+        if self.__russian_roulette and hashed_random(self.__roulette_seed, position.x, position.y, position.z,
+                                                     incoming_direction.x, incoming_direction.y, incoming_direction.z,
+                                                     is_refraction) * self.__min_ray_weight < weight:
+            return self.__min_ray_weight / weight
+        if RenderStats.active is not None:
+            RenderStats.active.terminated_rays += 1
+        return 0
+
+    def color_at(self, chip, incoming_ray, recursion_depth, weight=1.0):
+        """
+        Find color at given point of the scene
+        :param chip: Chip of material at the point
+        :param incoming_ray: Ray which hit the point
+        :param recursion_depth: Recursion depth of the incoming ray
+        :param weight: Largest fraction of the color at the point which reaches the camera
+        """
+        stats = RenderStats.active
+        if stats is not None:
+            stats.count_depths(recursion_depth)
         if recursion_depth >= MAX_RECURSION_COUNTER:
-            return color
+            return BLACK
+        # All terms are added to a single mutable buffer, instead of creating a new color for each sum
+        color = ColorAccumulator()
         # Ambient light:
-        color += self.__get_ambient_light(chip)
+        self.__add_ambient_light(color, chip)
 
         # Light sources:
         for light_source in self.__illumination.light_sources:
@@ -208,57 +651,76 @@ class Scene:
                 # source outside, for example.
                 continue
             # Check if light is obstructed, causing a shadow
-            if not self.ray_is_obstructed(new_ray, light_source.distance_to_point(
-                    chip.position)):  # Light source distance is infinity
+            if stats is not None:
+                stats.shadow_rays += 1
+            if not self.ray_is_obstructed(new_ray, light_source.distance_to_point(chip.position),
+                                          light_source):  # Light source distance is infinity
                 # Diffuse reflection
-                color += Scene.__get_diffuse_light(chip, new_ray, light_source)
+                Scene.__add_diffuse_light(color, chip, new_ray, light_source)
                 # Specular reflection (Phong-Blinn)
-                color += Scene.__get_phong_blinn_light(chip, incoming_ray, new_ray, light_source)
+                Scene.__add_phong_blinn_light(color, chip, incoming_ray, new_ray, light_source)
         # Recursive bits: Reflection and refraction
+        if recursion_depth + 1 >= MAX_RECURSION_COUNTER:
+            if stats is not None:
+                stats.count_depths(MAX_RECURSION_COUNTER,
+                                   (chip.material.reflective_index > 0) + chip.material.is_refractive)
+            return color.as_color()  # Deeper rays would not contribute to the color anyway
         # Reflection
-        if chip.material.reflective_index > 0:
+        reflection_weight = weight * chip.material.reflective_index
+        boost = self.path_survival(reflection_weight, chip.position, incoming_ray.direction) \
+            if chip.material.reflective_index > 0 else 0
+        if boost:
             new_direction = -reflected_vector(incoming_ray.direction, chip.normal)
             refracted_ray = Ray(chip.position, new_direction)
+            if stats is not None:
+                stats.reflection_rays += 1
 
             # Find nearest object
-            nearest_object, object_distance = self.__nearest_object_hit_by_ray(refracted_ray)
-            if nearest_object is not None:
-                intersection_position = refracted_ray.position_at_time(object_distance)
-                new_chip = nearest_object.chip_at(intersection_position)
-                attenuation = chip.material.reflective_index
-                color += attenuation * self.color_at(new_chip, refracted_ray, recursion_depth + 1)
+            new_chip = self.__nearest_hit(refracted_ray)
+            if new_chip is not None:
+                attenuation = chip.material.reflective_index * boost
+                color.add_scaled(self.color_at(new_chip, refracted_ray, recursion_depth + 1, reflection_weight * boost),
+                                 attenuation)
         # Refraction
         if chip.material.is_refractive:
             ray_is_coming_from_outside = chip.normal * incoming_ray.direction < 0
             refracted_ray = Scene.__get_refracted_ray(chip, incoming_ray, ray_is_coming_from_outside)
             if refracted_ray:
+                if stats is not None:
+                    stats.refraction_rays += 1
                 # Find nearest object
-                nearest_object, object_distance = self.__nearest_object_hit_by_ray(refracted_ray)
-                if nearest_object is not None:
-                    intersection_position = refracted_ray.position_at_time(object_distance)
-                    new_chip = nearest_object.chip_at(intersection_position)
-                    new_color = self.color_at(new_chip, refracted_ray, recursion_depth + 1)
+                new_chip = self.__nearest_hit(refracted_ray)
+                if new_chip is not None:
                     vector_travelled = incoming_ray.initial_point - chip.position if ray_is_coming_from_outside else chip.position - new_chip.position
                     distance_travelled = vector_travelled.length
-                    attenuated_color = chip.material.attenuate_by_refraction(new_color, distance_travelled)
-                    color += attenuated_color
-
-        return color
+                    # Color is only computed if enough of it gets through the material
+                    refraction_weight = weight * chip.material.max_transmittance(distance_travelled)
+                    boost = self.path_survival(refraction_weight, chip.position, incoming_ray.direction,
+                                               is_refraction=True)
+                    if boost:
+                        new_color = self.color_at(new_chip, refracted_ray, recursion_depth + 1,
+                                                  refraction_weight * boost)
+                        attenuated_color = chip.material.attenuate_by_refraction(new_color, distance_travelled)
+                        color.add_scaled(attenuated_color, boost)
+
+        return color.as_color()
 
     def ray_trace(self, ray):
         """Traces ray through the scene and return a color"""
-        color = BLACK
+        return self.__ray_trace_with_object(ray)[0]
 
+    def __ray_trace_with_object(self, ray):
+        """
+        Traces ray through the scene and return a color, the object hit by the ray (None if there is none) and the
+        normal of its surface where it is hit (None if there is no object)
+        """
+        if RenderStats.active is not None:
+            RenderStats.active.primary_rays += 1
         # Find closest object which intersects ray
-        nearest_object, object_distance = self.__nearest_object_hit_by_ray(ray)
+        hit = self.__nearest_hit(ray)
 
         # Draw
-        if nearest_object is not None:
-            intersection_position = ray.position_at_time(object_distance)
-            chip = nearest_object.chip_at(intersection_position)
-            color += self.color_at(chip, ray, recursion_depth=0)
-        else:
-            # Draw background color
-            return self.__background_color
-
-        return color
+        if hit is not None:
+            return self.color_at(hit, ray, recursion_depth=0), hit.obj, hit.normal
+        # Draw background color
+        return self.__background_color, None, None
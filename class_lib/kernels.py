@@ -0,0 +1,296 @@
+"""
+Intersection kernels: the math finding where packets of rays, given in the local coordinate system of a solid, first
+hit it. Several interchangeable backends implement the same kernels:
+- 'python': reference version, one ray at a time with plain arithmetic, like the scalar renderer
+- 'numpy': whole packets at once, with NumPy arrays (the default)
+- 'numba': the reference version compiled by Numba, only available if Numba is installed. Kernels are compiled the
+first time they are used in each process, which takes a few seconds
+Scenes choose a backend by name (Scene's kernel_backend), which is looked up when rays are traced, so that it also
+applies in worker processes. A backend which cannot be loaded falls back to the default one, with a warning
+backend_parity_errors checks that every available backend finds the same hits as the reference one (see
+tests/test_kernels.py)
+"""
+from contextlib import contextmanager
+from math import inf
+from warnings import warn
+
+from numpy import empty, errstate, full, where
+from numpy.random import default_rng
+
+from class_lib.useful_functions import dot_rows, min_pos_roots, ordered_pos_root_pair, ordered_pos_roots, unit_rows
+from globals import MIN_DIST
+
+DEFAULT_BACKEND = 'numpy'
+
+
+class KernelBackend:
+    """
+    Set of intersection kernels. Each one takes an array of ray initial points and one of unit ray directions (one ray
+    per row), followed by parameters of the solid, and returns the distance to the first hit of each ray (inf if there
+    is none)
+    - sphere(ray_p0s, ray_dirs, radius_sq)
+    - ellipsoid(ray_p0s, ray_dirs, kx, ky, kz), for the surface kx * x² + ky * y² + kz * z² = 1 / 4
+    - paraboloid(ray_p0s, ray_dirs, a, b, z_max), for the surface z = a * x² + b * y², with |z| <= z_max unless z_max
+    is 0
+    - plane(ray_p0s, ray_dirs, width, length), for the plane z = 0, with |x| <= width / 2 and |y| <= length / 2 unless
+    width or length is 0
+    """
+
+    def __init__(self, name, sphere, ellipsoid, paraboloid, plane):
+        self.name = name
+        self.sphere = sphere
+        self.ellipsoid = ellipsoid
+        self.paraboloid = paraboloid
+        self.plane = plane
+
+
+def _numpy_sphere(ray_p0s, ray_dirs, radius_sq):
+    b = 2 * dot_rows(ray_dirs, ray_p0s)
+    c = dot_rows(ray_p0s, ray_p0s) - radius_sq
+    return min_pos_roots(1, b, c)
+
+
+def _numpy_ellipsoid(ray_p0s, ray_dirs, kx, ky, kz):
+    px, py, pz = ray_p0s.T
+    dx, dy, dz = ray_dirs.T
+    a = kx * dx * dx + ky * dy * dy + kz * dz * dz
+    b = 2 * (kx * px * dx + ky * py * dy + kz * pz * dz)
+    c = kx * px * px + ky * py * py + kz * pz * pz - 0.25
+    return min_pos_roots(a, b, c)
+
+
+def _numpy_paraboloid(ray_p0s, ray_dirs, a, b, z_max):
+    px, py, pz = ray_p0s.T
+    dx, dy, dz = ray_dirs.T
+    aux_a = a * dx ** 2 + b * dy ** 2
+    aux_b = 2 * (a * (px * dx) + b * (py * dy)) - dz
+    aux_c = a * px ** 2 + b * py ** 2 - pz
+    first, second = ordered_pos_roots(aux_a, aux_b, aux_c)
+    if not z_max:
+        return first
+    # Use the first intersection whose height is within bounds
+    output = full(len(first), inf)
+    for time in (second, first):
+        with errstate(invalid='ignore'):
+            z = pz + time * dz
+        output = where((z_max >= z) & (z >= -z_max), time, output)
+    return output
+
+
+def _numpy_plane(ray_p0s, ray_dirs, width, length):
+    with errstate(divide='ignore', invalid='ignore'):
+        t = - ray_p0s[:, 2] / ray_dirs[:, 2]
+        hit = (ray_dirs[:, 2] != 0) & (t > MIN_DIST)
+        if width:
+            x = ray_p0s[:, 0] + ray_dirs[:, 0] * t
+            hit &= (x >= -width / 2) & (x <= width / 2)
+        if length:
+            y = ray_p0s[:, 1] + ray_dirs[:, 1] * t
+            hit &= (y >= -length / 2) & (y <= length / 2)
+    return where(hit, t, inf)
+
+
+def _numpy_backend():
+    return KernelBackend('numpy', _numpy_sphere, _numpy_ellipsoid, _numpy_paraboloid, _numpy_plane)
+
+
+def _reference_kernels(compile_function):
+    """
+    Kernels of the reference backend, tracing one ray at a time with plain arithmetic, compiled by the given function
+    (which returns them as they are for the pure Python backend)
+    The code only uses what Numba can compile, and functions called by a kernel are compiled first and bound in a
+    closure, since Numba cannot call Python functions
+    """
+
+    ordered_roots = compile_function(ordered_pos_root_pair)
+
+    @compile_function
+    def sphere(ray_p0s, ray_dirs, radius_sq):
+        distances = empty(len(ray_p0s))
+        for i in range(len(ray_p0s)):
+            px, py, pz = ray_p0s[i, 0], ray_p0s[i, 1], ray_p0s[i, 2]
+            dx, dy, dz = ray_dirs[i, 0], ray_dirs[i, 1], ray_dirs[i, 2]
+            b = 2 * (dx * px + dy * py + dz * pz)
+            c = px * px + py * py + pz * pz - radius_sq
+            distances[i] = ordered_roots(1.0, b, c)[0]
+        return distances
+
+    @compile_function
+    def ellipsoid(ray_p0s, ray_dirs, kx, ky, kz):
+        distances = empty(len(ray_p0s))
+        for i in range(len(ray_p0s)):
+            px, py, pz = ray_p0s[i, 0], ray_p0s[i, 1], ray_p0s[i, 2]
+            dx, dy, dz = ray_dirs[i, 0], ray_dirs[i, 1], ray_dirs[i, 2]
+            a = kx * dx * dx + ky * dy * dy + kz * dz * dz
+            b = 2 * (kx * px * dx + ky * py * dy + kz * pz * dz)
+            c = kx * px * px + ky * py * py + kz * pz * pz - 0.25
+            distances[i] = ordered_roots(a, b, c)[0]
+        return distances
+
+    @compile_function
+    def paraboloid(ray_p0s, ray_dirs, a, b, z_max):
+        distances = empty(len(ray_p0s))
+        for i in range(len(ray_p0s)):
+            px, py, pz = ray_p0s[i, 0], ray_p0s[i, 1], ray_p0s[i, 2]
+            dx, dy, dz = ray_dirs[i, 0], ray_dirs[i, 1], ray_dirs[i, 2]
+            first, second = ordered_roots(a * dx * dx + b * dy * dy, 2 * (a * (px * dx) + b * (py * dy)) - dz,
+                                          a * px * px + b * py * py - pz)
+            distances[i] = inf
+            if not z_max:
+                distances[i] = first
+            elif first < inf and z_max >= pz + first * dz >= -z_max:
+                distances[i] = first
+            elif second < inf and z_max >= pz + second * dz >= -z_max:
+                distances[i] = second
+        return distances
+
+    @compile_function
+    def plane(ray_p0s, ray_dirs, width, length):
+        distances = empty(len(ray_p0s))
+        for i in range(len(ray_p0s)):
+            distances[i] = inf
+            if ray_dirs[i, 2] == 0:
+                continue
+            t = - ray_p0s[i, 2] / ray_dirs[i, 2]
+            if t <= MIN_DIST:
+                continue
+            if width:
+                x = ray_p0s[i, 0] + ray_dirs[i, 0] * t
+                if x < -width / 2 or x > width / 2:
+                    continue
+            if length:
+                y = ray_p0s[i, 1] + ray_dirs[i, 1] * t
+                if y < -length / 2 or y > length / 2:
+                    continue
+            distances[i] = t
+        return distances
+
+    return sphere, ellipsoid, paraboloid, plane
+
+
+def _python_backend():
+    return KernelBackend('python', *_reference_kernels(lambda function: function))
+
+
+def _numba_backend():
+    from numba import njit  # Optional dependency: raises ImportError if it is not installed
+    return KernelBackend('numba', *_reference_kernels(njit))
+
+
+# Functions building each backend, only called when it is first used (compiling or importing may be slow)
+_BACKEND_FACTORIES = {'python': _python_backend, 'numpy': _numpy_backend, 'numba': _numba_backend}
+_backends = {}  # Backends already built, or the ImportError raised when building them
+_fallbacks = {}  # Backends used instead of those which cannot be loaded
+_active_backend = None
+
+
+def register_backend(name, make_backend):
+    """
+    Make a backend available under given name
+    :param make_backend: Function returning a KernelBackend, called when the backend is first used. It raises
+    ImportError if the backend needs a module which is not installed
+    """
+    _BACKEND_FACTORIES[name] = make_backend
+    _backends.pop(name, None)
+    _fallbacks.pop(name, None)
+
+
+def backend_names():
+    """Names of every registered backend, including those which cannot be loaded"""
+    return list(_BACKEND_FACTORIES)
+
+
+def get_backend(name):
+    """Backend with given name. Raises ImportError if it needs a module which is not installed"""
+    if name not in _BACKEND_FACTORIES:
+        raise ValueError(f"Unknown kernel backend: '{name}'. Use one of {', '.join(_BACKEND_FACTORIES)}")
+    if name not in _backends:
+        try:
+            _backends[name] = _BACKEND_FACTORIES[name]()
+        except ImportError as error:
+            _backends[name] = error  # So that loading is not tried again
+    if isinstance(_backends[name], ImportError):
+        raise ImportError(str(_backends[name]))
+    return _backends[name]
+
+
+def available_backends():
+    """Names of the backends which can be loaded"""
+    names = []
+    for name in _BACKEND_FACTORIES:
+        try:
+            get_backend(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def resolve_backend(name):
+    """Backend with given name, or the default one (with a warning, given once) if it cannot be loaded"""
+    if name not in _fallbacks:
+        try:
+            return get_backend(name)
+        except ImportError as error:
+            warn(f"Kernel backend '{name}' is not available ({error}). Using '{DEFAULT_BACKEND}' instead",
+                 RuntimeWarning)
+            _fallbacks[name] = get_backend(DEFAULT_BACKEND)
+    return _fallbacks[name]
+
+
+def active_backend():
+    """Backend used by the solids to intersect packets of rays"""
+    return _active_backend if _active_backend is not None else get_backend(DEFAULT_BACKEND)
+
+
+@contextmanager
+def using_backend(name):
+    """Make the backend with given name (or the default one, if it cannot be loaded) active inside a with block"""
+    global _active_backend
+    previous_backend = _active_backend
+    _active_backend = resolve_backend(name)
+    try:
+        yield _active_backend
+    finally:
+        _active_backend = previous_backend
+
+
+def random_kernel_arguments(rng, num_rays):
+    """Random rays (from points around the origin, where the solids are) and solid parameters for each kernel"""
+    ray_p0s = rng.uniform(-3, 3, (num_rays, 3))
+    # Half of the rays aim near the origin, so that most of them hit
+    near_origin = rng.random((num_rays, 1)) < 0.5
+    targets = where(near_origin, rng.uniform(-1, 1, (num_rays, 3)), rng.uniform(-3, 3, (num_rays, 3)))
+    ray_dirs = unit_rows(targets - ray_p0s)
+    ray_dirs[:num_rays // 10, 2] = 0  # Rays parallel to planes
+    ray_dirs[:num_rays // 10] = unit_rows(ray_dirs[:num_rays // 10])
+    return {
+        'sphere': [(ray_p0s, ray_dirs, 1.5 ** 2)],
+        'ellipsoid': [(ray_p0s, ray_dirs, 1 / 2 ** 2, 1 / 3 ** 2, 1 / 1.5 ** 2)],
+        'paraboloid': [(ray_p0s, ray_dirs, 0.8, 1.3, 1.0), (ray_p0s, ray_dirs, 0.5, -0.5, 0.0)],
+        'plane': [(ray_p0s, ray_dirs, 2.0, 3.0), (ray_p0s, ray_dirs, 0.0, 0.0)],
+    }
+
+
+def backend_parity_errors(num_rays=10000, seed=0, relative_tolerance=1e-9, names=None):
+    """
+    Compare the hits found by backends with those of the reference ('python') backend, on random rays
+    Returns a description of each kernel whose hits differ (rays hitting in one backend only, or distances which differ
+    by more than the relative tolerance), which is empty if every backend agrees
+    :param names: Names of the backends to compare (every available backend by default)
+    """
+    reference = get_backend('python')
+    names = available_backends() if names is None else names
+    errors = []
+    for kernel, arguments_list in random_kernel_arguments(default_rng(seed), num_rays).items():
+        for arguments in arguments_list:
+            expected = getattr(reference, kernel)(*arguments)
+            for name in names:
+                distances = getattr(get_backend(name), kernel)(*arguments)
+                different_hits = int(((distances < inf) != (expected < inf)).sum())
+                both_hit = (distances < inf) & (expected < inf)
+                differences = abs(distances[both_hit] - expected[both_hit]) / expected[both_hit]
+                if different_hits or (differences > relative_tolerance).any():
+                    errors.append(f"{name} {kernel} {arguments[2:]}: {different_hits} rays hit in one backend only, "
+                                  f"largest relative difference {differences.max(initial=0):.3g}")
+    return errors
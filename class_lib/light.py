@@ -1,9 +1,11 @@
 from math import inf
 
 from basics import Vector
+from numpy import full, ones
+from numpy.linalg import norm
 
 from class_lib.color import WHITE
-from class_lib.useful_functions import attenuate_by_distance_sq
+from class_lib.useful_functions import attenuate_by_distance_sq, attenuate_by_distances_sq, as_array
 
 
 class Ray:
@@ -51,6 +53,10 @@ class LightSource:
     def attenuator_by_distance_sq(self, chip_position):
         return 1
 
+    def attenuators_by_distance_sq(self, chip_positions):
+        """Vectorized version of attenuator_by_distance_sq, for an array of positions (one per row)"""
+        return ones(len(chip_positions))
+
 
 class AmbientLight(LightSource):
     """Class for ambient light (doesn't produce shades and is constant everywhere. An alias for its superclass"""
@@ -75,6 +81,10 @@ class PointLightSource(LightSource):
     def position(self):
         return self.__position
 
+    @property
+    def intensity_booster(self):
+        return self.__intensity_booster
+
     def ray_to_light_source(self, chip_position):
         direction = self.position - chip_position
         return Ray(chip_position, direction)
@@ -86,6 +96,19 @@ class PointLightSource(LightSource):
         distance_sq = (self.position - chip_position).length_sq
         return self.__intensity_booster * attenuate_by_distance_sq(distance_sq)
 
+    def directions_to_light_source(self, chip_positions):
+        """Unit directions of the rays from each position (one per row) to the light source"""
+        directions = as_array(self.position) - chip_positions
+        return directions / norm(directions, axis=1)[:, None]
+
+    def distances_to_points(self, point_positions):
+        return norm(as_array(self.position) - point_positions, axis=1)
+
+    def attenuators_by_distance_sq(self, chip_positions):
+        differences = as_array(self.position) - chip_positions
+        distances_sq = (differences * differences).sum(axis=1)
+        return self.__intensity_booster * attenuate_by_distances_sq(distances_sq)
+
 
 class LightSourceAtInfinity(LightSource):
     """Light coming from infinity in parallel rays (for example, the sun)"""
@@ -109,6 +132,13 @@ class LightSourceAtInfinity(LightSource):
     def distance_to_point(self, point_position):
         return inf
 
+    def directions_to_light_source(self, chip_positions):
+        """Unit directions of the rays from each position (one per row) to the light source"""
+        return full((len(chip_positions), 3), as_array(self.direction.unit))
+
+    def distances_to_points(self, point_positions):
+        return full(len(point_positions), inf)
+
 
 class Illumination:
     """Class for storing light sources"""
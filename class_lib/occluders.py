@@ -0,0 +1,109 @@
+from math import inf
+
+from numpy import flatnonzero, zeros
+
+
+class _LightStatistics:
+    """How often each object was tested against the shadow rays of a light source, and how often it blocked them"""
+
+    def __init__(self, num_objects):
+        self.tests = [0] * num_objects
+        self.hits = [0] * num_objects
+        self.order = list(range(num_objects))
+        self.last_occluder = None
+        self.queries_since_reorder = 0
+
+
+class OccluderCache:
+    """
+    Speeds up shadow rays by testing first the objects most likely to block them:
+    - The last object which blocked a light source (for packets, the one which blocked most rays of the last packet)
+    is tested before any other, since neighbouring pixels are almost always shadowed by the same object
+    - The remaining objects are tested in order of decreasing hit rate per unit of intersection cost, as observed so far
+    The result is exactly the same as testing the objects in any other order
+    """
+
+    REORDER_INTERVAL = 256  # Number of shadow rays between two updates of the test order
+
+    def __init__(self, objects, bvh=None):
+        """
+        Initialize new occluder cache
+        :param objects: Objects of the scene
+        :param bvh: If given, objects are found through the bounding volume hierarchy, instead of in adaptive order
+        """
+        self.__objects = objects
+        self.__bvh = bvh
+        self.__statistics = {}
+
+    def __light_statistics(self, light_source):
+        statistics = self.__statistics.get(light_source)
+        if statistics is None:
+            statistics = self.__statistics[light_source] = _LightStatistics(len(self.__objects))
+        return statistics
+
+    def __reorder(self, statistics):
+        """Likely and cheap occluders come first (hit rate is smoothed, so that untested objects are not neglected)"""
+        objects = self.__objects
+        statistics.order.sort(key=lambda i: -(statistics.hits[i] + 1) / (
+                (statistics.tests[i] + 2) * objects[i].INTERSECTION_COST))
+        statistics.queries_since_reorder = 0
+
+    def ray_is_obstructed(self, ray, light_source_distance, light_source):
+        """Returns true if there is an object obstructing the light source and causing a shadow"""
+        statistics = self.__light_statistics(light_source)
+        last_occluder = statistics.last_occluder
+        if last_occluder is not None:
+            statistics.tests[last_occluder] += 1
+            distance = self.__objects[last_occluder].intersection_distance(ray)
+            if distance and distance <= light_source_distance:
+                statistics.hits[last_occluder] += 1
+                return True
+
+        if self.__bvh is not None:
+            statistics.last_occluder = self.__bvh.occluder_index(ray, light_source_distance)
+            return statistics.last_occluder is not None
+
+        statistics.queries_since_reorder += 1
+        if statistics.queries_since_reorder >= OccluderCache.REORDER_INTERVAL:
+            self.__reorder(statistics)
+        tests, hits = statistics.tests, statistics.hits
+        for obj_index in statistics.order:
+            if obj_index == last_occluder:
+                continue
+            tests[obj_index] += 1
+            distance = self.__objects[obj_index].intersection_distance(ray)
+            if distance and distance <= light_source_distance:
+                hits[obj_index] += 1
+                statistics.last_occluder = obj_index
+                return True
+        return False
+
+    def rays_are_obstructed(self, ray_initial_points, ray_directions, light_source_distances, light_source):
+        """Vectorized version of ray_is_obstructed, for arrays of rays (one per row)"""
+        if self.__bvh is not None:
+            return self.__bvh.rays_are_obstructed(ray_initial_points, ray_directions, light_source_distances)
+
+        statistics = self.__light_statistics(light_source)
+        statistics.queries_since_reorder += len(ray_initial_points)
+        if statistics.queries_since_reorder >= OccluderCache.REORDER_INTERVAL:
+            self.__reorder(statistics)
+        last_occluder = statistics.last_occluder
+        order = statistics.order if last_occluder is None else \
+            [last_occluder] + [i for i in statistics.order if i != last_occluder]
+        obstructed = zeros(len(ray_initial_points), dtype=bool)
+        most_blocked = 0
+        for obj_index in order:
+            # Only rays which are not yet known to be obstructed are tested
+            remaining = flatnonzero(~obstructed)
+            if len(remaining) == 0:
+                break
+            distances = self.__objects[obj_index].intersection_distances(ray_initial_points[remaining],
+                                                                         ray_directions[remaining])
+            blocked = (distances < inf) & (distances <= light_source_distances[remaining])
+            obstructed[remaining] = blocked
+            num_blocked = int(blocked.sum())
+            statistics.tests[obj_index] += len(remaining)
+            statistics.hits[obj_index] += num_blocked
+            if num_blocked > most_blocked:
+                most_blocked, statistics.last_occluder = num_blocked, obj_index
+        return obstructed
@@ -0,0 +1,66 @@
+from collections import deque
+from multiprocessing import Pool, cpu_count
+
+# Function rendering tiles in the current worker process. Set once per worker by the pool initializer, so that the
+# scene is pickled only once per process instead of once per tile.
+_worker_render_tile = None
+
+
+def split_into_tiles(height, width, tile_size):
+    """
+    Split an image of given height and width into square tiles
+    Each tile is given as (top, left, bottom, right), bottom and right being exclusive
+    """
+    if tile_size < 1:
+        raise ValueError("Tile size must be a positive integer")
+    tiles = []
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            tiles.append((top, left, min(top + tile_size, height), min(left + tile_size, width)))
+    return tiles
+
+
+def default_num_workers():
+    """Number of worker processes to use when none is specified"""
+    return cpu_count() or 1
+
+
+def _init_worker(render_tile):
+    global _worker_render_tile
+    _worker_render_tile = render_tile
+
+
+def _render_tile(tile):
+    return tile, _worker_render_tile(tile)
+
+
+def render_tiles_in_parallel(render_tile, tiles, num_workers):
+    """
+    Render tiles in a pool of worker processes
+    :param render_tile: Picklable function returning the pixel colors of a tile, such as Scene.render_tile
+    :param tiles: Tiles to render
+    :param num_workers: Number of worker processes
+    Yields each tile with its pixel colors (row by row), in the order they are finished
+    """
+    with Pool(processes=num_workers, initializer=_init_worker, initargs=(render_tile,)) as pool:
+        for tile, colors in pool.imap_unordered(_render_tile, tiles):
+            yield tile, colors
+
+
+def render_tiles_in_order(render_tile, tiles, num_workers, max_pending=None):
+    """
+    Render tiles in a pool of worker processes, like render_tiles_in_parallel, but yield them in the order they are
+    given. Only max_pending tiles are handed to the workers ahead of the next one to yield, so that the tiles waiting to
+    be yielded do not pile up in memory
+    :param max_pending: Maximum number of tiles rendered or being rendered ahead. Four per worker by default
+    """
+    if max_pending is None:
+        max_pending = 4 * num_workers
+    with Pool(processes=num_workers, initializer=_init_worker, initargs=(render_tile,)) as pool:
+        pending = deque()
+        for tile in tiles:
+            pending.append(pool.apply_async(_render_tile, (tile,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
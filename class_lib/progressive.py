@@ -0,0 +1,115 @@
+from numpy import arange, array, clip, empty, full, nonzero, searchsorted, zeros
+
+
+def lattice(size, step):
+    """Pixel coordinates sampled along one dimension at given step. The last pixel is always included"""
+    return array(sorted(set(range(0, size, step)) | {size - 1}))
+
+
+def interpolate_lattice(values, rows, columns, at_rows, at_columns):
+    """
+    Bilinear interpolation of values known on a lattice
+    :param values: Values at the lattice points (array with one row per lattice row and one column per lattice column)
+    :param rows: Pixel rows of the lattice (at least two)
+    :param columns: Pixel columns of the lattice (at least two)
+    :param at_rows: Pixel rows where values are interpolated
+    :param at_columns: Pixel columns where values are interpolated
+    """
+    i = clip(searchsorted(rows, at_rows, side='right') - 1, 0, len(rows) - 2)
+    j = clip(searchsorted(columns, at_columns, side='right') - 1, 0, len(columns) - 2)
+    weight_rows = ((at_rows - rows[i]) / (rows[i + 1] - rows[i]))[:, None]
+    weight_columns = ((at_columns - columns[j]) / (columns[j + 1] - columns[j]))[None, :]
+    if values.ndim == 3:
+        weight_rows, weight_columns = weight_rows[..., None], weight_columns[..., None]
+    i, j = i[:, None], j[None, :]
+    return (1 - weight_rows) * ((1 - weight_columns) * values[i, j] + weight_columns * values[i, j + 1]) + \
+        weight_rows * ((1 - weight_columns) * values[i + 1, j] + weight_columns * values[i + 1, j + 1])
+
+
+def disagreeing_cells(colors, object_ids, color_threshold):
+    """
+    Cells of a lattice whose four corners do not hit the same object, or whose colors differ by more than threshold
+    Returns a boolean array with one row per lattice row interval, and one column per lattice column interval
+    """
+    corners = (slice(None, -1), slice(1, None))
+    corner_ids = array([object_ids[r, c] for r in corners for c in corners])
+    corner_colors = array([colors[r, c] for r in corners for c in corners])
+    different_objects = (corner_ids != corner_ids[0]).any(axis=0)
+    different_colors = (corner_colors.max(axis=0) - corner_colors.min(axis=0)).max(axis=2) > color_threshold
+    return different_objects | different_colors
+
+
+def _cells_containing(lattice_coords, coords):
+    """
+    Indexes of the lattice intervals containing each coordinate. Coordinates on a lattice line belong to two intervals,
+    so two arrays are returned (they are equal for coordinates strictly inside an interval)
+    """
+    last_interval = len(lattice_coords) - 2
+    after = clip(searchsorted(lattice_coords, coords, side='right') - 1, 0, last_interval)
+    before = clip(searchsorted(lattice_coords, coords, side='left') - 1, 0, last_interval)
+    return after, before
+
+
+def progressive_levels(height, width, sample_pixels, initial_step=8, color_threshold=0.05):
+    """
+    Render image progressively, yielding the colors of every pixel (height x width x 3 array) at each level:
+    - The first level samples a sparse lattice of pixels, every initial_step rows and columns
+    - Each following level halves the step, but only samples the new lattice points lying in cells whose corners hit
+    different objects or differ in color by more than color_threshold. Other points are interpolated
+    - The last level has a step of one pixel
+    :param sample_pixels: Function which, given arrays of rows and columns, returns the colors of those pixels and the
+    index of the object seen through each of them (-1 for the background)
+    """
+    if height < 2 or width < 2:
+        # Too small to interpolate anything
+        rows, columns = nonzero(full((height, width), True))
+        colors, _ = sample_pixels(rows, columns)
+        yield colors.reshape((height, width, 3))
+        return
+
+    # True samples, kept at full resolution
+    sampled = zeros((height, width), dtype=bool)
+    sampled_colors = empty((height, width, 3))
+    sampled_ids = empty((height, width), dtype=int)
+
+    def sample(needed):
+        """Sample lattice points (given as a full resolution mask) which have not been sampled yet"""
+        rows, columns = nonzero(needed & ~sampled)
+        if len(rows) > 0:
+            sampled_colors[rows, columns], sampled_ids[rows, columns] = sample_pixels(rows, columns)
+            sampled[rows, columns] = True
+
+    step = 1
+    while step * 2 <= initial_step:
+        step *= 2
+    rows, columns = lattice(height, step), lattice(width, step)
+    needed = zeros((height, width), dtype=bool)
+    needed[rows[:, None], columns[None, :]] = True
+    sample(needed)
+    colors = sampled_colors[rows[:, None], columns[None, :]]
+    object_ids = sampled_ids[rows[:, None], columns[None, :]]
+
+    while True:
+        yield interpolate_lattice(colors, rows, columns, arange(height), arange(width))
+        if step == 1:
+            return
+        disagreeing = disagreeing_cells(colors, object_ids, color_threshold)
+        step //= 2
+        new_rows, new_columns = lattice(height, step), lattice(width, step)
+
+        # New lattice points which touch a disagreeing cell are sampled, the others are interpolated
+        row_cells, column_cells = _cells_containing(rows, new_rows), _cells_containing(columns, new_columns)
+        touches_disagreeing_cell = zeros((len(new_rows), len(new_columns)), dtype=bool)
+        for i in row_cells:
+            for j in column_cells:
+                touches_disagreeing_cell |= disagreeing[i[:, None], j[None, :]]
+        needed[:] = False
+        needed[new_rows[:, None], new_columns[None, :]] = touches_disagreeing_cell
+        sample(needed)
+
+        new_colors = interpolate_lattice(colors, rows, columns, new_rows, new_columns)
+        new_object_ids = object_ids[row_cells[0][:, None], column_cells[0][None, :]]
+        is_sampled = sampled[new_rows[:, None], new_columns[None, :]]
+        new_colors[is_sampled] = sampled_colors[new_rows[:, None], new_columns[None, :]][is_sampled]
+        new_object_ids[is_sampled] = sampled_ids[new_rows[:, None], new_columns[None, :]][is_sampled]
+        rows, columns, colors, object_ids = new_rows, new_columns, new_colors, new_object_ids
@@ -0,0 +1,329 @@
+from math import inf
+
+from numpy import array, column_stack, empty, exp, flatnonzero, full, ones, zeros, abs as array_abs, maximum, where, \
+    errstate
+from numpy.linalg import norm
+
+from class_lib.kernels import using_backend
+from class_lib.render_stats import RenderStats
+from class_lib.useful_functions import as_array, dot_rows, hashed_randoms, unit_rows, reflected_vectors
+from globals import MAX_RECURSION_COUNTER
+
+
+class MaterialArrays:
+    """Optical specifications of a list of materials, as arrays (one row per material)"""
+
+    def __init__(self, material_table, material_indexes):
+        """
+        Initialize material arrays
+        :param material_table: List of materials
+        :param material_indexes: Index in the table of each material of the arrays
+        """
+        # Materials are usually shared by many chips, so each distinct one is only converted once
+        distinct_indexes = {}
+        distinct_materials = []
+        table_to_distinct = empty(len(material_table), dtype=int)
+        for i, material in enumerate(material_table):
+            index = distinct_indexes.get(id(material))
+            if index is None:
+                index = distinct_indexes[id(material)] = len(distinct_materials)
+                distinct_materials.append(material)
+            table_to_distinct[i] = index
+        material_indexes = table_to_distinct[material_indexes]
+
+        def table(values):
+            return array(values, dtype=float)[material_indexes]
+
+        self.ambient_light_reflectivity = table([as_array(m.ambient_light_reflectivity) for m in distinct_materials])
+        self.diffuse_light_reflectivity = table([as_array(m.diffuse_light_reflectivity) for m in distinct_materials])
+        self.specular_multiplier = table([m.specular_multiplier for m in distinct_materials])
+        self.specular_coefficient = table([m.specular_coefficient for m in distinct_materials])
+        self.reflective_index = table([m.reflective_index for m in distinct_materials])
+        self.refractive_index = table([m.refractive_index for m in distinct_materials])
+        self.is_refractive = table([m.is_refractive for m in distinct_materials]).astype(bool)
+        self.refractive_attenuation_constants = table(
+            [as_array(m.refractive_attenuation_constants) for m in distinct_materials])
+
+
+class PacketTracer:
+    """
+    Ray tracer which handles whole packets of rays at once, stored as NumPy arrays (one ray per row)
+    Produces the same colors as Scene.ray_trace (up to rounding errors), without creating a Ray, Vector and Color
+    object for each pixel
+    """
+
+    def __init__(self, scene, ray_recorder=None):
+        """
+        Initialize packet tracer
+        :param scene: Scene to trace
+        :param ray_recorder: Optional object whose record_segments method is given every ray segment that is traced
+        (initial points, directions, lengths which are inf for rays that go on forever, and a label for the kind of
+        ray: 'primary', 'secondary', or the light source for shadow rays)
+        """
+        self.__scene = scene
+        self.__ray_recorder = ray_recorder
+
+    def primary_rays(self, tile):
+        """Initial points and unit directions of the rays from the camera through each pixel of the tile"""
+        camera = self.__scene.camera
+        directions = camera.ray_directions(tile)
+        return full(directions.shape, as_array(camera.position)), directions
+
+    def render_tile(self, tile):
+        """Array of colors of all pixels inside tile (top, left, bottom, right)"""
+        top, left, bottom, right = tile
+        return self.ray_trace(*self.primary_rays(tile)).reshape((bottom - top, right - left, 3))
+
+    def ray_trace(self, ray_initial_points, ray_directions):
+        """Vectorized version of Scene.ray_trace. Returns the color (one per row) seen by each ray"""
+        return self.ray_trace_with_objects(ray_initial_points, ray_directions)[0]
+
+    def ray_trace_with_objects(self, ray_initial_points, ray_directions):
+        """Same as ray_trace, but also returns the index of the object hit by each ray (-1 if there is none)"""
+        return self.ray_trace_with_surfaces(ray_initial_points, ray_directions)[:2]
+
+    def ray_trace_with_surfaces(self, ray_initial_points, ray_directions):
+        """
+        Same as ray_trace_with_objects, but also returns the unit normal of the surface hit by each ray (zero if there
+        is none)
+        """
+        colors = full(ray_initial_points.shape, as_array(self.__scene.background_color))
+        normals = zeros(ray_initial_points.shape)
+        if RenderStats.active is not None:
+            RenderStats.active.primary_rays += len(ray_initial_points)
+        object_indexes, distances = self.nearest_objects_hit_by_rays(ray_initial_points, ray_directions, 'primary')
+        hit = flatnonzero(object_indexes >= 0)
+        if len(hit) > 0:
+            positions, normals[hit], materials = self.__surfaces_at_hits(object_indexes[hit], ray_initial_points[hit],
+                                                                         ray_directions[hit], distances[hit])
+            colors[hit] = self.colors_at(positions, normals[hit], materials, ray_initial_points[hit],
+                                         ray_directions[hit], recursion_depth=0, weights=ones(len(hit)))
+        return colors, object_indexes, normals
+
+    def nearest_objects_hit_by_rays(self, ray_initial_points, ray_directions, ray_label='secondary'):
+        """
+        Find closest object which intersects each ray
+        Returns index of the object (-1 if there is none) and its distance to ray origin
+        """
+        bvh = self.__scene.bounding_volume_hierarchy
+        with using_backend(self.__scene.kernel_backend):
+            if bvh is not None:
+                object_indexes, minimum_distances = bvh.nearest_objects_hit_by_rays(ray_initial_points, ray_directions)
+            else:
+                minimum_distances = full(len(ray_initial_points), inf)
+                object_indexes = full(len(ray_initial_points), -1)
+                for obj_index, obj in enumerate(self.__scene.objects):
+                    distances = obj.intersection_distances(ray_initial_points, ray_directions)
+                    closer = distances < minimum_distances
+                    minimum_distances[closer] = distances[closer]
+                    object_indexes[closer] = obj_index
+        if self.__ray_recorder is not None:
+            self.__ray_recorder.record_segments(ray_initial_points, ray_directions, minimum_distances, ray_label)
+        return object_indexes, minimum_distances
+
+    def rays_are_obstructed(self, ray_initial_points, ray_directions, light_source_distances, light_source=None):
+        """Vectorized version of Scene.ray_is_obstructed"""
+        if self.__ray_recorder is not None:
+            self.__ray_recorder.record_segments(ray_initial_points, ray_directions, light_source_distances,
+                                                light_source)
+        with using_backend(self.__scene.kernel_backend):
+            return self.__rays_are_obstructed(ray_initial_points, ray_directions, light_source_distances, light_source)
+
+    def __rays_are_obstructed(self, ray_initial_points, ray_directions, light_source_distances, light_source):
+        if light_source is not None:
+            return self.__scene.occluder_cache.rays_are_obstructed(ray_initial_points, ray_directions,
+                                                                   light_source_distances, light_source)
+        bvh = self.__scene.bounding_volume_hierarchy
+        if bvh is not None:
+            return bvh.rays_are_obstructed(ray_initial_points, ray_directions, light_source_distances)
+        obstructed = zeros(len(ray_initial_points), dtype=bool)
+        for obj in self.__scene.objects:
+            # Only rays which are not yet known to be obstructed are tested
+            remaining = flatnonzero(~obstructed)
+            if len(remaining) == 0:
+                break
+            distances = obj.intersection_distances(ray_initial_points[remaining], ray_directions[remaining])
+            obstructed[remaining] = (distances < inf) & (distances <= light_source_distances[remaining])
+        return obstructed
+
+    def __colors_at_hits(self, object_indexes, ray_initial_points, ray_directions, distances, recursion_depth,
+                         weights):
+        """Vectorized version of Scene.color_at, for rays which hit the objects given by their indexes"""
+        if len(object_indexes) == 0:
+            return zeros((0, 3))
+        positions, normals, materials = self.__surfaces_at_hits(object_indexes, ray_initial_points, ray_directions,
+                                                                distances)
+        return self.colors_at(positions, normals, materials, ray_initial_points, ray_directions, recursion_depth,
+                              weights)
+
+    def __surfaces_at_hits(self, object_indexes, ray_initial_points, ray_directions, distances):
+        """Positions, normals and materials of the points where rays hit the objects given by their indexes"""
+        positions = ray_initial_points + distances[:, None] * ray_directions
+        normals = empty(positions.shape)
+        # Material tables of all objects hit are concatenated, and each chip gets an index in the concatenated table
+        material_table = []
+        material_indexes = empty(len(positions), dtype=int)
+        objects = self.__scene.objects
+        for obj_index in set(object_indexes.tolist()):
+            chips = flatnonzero(object_indexes == obj_index)
+            chip_normals, object_material_table, chip_material_indexes = objects[obj_index].normals_and_materials_at(
+                positions[chips])
+            normals[chips] = chip_normals
+            material_indexes[chips] = len(material_table) + chip_material_indexes
+            material_table.extend(object_material_table)
+        return positions, normals, MaterialArrays(material_table, material_indexes)
+
+    def __path_survival(self, weights, positions, incoming_directions, is_refraction=False):
+        """Vectorized version of Scene.path_survival: factor for each ray, 0 for those which are not traced"""
+        min_ray_weight = self.__scene.min_ray_weight
+        boosts = ones(len(weights))
+        low = flatnonzero(weights < min_ray_weight)
+        if len(low) > 0:
+            boosts[low] = 0
+            if self.__scene.russian_roulette:
+                randoms = hashed_randoms(self.__scene.roulette_seed,
+                                         column_stack((positions[low], incoming_directions[low],
+                                                       full(len(low), float(is_refraction)))))
+                survivors = low[randoms * min_ray_weight < weights[low]]
+                boosts[survivors] = min_ray_weight / weights[survivors]
+            if RenderStats.active is not None:
+                RenderStats.active.terminated_rays += int((boosts[low] == 0).sum())
+        return boosts
+
+    def colors_at(self, positions, normals, materials, ray_initial_points, ray_directions, recursion_depth,
+                  weights=None):
+        """
+        Find color at given points of the scene
+        :param positions: Chip positions (one per row)
+        :param normals: Chip normals (one per row)
+        :param materials: MaterialArrays with the material of each chip
+        :param ray_initial_points: Initial points of the incoming rays
+        :param ray_directions: Unit directions of the incoming rays
+        :param recursion_depth: Recursion depth of the incoming rays
+        :param weights: Largest fraction of the color at each point which reaches the camera (all ones by default)
+        """
+        if weights is None:
+            weights = ones(len(positions))
+        if recursion_depth >= MAX_RECURSION_COUNTER:
+            return zeros(positions.shape)
+        stats = RenderStats.active
+        if stats is not None:
+            stats.count_depths(recursion_depth, len(positions))
+        illumination = self.__scene.illumination
+
+        # Ambient light:
+        colors = materials.ambient_light_reflectivity * as_array(illumination.ambient_light.intensity)
+
+        # Light sources:
+        cos_incoming = dot_rows(ray_directions, normals)
+        for light_source in illumination.light_sources:
+            directions_to_light = light_source.directions_to_light_source(positions)
+            cos_new_ray = dot_rows(directions_to_light, normals)
+            # Light should hit the same side of the surface that the camera sees
+            lit = flatnonzero(cos_incoming * cos_new_ray <= 0)
+            if stats is not None:
+                stats.shadow_rays += len(lit)
+            # Check if light is obstructed, causing a shadow
+            obstructed = self.rays_are_obstructed(positions[lit], directions_to_light[lit],
+                                                  light_source.distances_to_points(positions[lit]), light_source)
+            lit = lit[~obstructed]
+            if len(lit) == 0:
+                continue
+            intensity = as_array(light_source.intensity)
+            attenuators = light_source.attenuators_by_distance_sq(positions[lit])
+
+            # Diffuse reflection
+            diffuse_multipliers = array_abs(cos_new_ray[lit]) * attenuators
+            colors[lit] += diffuse_multipliers[:, None] * (materials.diffuse_light_reflectivity[lit] * intensity)
+
+            # Specular reflection (Phong-Blinn)
+            h = unit_rows(- ray_directions[lit] + directions_to_light[lit])
+            r = reflected_vectors(directions_to_light[lit], normals[lit])
+            specular_multipliers = maximum(dot_rows(h, r), 0)
+            specular_multipliers = materials.specular_multiplier[lit] * (
+                    specular_multipliers ** materials.specular_coefficient[lit])
+            specular_multipliers *= attenuators
+            colors[lit] += specular_multipliers[:, None] * intensity
+
+        # Recursive bits: Reflection and refraction
+        if recursion_depth + 1 >= MAX_RECURSION_COUNTER:
+            if stats is not None:
+                stats.count_depths(MAX_RECURSION_COUNTER, int((materials.reflective_index > 0).sum() +
+                                                              materials.is_refractive.sum()))
+            return colors  # Deeper rays would not contribute to the color anyway
+
+        # Reflection
+        reflective = flatnonzero(materials.reflective_index > 0)
+        reflection_weights = weights[reflective] * materials.reflective_index[reflective]
+        boosts = self.__path_survival(reflection_weights, positions[reflective], ray_directions[reflective])
+        traced = flatnonzero(boosts > 0)
+        reflective, reflection_weights, boosts = reflective[traced], reflection_weights[traced], boosts[traced]
+        if len(reflective) > 0:
+            if stats is not None:
+                stats.reflection_rays += len(reflective)
+            new_directions = unit_rows(-reflected_vectors(ray_directions[reflective], normals[reflective]))
+            new_colors, hit = self.__trace_secondary_rays(positions[reflective], new_directions, recursion_depth + 1,
+                                                          reflection_weights * boosts)
+            reflected = reflective[hit]
+            colors[reflected] += (materials.reflective_index[reflected] * boosts[hit])[:, None] * new_colors
+
+        # Refraction
+        refractive = flatnonzero(materials.is_refractive)
+        if len(refractive) > 0:
+            colors[refractive] += self.__refraction_colors(positions[refractive], normals[refractive],
+                                                           materials.refractive_index[refractive],
+                                                           materials.refractive_attenuation_constants[refractive],
+                                                           ray_initial_points[refractive], ray_directions[refractive],
+                                                           recursion_depth, weights[refractive])
+        return colors
+
+    def __trace_secondary_rays(self, ray_initial_points, ray_directions, recursion_depth, weights):
+        """
+        Colors seen by reflected rays. Unlike primary rays, rays which hit nothing add no color
+        Returns the colors seen by the rays which hit an object, and their indexes
+        """
+        object_indexes, distances = self.nearest_objects_hit_by_rays(ray_initial_points, ray_directions)
+        hit = flatnonzero(object_indexes >= 0)
+        colors = self.__colors_at_hits(object_indexes[hit], ray_initial_points[hit], ray_directions[hit],
+                                       distances[hit], recursion_depth, weights[hit])
+        return colors, hit
+
+    def __refraction_colors(self, positions, normals, refractive_indexes, attenuation_constants, ray_initial_points,
+                            ray_directions, recursion_depth, weights):
+        """Vectorized version of the refraction bit of Scene.color_at"""
+        cos_incoming = dot_rows(normals, ray_directions)
+        coming_from_outside = cos_incoming < 0
+        alpha = where(coming_from_outside, 1 / refractive_indexes, refractive_indexes)
+        aux = alpha * cos_incoming
+        discriminant = aux * aux + 1 - alpha * alpha
+        with errstate(invalid='ignore'):
+            square_root = where(coming_from_outside, -1, 1) * discriminant ** .5
+        beta = -aux + square_root
+        new_directions = alpha[:, None] * ray_directions + beta[:, None] * normals
+        refracted = flatnonzero(discriminant >= 0)  # Otherwise there is total internal reflection
+
+        colors = zeros(positions.shape)
+        if len(refracted) == 0:
+            return colors
+        if RenderStats.active is not None:
+            RenderStats.active.refraction_rays += len(refracted)
+        new_initial_points, new_directions = positions[refracted], unit_rows(new_directions[refracted])
+        object_indexes, distances = self.nearest_objects_hit_by_rays(new_initial_points, new_directions)
+        hit = flatnonzero(object_indexes >= 0)
+        refracted = refracted[hit]
+        new_positions = new_initial_points[hit] + distances[hit][:, None] * new_directions[hit]
+        vectors_travelled = where(coming_from_outside[refracted][:, None],
+                                  ray_initial_points[refracted] - positions[refracted],
+                                  positions[refracted] - new_positions)
+        distances_travelled = norm(vectors_travelled, axis=1)
+        transmittances = exp(attenuation_constants[refracted] * distances_travelled[:, None])
+        # Color is only computed where enough of it gets through the material
+        refraction_weights = weights[refracted] * transmittances.max(axis=1)
+        boosts = self.__path_survival(refraction_weights, positions[refracted], ray_directions[refracted],
+                                      is_refraction=True)
+        traced = flatnonzero(boosts > 0)
+        new_colors = self.__colors_at_hits(object_indexes[hit][traced], new_initial_points[hit][traced],
+                                           new_directions[hit][traced], distances[hit][traced], recursion_depth + 1,
+                                           refraction_weights[traced] * boosts[traced])
+        colors[refracted[traced]] = new_colors * transmittances[traced] * boosts[traced][:, None]
+        return colors
@@ -0,0 +1,120 @@
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+
+from globals import MAX_RECURSION_COUNTER
+
+
+class RenderStats:
+    """
+    Counters and timers filled while a scene is rendered with statistics:
+    - Number of primary, shadow, reflection and refraction rays, and of those terminated because of their weight
+    - Number of intersection tests, and of those which hit, per class of object
+    - Histogram of the recursion depth of each shading evaluation (the last bin counts the rays cut off by
+    MAX_RECURSION_COUNTER)
+    - Wall time per stage of the rendering
+    Both engines count the same rays and recursion depths for the same image. Intersection tests may differ, since
+    they skip objects in different ways
+    Hot paths only look at RenderStats.active, so statistics cost a single comparison when they are not collected
+    """
+
+    active = None  # Statistics being collected in this process, if any
+
+    def __init__(self):
+        self.primary_rays = 0
+        self.shadow_rays = 0
+        self.reflection_rays = 0
+        self.refraction_rays = 0
+        self.terminated_rays = 0
+        self.intersection_tests = Counter()
+        self.intersection_hits = Counter()
+        self.total_intersection_tests = 0
+        self.depth_histogram = [0] * (MAX_RECURSION_COUNTER + 1)
+        self.stage_times = Counter()
+
+    @contextmanager
+    def collecting(self):
+        """Make these statistics the active ones while the context lasts"""
+        previous_stats = RenderStats.active
+        RenderStats.active = self
+        try:
+            yield self
+        finally:
+            RenderStats.active = previous_stats
+
+    @contextmanager
+    def timing(self, stage):
+        """Add the wall time spent in the context to given stage"""
+        start_time = perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_times[stage] += perf_counter() - start_time
+
+    def count_intersections(self, obj, num_tests, num_hits):
+        class_name = type(obj).__name__
+        self.intersection_tests[class_name] += num_tests
+        self.total_intersection_tests += num_tests
+        self.intersection_hits[class_name] += num_hits
+
+    def count_depths(self, recursion_depth, num_evaluations=1):
+        self.depth_histogram[min(recursion_depth, MAX_RECURSION_COUNTER)] += num_evaluations
+
+    def merge(self, other):
+        """Add the counts and times of other statistics (of a tile rendered in another process, for example)"""
+        self.primary_rays += other.primary_rays
+        self.shadow_rays += other.shadow_rays
+        self.reflection_rays += other.reflection_rays
+        self.refraction_rays += other.refraction_rays
+        self.terminated_rays += other.terminated_rays
+        self.intersection_tests.update(other.intersection_tests)
+        self.intersection_hits.update(other.intersection_hits)
+        self.total_intersection_tests += other.total_intersection_tests
+        self.depth_histogram = [a + b for a, b in zip(self.depth_histogram, other.depth_histogram)]
+        self.stage_times.update(other.stage_times)
+
+    @property
+    def total_rays(self):
+        return self.primary_rays + self.shadow_rays + self.reflection_rays + self.refraction_rays
+
+    def as_dict(self):
+        """Statistics as a dictionary of plain values, which can be saved as JSON"""
+        return {
+            'rays': {'primary': self.primary_rays, 'shadow': self.shadow_rays, 'reflection': self.reflection_rays,
+                     'refraction': self.refraction_rays, 'total': self.total_rays,
+                     'terminated': self.terminated_rays},
+            'intersections': {class_name: {'tests': tests, 'hits': self.intersection_hits[class_name]}
+                              for class_name, tests in sorted(self.intersection_tests.items())},
+            'recursion_depth_histogram': list(self.depth_histogram),
+            'stage_times': dict(self.stage_times),
+        }
+
+    def __str__(self):
+        lines = [f"Rays: {self.total_rays} ({self.primary_rays} primary, {self.shadow_rays} shadow, "
+                 f"{self.reflection_rays} reflection, {self.refraction_rays} refraction), "
+                 f"{self.terminated_rays} terminated by weight",
+                 "Intersection tests (hits) per class:"]
+        for class_name, tests in sorted(self.intersection_tests.items()):
+            hits = self.intersection_hits[class_name]
+            lines.append(f"  {class_name}: {tests} ({hits}, {hits / tests:.1%})" if tests else f"  {class_name}: 0")
+        lines.append("Shading evaluations per recursion depth: " + ', '.join(
+            f"{depth}: {count}" for depth, count in enumerate(self.depth_histogram[:-1])) +
+                     f" (cut off at {MAX_RECURSION_COUNTER}: {self.depth_histogram[-1]})")
+        lines.append("Wall time per stage: " + ', '.join(
+            f"{stage} {seconds:.3f} s" for stage, seconds in self.stage_times.items()))
+        return '\n'.join(lines)
+
+
+class CollectingTileRenderer:
+    """
+    Picklable function rendering a tile with statistics, in a worker process. Returns its pixel colors and statistics
+    """
+
+    def __init__(self, render_tile):
+        self.__render_tile = render_tile
+
+    def __call__(self, tile):
+        stats = RenderStats()
+        with stats.collecting(), stats.timing('tracing'):
+            colors = self.__render_tile(tile)
+        return colors, stats
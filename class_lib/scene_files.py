@@ -0,0 +1,217 @@
+"""
+Scenes saved to files, so that a scene built by a module (possibly with random choices) can be loaded again, by any
+process, exactly the same and much faster than by running the module again
+A scene is described with plain values only (lists, numbers, strings and None): materials shared by several objects
+are written once, and materials and objects are written as lists of values rather than dicts, which makes files smaller
+and faster to read. Files are either binary (pickled plain values, which are read back exactly and fast, and cannot
+contain anything else) or JSON, which is human-readable (floats are written with as many digits as needed to be read
+back exactly), and may be compressed with gzip
+Save the scene of a module with: python -m class_lib.scene_files pre_cooked_scenes.mentos output/mentos.scene
+"""
+import gzip
+import json
+from contextlib import redirect_stdout
+from importlib import import_module
+from io import StringIO
+from pickle import HIGHEST_PROTOCOL, Unpickler, UnpicklingError, dump
+from sys import argv
+
+from basics import Vector
+
+from class_lib.color import Color
+from class_lib.coordinate_system import CoordinateSystem
+from class_lib.imaging import Camera, Scene
+from class_lib.kernels import DEFAULT_BACKEND
+from class_lib.light import AmbientLight, Illumination, LightSource, LightSourceAtInfinity, PointLightSource
+from class_lib.solid_objects import Material
+from class_lib.solids.ellipsoid import Ellipsoid
+from class_lib.solids.paraboloid import Paraboloid
+from class_lib.solids.plane import CheckeredPlane, SmoothPlane
+from class_lib.solids.sphere import BeachBall, SmoothSphere
+
+SCENE_FORMAT = 'py-cgi scene'
+SCENE_FORMAT_VERSION = 1  # Must be increased whenever the format changes, so that old files are not misread
+
+# Attributes of each kind of solid, which are also the names of its constructor's parameters (besides the coordinate
+# system and the material)
+_SOLID_ATTRIBUTES = {
+    SmoothSphere: ('radius',),
+    BeachBall: ('radius',),
+    Ellipsoid: ('width', 'length', 'height'),
+    Paraboloid: ('a', 'b', 'z_max'),
+    SmoothPlane: ('width', 'length'),
+    CheckeredPlane: ('cell_size', 'width', 'length'),
+}
+_SOLID_CLASSES = {cls.__name__: cls for cls in _SOLID_ATTRIBUTES}
+_LIGHT_CLASSES = {cls.__name__: cls for cls in (LightSource, AmbientLight, PointLightSource, LightSourceAtInfinity)}
+
+
+def _vector_to_list(vector):
+    return [vector.x, vector.y, vector.z]
+
+
+def _color_to_list(color):
+    return [color.red, color.green, color.blue]
+
+
+def _material_to_list(material):
+    """Colors of ambient and diffuse light reflectivity (6 numbers), specular multiplier and coefficient, reflective
+    and refractive index, and color of refractive attenuation (3 numbers)"""
+    return [*_color_to_list(material.ambient_light_reflectivity), *_color_to_list(material.diffuse_light_reflectivity),
+            material.specular_multiplier, material.specular_coefficient, material.reflective_index,
+            material.refractive_index, *_color_to_list(material.refractive_attenuation)]
+
+
+def _material_from_list(values):
+    return Material(ambient_light_reflectivity=Color(*values[0:3]), diffuse_light_reflectivity=Color(*values[3:6]),
+                    specular_multiplier=values[6], specular_coefficient=values[7], reflective_index=values[8],
+                    refractive_index=values[9], refractive_attenuation=Color(*values[10:13]))
+
+
+def _light_source_to_dict(light_source):
+    if type(light_source).__name__ not in _LIGHT_CLASSES:
+        raise TypeError(f"Cannot save light sources of class {type(light_source).__name__}")
+    data = {'type': type(light_source).__name__, 'intensity': _color_to_list(light_source.intensity)}
+    if isinstance(light_source, PointLightSource):
+        data.update(intensity_booster=light_source.intensity_booster,
+                    position=_vector_to_list(light_source.position))
+    elif isinstance(light_source, LightSourceAtInfinity):
+        data.update(direction=_vector_to_list(light_source.direction))
+    return data
+
+
+def _light_source_from_dict(data):
+    cls = _LIGHT_CLASSES[data['type']]
+    arguments = {'intensity': Color(*data['intensity'])}
+    if cls is PointLightSource:
+        arguments.update(intensity_booster=data['intensity_booster'], position=Vector(*data['position']))
+    elif cls is LightSourceAtInfinity:
+        arguments.update(direction=Vector(*data['direction']))
+    return cls(**arguments)
+
+
+def _solid_to_list(solid, material_indexes):
+    """
+    Class name, index of the material (None for objects made of several materials), origin and axes of the coordinate
+    system (12 numbers), and attributes of the class (see _SOLID_ATTRIBUTES)
+    Axes are saved rather than the orientation, since they cannot be computed back from it exactly
+    """
+    if type(solid) not in _SOLID_ATTRIBUTES:
+        raise TypeError(f"Cannot save objects of class {type(solid).__name__}")
+    coordinate_system = solid.coordinate_system
+    material = getattr(solid, 'material', None)
+    return [type(solid).__name__, material_indexes[id(material)] if material is not None else None,
+            *(value for vector in (coordinate_system.origin, coordinate_system.i_prime, coordinate_system.j_prime,
+                                   coordinate_system.k_prime) for value in _vector_to_list(vector)),
+            *(getattr(solid, attribute) for attribute in _SOLID_ATTRIBUTES[type(solid)])]
+
+
+def _solid_from_list(values, materials):
+    cls = _SOLID_CLASSES[values[0]]
+    coordinate_system = CoordinateSystem.from_axes(*(Vector(*values[i:i + 3]) for i in range(2, 14, 3)))
+    arguments = dict(zip(_SOLID_ATTRIBUTES[cls], values[14:]))
+    if values[1] is not None:
+        arguments['material'] = materials[values[1]]
+    if cls is SmoothSphere:
+        arguments['position'] = coordinate_system.origin
+    else:
+        arguments['coordinate_system'] = coordinate_system
+    solid = cls(**arguments)
+    solid.coordinate_system = coordinate_system  # Spheres build their own, which might differ from the saved one
+    return solid
+
+
+def scene_to_dict(scene):
+    """Description of a scene with only dicts, lists, numbers, strings and None, which can be saved as JSON"""
+    materials = []
+    material_indexes = {}
+    for solid in scene.objects:
+        material = getattr(solid, 'material', None)
+        if material is not None and id(material) not in material_indexes:
+            material_indexes[id(material)] = len(materials)
+            materials.append(material)
+
+    camera = scene.camera.parameters
+    ambient_light = scene.illumination.ambient_light
+    return {
+        'format': SCENE_FORMAT,
+        'version': SCENE_FORMAT_VERSION,
+        'camera': {**camera, 'position': _vector_to_list(camera['position']),
+                   'direction': _vector_to_list(camera['direction'])},
+        'illumination': {
+            # Ambient light is either a light source or just a color
+            'ambient_light': _light_source_to_dict(ambient_light) if isinstance(ambient_light, LightSource)
+            else _color_to_list(ambient_light),
+            'light_sources': [_light_source_to_dict(light_source)
+                              for light_source in scene.illumination.light_sources],
+        },
+        'materials': [_material_to_list(material) for material in materials],
+        'objects': [_solid_to_list(solid, material_indexes) for solid in scene.objects],
+        'use_bvh': scene.use_bvh,
+        'min_ray_weight': scene.min_ray_weight,
+        'russian_roulette': scene.russian_roulette,
+        'kernel_backend': scene.kernel_backend,
+        'roulette_seed': scene.roulette_seed,
+    }
+
+
+def scene_from_dict(data):
+    """Scene described by a dict made by scene_to_dict"""
+    if data.get('format') != SCENE_FORMAT:
+        raise ValueError("Not a scene description")
+    if data.get('version') != SCENE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported scene format version: {data.get('version')}. "
+                         f"This version of py-cgi reads version {SCENE_FORMAT_VERSION}")
+    camera = data['camera']
+    camera = Camera(resolution=tuple(camera['resolution']), position=Vector(*camera['position']),
+                    direction=Vector(*camera['direction']), zoom=camera['zoom'], tilt_angle=camera['tilt_angle'])
+    ambient_light = data['illumination']['ambient_light']
+    ambient_light = Color(*ambient_light) if isinstance(ambient_light, list) else \
+        _light_source_from_dict(ambient_light)
+    illumination = Illumination(ambient_light=ambient_light,
+                                light_sources=[_light_source_from_dict(light_source)
+                                               for light_source in data['illumination']['light_sources']])
+    materials = [_material_from_list(material) for material in data['materials']]
+    objects = [_solid_from_list(solid, materials) for solid in data['objects']]
+    return Scene(camera, objects, illumination, use_bvh=data['use_bvh'],
+                 min_ray_weight=data.get('min_ray_weight', 0.0), russian_roulette=data.get('russian_roulette', False),
+                 kernel_backend=data.get('kernel_backend', DEFAULT_BACKEND), roulette_seed=data.get('roulette_seed', 0))
+
+
+class _PlainValueUnpickler(Unpickler):
+    """Unpickler which only accepts plain values (no classes), so that loading a file cannot run any code"""
+
+    def find_class(self, module, name):
+        raise UnpicklingError(f"Scene files cannot contain {module}.{name}")
+
+
+def _open(file_name, mode):
+    return gzip.open(file_name, mode) if file_name.endswith('.gz') else open(file_name, mode)
+
+
+def save_scene(scene, file_name):
+    """
+    Save scene to file, as JSON if the file name ends with .json or .json.gz, or in binary format otherwise
+    Files whose name ends with .gz are compressed with gzip
+    """
+    data = scene_to_dict(scene)
+    with _open(file_name, 'wb') as scene_file:
+        if file_name.endswith(('.json', '.json.gz')):
+            scene_file.write(json.dumps(data, separators=(',', ':')).encode())
+        else:
+            dump(data, scene_file, protocol=HIGHEST_PROTOCOL)
+
+
+def load_scene(file_name):
+    """Load scene saved with save_scene"""
+    with _open(file_name, 'rb') as scene_file:
+        if file_name.endswith(('.json', '.json.gz')):
+            return scene_from_dict(json.load(scene_file))
+        return scene_from_dict(_PlainValueUnpickler(scene_file).load())
+
+
+if __name__ == '__main__':
+    with redirect_stdout(StringIO()):
+        module = import_module(argv[1])
+    save_scene(module.scene if hasattr(module, 'scene') else module.scene_at_frame(0), argv[2])
+    print(f"Scene saved to {argv[2]}.")
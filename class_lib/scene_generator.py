@@ -0,0 +1,99 @@
+from math import pi
+from random import Random
+
+from basics import Vector
+
+from class_lib.color import Color, WHITE
+from class_lib.coordinate_system import CoordinateSystem
+from class_lib.imaging import Camera, Scene
+from class_lib.light import AmbientLight, Illumination, LightSourceAtInfinity, PointLightSource
+from class_lib.solid_objects import Material
+from class_lib.solids.ellipsoid import Ellipsoid
+from class_lib.solids.paraboloid import Paraboloid
+from class_lib.solids.plane import SmoothPlane
+from class_lib.solids.sphere import SmoothSphere
+
+SHAPES = ('sphere', 'ellipsoid', 'paraboloid', 'plane')
+
+
+class SceneGenerator:
+    """
+    Seeded generator of random scenes, to measure how rendering scales with the number of objects and light sources,
+    and with the fraction of reflective and refractive materials
+    Objects are scattered in a cube whose volume grows with their number, so that the image looks about as crowded for
+    any number of objects. Every object is bounded (planes are rectangles), so that any scene can use a BVH
+    """
+
+    def __init__(self, seed=0):
+        self.__random = Random(seed)
+
+    def __random_unit_vector(self):
+        return Vector(self.__random.gauss(0, 1), self.__random.gauss(0, 1), self.__random.gauss(0, 1)).unit
+
+    def __random_color(self, brightness=1.0):
+        return Color(*(brightness * self.__random.random() for _ in range(3)))
+
+    def random_material(self, reflective_fraction=0.0, refractive_fraction=0.0):
+        """Random material, which is reflective and/or refractive with given probabilities"""
+        random = self.__random
+        reflective_index = random.uniform(.2, .6) if random.random() < reflective_fraction else 0
+        if random.random() < refractive_fraction:
+            return Material(diffuse_light_reflectivity=self.__random_color(.1), specular_multiplier=.5,
+                            reflective_index=reflective_index, refractive_index=random.uniform(1.05, 1.5),
+                            refractive_attenuation=self.__random_color(.05))
+        return Material(diffuse_light_reflectivity=self.__random_color(), specular_multiplier=random.uniform(0, .6),
+                        specular_coefficient=random.choice((5, 10, 20, 50)), reflective_index=reflective_index)
+
+    def random_object(self, shape, center, size, material):
+        """Randomly oriented object of given shape ('sphere', 'ellipsoid', 'paraboloid' or 'plane') and size"""
+        random = self.__random
+        if shape == 'sphere':
+            return SmoothSphere(center, size, material)
+        coordinate_system = CoordinateSystem(origin=center, orientation=self.__random_unit_vector(),
+                                             angle=random.uniform(0, 2 * pi))
+        if shape == 'ellipsoid':
+            return Ellipsoid(coordinate_system, material, *(size * random.uniform(1, 2) for _ in range(3)))
+        if shape == 'paraboloid':
+            return Paraboloid(coordinate_system, material, a=random.uniform(.5, 2) / size,
+                              b=random.uniform(.5, 2) / size, z_max=size)
+        if shape == 'plane':
+            return SmoothPlane(coordinate_system, material, width=size * random.uniform(1, 3),
+                               length=size * random.uniform(1, 3))
+        raise ValueError(f"Unknown shape: '{shape}'. Use one of {', '.join(SHAPES)}")
+
+    def scene(self, num_objects=100, num_lights=2, reflective_fraction=0.2, refractive_fraction=0.1,
+              resolution=(45, 60), shapes=SHAPES, use_bvh=False):
+        """
+        Generate a random scene
+        :param num_objects: Number of solid objects
+        :param num_lights: Number of light sources, alternately at infinity and point light sources
+        :param reflective_fraction: Probability of an object being reflective
+        :param refractive_fraction: Probability of an object being refractive
+        :param resolution: Camera resolution (height, width)
+        :param shapes: Shapes the objects are chosen from
+        :param use_bvh: Whether the scene uses a bounding volume hierarchy
+        """
+        random = self.__random
+        half_side = 1.2 * max(num_objects, 1) ** (1 / 3)  # Constant density of objects
+        objects = []
+        for _ in range(num_objects):
+            center = Vector(*(random.uniform(-half_side, half_side) for _ in range(3)))
+            material = self.random_material(reflective_fraction, refractive_fraction)
+            objects.append(self.random_object(random.choice(shapes), center, random.uniform(.3, .8), material))
+
+        light_sources = []
+        for i in range(num_lights):
+            intensity = WHITE * (1.5 / num_lights)
+            if i % 2 == 0:
+                light_sources.append(LightSourceAtInfinity(intensity=intensity,
+                                                           direction=self.__random_unit_vector()))
+            else:
+                position = Vector(*(random.uniform(-half_side, half_side) for _ in range(2)), 2 * half_side)
+                light_sources.append(PointLightSource(intensity=intensity, intensity_booster=4 * half_side ** 2,
+                                                      position=position))
+        illumination = Illumination(ambient_light=AmbientLight(intensity=WHITE * 0.2), light_sources=light_sources)
+
+        camera_position = Vector(3 * half_side, half_side, 1.5 * half_side)
+        camera = Camera(resolution=resolution, position=camera_position, direction=-camera_position, zoom=1,
+                        tilt_angle=0)
+        return Scene(camera, objects, illumination, use_bvh=use_bvh)
@@ -0,0 +1,43 @@
+"""
+Scenes available by name: every module of pre_cooked_scenes, which is only imported when its scene is requested, and
+scene files saved with class_lib.scene_files
+This module only imports the standard library, so that listing scenes, or parsing the command line, is fast
+"""
+from contextlib import redirect_stdout
+from importlib import import_module
+from io import StringIO
+from os.path import isfile
+from pkgutil import iter_modules
+from random import seed as seed_random
+
+SCENE_PACKAGE = 'pre_cooked_scenes'
+
+
+def scene_names():
+    """Names of the scene modules, found without importing them"""
+    return sorted(module_info.name for module_info in iter_modules(import_module(SCENE_PACKAGE).__path__))
+
+
+def _scene_module(name):
+    if name not in scene_names():
+        raise ValueError(f"Unknown scene: '{name}'. Use a scene file, or one of {', '.join(scene_names())}")
+    with redirect_stdout(StringIO()):  # Some modules print while building their scene
+        return import_module(f'{SCENE_PACKAGE}.{name}')
+
+
+def get_scene(name, frame_index=0, seed=None):
+    """
+    Scene given by the name of its module in pre_cooked_scenes, or by the name of a scene file
+    :param name: Module name (such as 'mentos') or file name
+    :param frame_index: Frame whose scene is given, for modules describing an animation
+    :param seed: If not None, seeds the random choices made by the module, so that the scene is always the same
+    """
+    if isfile(name):
+        from class_lib.scene_files import load_scene
+        return load_scene(name)
+    if seed is not None:
+        seed_random(seed)
+    module = _scene_module(name)
+    if hasattr(module, 'scene'):
+        return module.scene
+    return module.scene_at_frame(frame_index)
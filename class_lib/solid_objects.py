@@ -1,7 +1,12 @@
 from abc import ABC, abstractmethod
 
+from functools import lru_cache
+
+from basics import Vector
+from numpy import arange, flatnonzero, full, zeros
 from class_lib.color import *
-from math import log, exp
+from class_lib.render_stats import RenderStats
+from math import inf, log, exp
 
 
 class Material:
@@ -38,13 +43,28 @@ class Material:
                self.__refractive_attenuation.green < 1 or \
                self.__refractive_attenuation.blue < 1
 
+    @property
+    def refractive_attenuation(self):
+        return self.__refractive_attenuation
+
+    @property
+    def refractive_attenuation_constants(self):
+        """Exponent decay constants of light travelling inside the material, in RGB"""
+        return self.__refractive_attenuation_consts
+
     def attenuate_by_refraction(self, original_color, distance_travelled):
         new_red = original_color.red * exp(self.__refractive_attenuation_consts.red * distance_travelled)
         new_green = original_color.green * exp(self.__refractive_attenuation_consts.green * distance_travelled)
         new_blue = original_color.blue * exp(self.__refractive_attenuation_consts.blue * distance_travelled)
         return Color(new_red, new_green, new_blue)
 
+    def max_transmittance(self, distance_travelled):
+        """Largest fraction, among red, green and blue, of the light left after travelling inside the material"""
+        consts = self.__refractive_attenuation_consts
+        return exp(max(consts.red, consts.green, consts.blue) * distance_travelled)
+
     @staticmethod
+    @lru_cache(maxsize=None)
     def __exp_constant(p):
         """Exponent decay constant"""
         if p < 1:
@@ -54,6 +74,7 @@ class Material:
 
 class Chip:
     """A small chip of material, with a position and a normal vector"""
+    __slots__ = ('position', 'normal', 'material')
 
     def __init__(self, position, normal, material):
         self.position = position
@@ -61,32 +82,193 @@ class Chip:
         self.material = material
 
 
+class Hit(Chip):
+    """
+    Nearest hit of a ray found so far, updated in place as objects are tested: object hit (None until one is), its
+    index (so that objects at the same distance are chosen as by a scan of the list of objects) and distance, and the
+    ray in the object's coordinate system, kept from the intersection test so that the point hit is not converted again
+    Once the nearest hit is known, set_surface makes the record the chip of material at the point hit
+    """
+    __slots__ = ('obj', 'index', 'distance', 'local_initial_point', 'local_direction')
+
+    def __init__(self):
+        # Surface attributes are set with set_surface. Attributes are set directly, since a record is created per ray
+        self.position = self.normal = self.material = None
+        self.obj = None
+        self.index = -1
+        self.distance = inf
+        self.local_initial_point = None
+        self.local_direction = None
+
+    def is_closer(self, distance, index):
+        """Whether a hit at given distance, on the object with given index, is closer than the recorded one"""
+        return distance < self.distance or (distance == self.distance and index < self.index)
+
+    def set_surface(self, ray):
+        """Set position, normal and material of the point hit by given ray (the ray whose hit was recorded)"""
+        self.position = ray.position_at_time(self.distance)
+        self.obj.set_surface(self, self.local_initial_point + self.distance * self.local_direction)
+
+
 class AbstractObject(ABC):
     """Abstract object with position and orientation"""
 
+    INTERSECTION_COST = 1  # Rough cost of an intersection test, relative to that of a plane
+
+    # The bounding sphere is computed when needed, and again whenever an attribute of the object or of its coordinate
+    # system was set since, so that it is never stale
+    __CACHED = ('_AbstractObject__bounding_sphere', '_AbstractObject__bounding_sphere_version')
+    __bounding_sphere = None
+    __bounding_sphere_version = None  # Version of the coordinate system when the bounding sphere was computed
+
     def __init__(self, coordinate_system):
-        self.coordinate_system = coordinate_system
+        self.__coordinate_system = coordinate_system
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name not in AbstractObject.__CACHED:
+            super().__setattr__('_AbstractObject__bounding_sphere_version', None)
+
+    def __getstate__(self):
+        """Attributes of the object, without the cached bounding sphere"""
+        return {name: value for name, value in self.__dict__.items() if name not in AbstractObject.__CACHED}
+
+    @property
+    def coordinate_system(self):
+        return self.__coordinate_system
+
+    @coordinate_system.setter
+    def coordinate_system(self, coordinate_system):
+        self.__coordinate_system = coordinate_system
+
+    def __update_bounding_sphere(self):
+        self.__bounding_sphere = self.bounding_sphere()
+        self.__bounding_sphere_version = self.__coordinate_system.version
 
     def intersection_distance(self, ray):
-        new_ray_init_point = self.coordinate_system.convert_position(ray.initial_point)
-        new_ray_direction = self.coordinate_system.convert_direction(ray.direction)
-        return self.easier_intersection(new_ray_init_point, new_ray_direction)
+        if self.__bounding_sphere_version != self.__coordinate_system.version:
+            self.__update_bounding_sphere()
+        bounding_sphere = self.__bounding_sphere
+        if bounding_sphere is not None and not bounding_sphere.may_be_hit_by_ray(ray.initial_point, ray.direction):
+            if RenderStats.active is not None:
+                RenderStats.active.count_intersections(self, 1, 0)
+            return None
+        new_ray_init_point, new_ray_direction = self.coordinate_system.convert_ray(ray.initial_point, ray.direction)
+        distance = self.easier_intersection(new_ray_init_point, new_ray_direction)
+        if RenderStats.active is not None:
+            RenderStats.active.count_intersections(self, 1, 1 if distance else 0)
+        return distance
 
-    def chip_at(self, position):
-        relative_position = self.coordinate_system.convert_position(position)
+    def record_hit(self, ray, hit, obj_index):
+        """
+        Same as intersection_distance, but the hit is recorded in given Hit, with the ray converted to the object's
+        coordinate system, if it is closer than the hit already recorded. Returns whether it is
+        """
+        if self.__bounding_sphere_version != self.__coordinate_system.version:
+            self.__update_bounding_sphere()
+        bounding_sphere = self.__bounding_sphere
+        if bounding_sphere is not None and not bounding_sphere.may_be_hit_by_ray(ray.initial_point, ray.direction):
+            if RenderStats.active is not None:
+                RenderStats.active.count_intersections(self, 1, 0)
+            return False
+        new_ray_init_point, new_ray_direction = self.coordinate_system.convert_ray(ray.initial_point, ray.direction)
+        distance = self.easier_intersection(new_ray_init_point, new_ray_direction)
+        if RenderStats.active is not None:
+            RenderStats.active.count_intersections(self, 1, 1 if distance else 0)
+        if not distance or not hit.is_closer(distance, obj_index):
+            return False
+        hit.obj, hit.index, hit.distance = self, obj_index, distance
+        hit.local_initial_point, hit.local_direction = new_ray_init_point, new_ray_direction
+        return True
+
+    def set_surface(self, chip, relative_position):
+        """Set normal and material of a chip, given its position relative to the object"""
         normal = self.normal_at(relative_position)
-        fixed_normal = self.coordinate_system.deconvert_direction(normal)
-        material = self.material_at(relative_position)
-        return Chip(position, fixed_normal, material)
+        chip.normal = self.coordinate_system.deconvert_direction(normal)
+        chip.material = self.material_at(relative_position)
+        return chip
+
+    def chip_at(self, position):
+        return self.set_surface(Chip(position, None, None), self.coordinate_system.convert_position(position))
+
+    def intersection_distances(self, ray_initial_points, ray_directions):
+        """
+        Vectorized version of intersection_distance, for arrays of rays (one per row)
+        Returns inf for the rays which do not intersect the object
+        """
+        if self.__bounding_sphere_version != self.__coordinate_system.version:
+            self.__update_bounding_sphere()
+        bounding_sphere = self.__bounding_sphere
+        candidates = None if bounding_sphere is None else flatnonzero(
+            bounding_sphere.may_be_hit_by_rays(ray_initial_points, ray_directions))
+        if candidates is not None and len(candidates) < len(ray_initial_points):
+            # Only rays which may hit the object are converted to its coordinate system
+            distances = full(len(ray_initial_points), inf)
+            if len(candidates) > 0:
+                distances[candidates] = self.__easier_intersections_in_world(ray_initial_points[candidates],
+                                                                             ray_directions[candidates])
+        else:
+            distances = self.__easier_intersections_in_world(ray_initial_points, ray_directions)
+        if RenderStats.active is not None:
+            RenderStats.active.count_intersections(self, len(distances), int((distances < inf).sum()))
+        return distances
+
+    def __easier_intersections_in_world(self, ray_initial_points, ray_directions):
+        new_ray_init_points = self.coordinate_system.convert_positions(ray_initial_points)
+        new_ray_directions = self.coordinate_system.convert_directions(ray_directions)
+        return self.easier_intersections(new_ray_init_points, new_ray_directions)
+
+    def normals_and_materials_at(self, positions):
+        """
+        Vectorized version of chip_at
+        Returns the normals (one per row), a material table, and the index in the table of each chip's material
+        """
+        relative_positions = self.coordinate_system.convert_positions(positions)
+        normals = self.coordinate_system.deconvert_directions(self.normals_at(relative_positions))
+        material_table = self.material_table
+        if material_table is None:
+            # Materials are only available one at a time
+            material_table = [self.material_at(Vector(x, y, z)) for x, y, z in relative_positions.tolist()]
+            return normals, material_table, arange(len(material_table))
+        return normals, material_table, self.material_indexes_at(relative_positions)
+
+    def bounding_box(self):
+        """Axis-aligned BoundingBox containing the whole object, or None if the object is unbounded"""
+        return None
+
+    def bounding_sphere(self):
+        """BoundingSphere containing the whole object, or None if the object is unbounded"""
+        return None
+
+    @property
+    def material_table(self):
+        """
+        List of every material the object is made of, or None if they can only be found with material_at
+        Objects made of a single material have a table with only that material
+        """
+        material = getattr(self, 'material', None)
+        return [material] if material is not None else None
+
+    def material_indexes_at(self, rel_positions):
+        """Vectorized version of material_at: index in material_table of the material at each relative position"""
+        return zeros(len(rel_positions), dtype=int)
 
     @abstractmethod
     def normal_at(self, rel_position):
         raise NotImplementedError("Must be overridden")
 
+    @abstractmethod
+    def normals_at(self, rel_positions):
+        raise NotImplementedError("Must be overridden")
+
     @abstractmethod
     def material_at(self, rel_position):
         raise NotImplementedError("Must be overridden")
 
     @abstractmethod
     def easier_intersection(self, ray_p0, ray_dir):
-        raise NotImplementedError("Must be overridden")
\ No newline at end of file
+        raise NotImplementedError("Must be overridden")
+
+    @abstractmethod
+    def easier_intersections(self, ray_p0s, ray_dirs):
+        raise NotImplementedError("Must be overridden")
@@ -1,29 +1,73 @@
 from basics import Vector
+from class_lib.bounding_volumes import BoundingBox, BoundingSphere
+from class_lib.kernels import active_backend
 from class_lib.solid_objects import AbstractObject
-from class_lib.useful_functions import min_pos_root
+from class_lib.useful_functions import min_pos_root, unit_rows
 
 
 class Ellipsoid(AbstractObject):
+    INTERSECTION_COST = 2
 
     def __init__(self, coordinate_system, material, width=1, length=1, height=1):
         super().__init__(coordinate_system)
         self.material = material
-        self.width = width
-        self.length = length
-        self.height = height
+        self.__set_dimensions(width, length, height)
+
+    def __set_dimensions(self, width, length, height):
+        self.__width, self.__length, self.__height = width, length, height
+        # Coefficients of the surface x² / width² + y² / length² + z² / height² = 1 / 4
+        self.__inverse_squares = (1 / width ** 2, 1 / length ** 2, 1 / height ** 2)
+
+    @property
+    def width(self):
+        return self.__width
+
+    @width.setter
+    def width(self, width):
+        self.__set_dimensions(width, self.__length, self.__height)
+
+    @property
+    def length(self):
+        return self.__length
+
+    @length.setter
+    def length(self, length):
+        self.__set_dimensions(self.__width, length, self.__height)
+
+    @property
+    def height(self):
+        return self.__height
+
+    @height.setter
+    def height(self, height):
+        self.__set_dimensions(self.__width, self.__length, height)
 
     def material_at(self, rel_position):
         return self.material
 
     def easier_intersection(self, ray_p0, ray_dir):
-        a = (ray_dir.x / self.width) ** 2 + (ray_dir.y / self.length) ** 2 + (ray_dir.z / self.height) ** 2
-        b = 2 * ((ray_p0.x * ray_dir.x) / self.width ** 2 +
-                 (ray_p0.y * ray_dir.y) / self.length ** 2 +
-                 (ray_p0.z * ray_dir.z) / self.height ** 2)
-        c = (ray_p0.x / self.width) ** 2 + (ray_p0.y / self.length) ** 2 + (ray_p0.z / self.height) ** 2 - 0.25
+        kx, ky, kz = self.__inverse_squares
+        px, py, pz = ray_p0.x, ray_p0.y, ray_p0.z
+        dx, dy, dz = ray_dir.x, ray_dir.y, ray_dir.z
+        a = kx * dx * dx + ky * dy * dy + kz * dz * dz
+        b = 2 * (kx * px * dx + ky * py * dy + kz * pz * dz)
+        c = kx * px * px + ky * py * py + kz * pz * pz - 0.25
         return min_pos_root(a, b, c)
 
+    def easier_intersections(self, ray_p0s, ray_dirs):
+        return active_backend().ellipsoid(ray_p0s, ray_dirs, *self.__inverse_squares)
+
+    def bounding_box(self):
+        half_sides = (self.width / 2, self.length / 2, self.height / 2)
+        return BoundingBox.around_local_box(self.coordinate_system, [-h for h in half_sides], half_sides)
+
+    def bounding_sphere(self):
+        origin = self.coordinate_system.origin
+        return BoundingSphere((origin.x, origin.y, origin.z), max(self.width, self.length, self.height) / 2)
+
     def normal_at(self, rel_position):
-        return Vector(rel_position.x / self.width ** 2,
-                      rel_position.y / self.length ** 2,
-                      rel_position.z / self.height ** 2).unit
+        kx, ky, kz = self.__inverse_squares
+        return Vector(rel_position.x * kx, rel_position.y * ky, rel_position.z * kz).unit
+
+    def normals_at(self, rel_positions):
+        return unit_rows(rel_positions * self.__inverse_squares)
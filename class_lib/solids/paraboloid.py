@@ -1,9 +1,15 @@
+from math import inf
+
 from basics import Vector
+from numpy import column_stack, full
+from class_lib.bounding_volumes import BoundingBox, BoundingSphere
+from class_lib.kernels import active_backend
 from class_lib.solid_objects import AbstractObject
-from class_lib.useful_functions import min_pos_root, all_pos_roots
+from class_lib.useful_functions import ordered_pos_root_pair, unit_rows
 
 
 class Paraboloid(AbstractObject):
+    INTERSECTION_COST = 2.5
 
     def __init__(self, coordinate_system, material, a=1, b=1, z_max=None):
         super().__init__(coordinate_system)
@@ -20,18 +26,46 @@ class Paraboloid(AbstractObject):
         aux_b = 2 * (self.a * (ray_p0.x * ray_dir.x) +
                      self.b * (ray_p0.y * ray_dir.y)) - ray_dir.z
         aux_c = self.a * ray_p0.x ** 2 + self.b * ray_p0.y ** 2 - ray_p0.z
-        intersections = all_pos_roots(aux_a, aux_b, aux_c)
-        if not intersections or len(intersections) == 0:
+        first, second = ordered_pos_root_pair(aux_a, aux_b, aux_c)
+        if first == inf:
             return None
         if not self.z_max:
-            return min(intersections)
-        for time in intersections:
-            z = ray_p0.z + time * ray_dir.z
-            if self.z_max >= z >= -self.z_max:
-                return time
+            return first
+        # Use the first intersection whose height is within bounds
+        if self.z_max >= ray_p0.z + first * ray_dir.z >= -self.z_max:
+            return first
+        if second < inf and self.z_max >= ray_p0.z + second * ray_dir.z >= -self.z_max:
+            return second
         return None
 
+    def easier_intersections(self, ray_p0s, ray_dirs):
+        return active_backend().paraboloid(ray_p0s, ray_dirs, self.a, self.b, self.z_max or 0.0)
+
+    def bounding_box(self):
+        if not self.z_max or self.a <= 0 or self.b <= 0:
+            return None  # Unbounded
+        # Surface is z = a * x² + b * y², with 0 <= z <= z_max
+        half_width = (self.z_max / self.a) ** .5
+        half_length = (self.z_max / self.b) ** .5
+        return BoundingBox.around_local_box(self.coordinate_system, (-half_width, -half_length, 0),
+                                            (half_width, half_length, self.z_max))
+
+    def bounding_sphere(self):
+        if not self.z_max or self.a <= 0 or self.b <= 0:
+            return None  # Unbounded
+        # Sphere around the bounding box of the surface in the paraboloid's coordinates (see bounding_box)
+        half_width = (self.z_max / self.a) ** .5
+        half_length = (self.z_max / self.b) ** .5
+        center = self.coordinate_system.deconvert_position(Vector(0, 0, self.z_max / 2))
+        return BoundingSphere((center.x, center.y, center.z),
+                              (half_width ** 2 + half_length ** 2 + (self.z_max / 2) ** 2) ** .5)
+
     def normal_at(self, rel_position):
         return Vector(self.a * rel_position.x,
                       self.b * rel_position.y,
                       -.5).unit
+
+    def normals_at(self, rel_positions):
+        return unit_rows(column_stack((self.a * rel_positions[:, 0],
+                                       self.b * rel_positions[:, 1],
+                                       full(len(rel_positions), -.5))))
@@ -1,7 +1,10 @@
 from abc import ABC, abstractmethod
 from math import floor
 from basics import Vector
+from numpy import zeros, floor as array_floor
+from class_lib.bounding_volumes import BoundingBox, BoundingSphere
 from class_lib.color import *
+from class_lib.kernels import active_backend
 from class_lib.solid_objects import AbstractObject, Material
 from globals import MIN_DIST
 
@@ -15,6 +18,11 @@ class AbstractPlane(AbstractObject, ABC):
     def normal_at(self, rel_position):
         return Vector(0, 0, 1)
 
+    def normals_at(self, rel_positions):
+        normals = zeros((len(rel_positions), 3))
+        normals[:, 2] = 1
+        return normals
+
     def easier_intersection(self, ray_p0, ray_dir):
         if ray_dir.z == 0:
             return None
@@ -31,6 +39,21 @@ class AbstractPlane(AbstractObject, ABC):
                 return None
         return t
 
+    def easier_intersections(self, ray_p0s, ray_dirs):
+        return active_backend().plane(ray_p0s, ray_dirs, self.width or 0.0, self.length or 0.0)
+
+    def bounding_box(self):
+        if not self.width or not self.length:
+            return None  # Unbounded
+        return BoundingBox.around_local_box(self.coordinate_system, (-self.width / 2, -self.length / 2, 0),
+                                            (self.width / 2, self.length / 2, 0))
+
+    def bounding_sphere(self):
+        if not self.width or not self.length:
+            return None  # Unbounded
+        origin = self.coordinate_system.origin
+        return BoundingSphere((origin.x, origin.y, origin.z), (self.width ** 2 + self.length ** 2) ** .5 / 2)
+
     @abstractmethod
     def material_at(self, rel_position):
         return NotImplementedError("Must be overridden")
@@ -47,13 +70,24 @@ class SmoothPlane(AbstractPlane):
 
 
 class CheckeredPlane(AbstractPlane):
+    # Materials of light and dark cells, shared by all checkered planes
+    __CELL_MATERIALS = [Material(diffuse_light_reflectivity=Color(.8, .8, .8)),
+                        Material(diffuse_light_reflectivity=Color(.1, .1, .1))]
+
     def __init__(self, coordinate_system, cell_size=1, width=None, length=None):
         super().__init__(coordinate_system, width, length)
         self.cell_size = cell_size
 
+    @property
+    def material_table(self):
+        return CheckeredPlane.__CELL_MATERIALS
+
     def material_at(self, rel_position):
         aux_x = floor(rel_position.x / self.cell_size)
         aux_y = floor(rel_position.y / self.cell_size)
-        if (aux_x + aux_y) % 2 == 0:
-            return Material(diffuse_light_reflectivity=Color(.8, .8, .8))
-        return Material(diffuse_light_reflectivity=Color(.1, .1, .1))
+        return CheckeredPlane.__CELL_MATERIALS[(aux_x + aux_y) % 2]
+
+    def material_indexes_at(self, rel_positions):
+        aux_x = array_floor(rel_positions[:, 0] / self.cell_size)
+        aux_y = array_floor(rel_positions[:, 1] / self.cell_size)
+        return ((aux_x + aux_y) % 2).astype(int)
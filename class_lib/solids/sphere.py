@@ -1,25 +1,54 @@
 from abc import ABC, abstractmethod
+from class_lib.bounding_volumes import BoundingBox, BoundingSphere
 from class_lib.color import *
 from class_lib.coordinate_system import CoordinateSystem
+from class_lib.kernels import active_backend
 from class_lib.solid_objects import AbstractObject, Material
-from class_lib.useful_functions import min_pos_root
+from class_lib.useful_functions import min_pos_root, unit_rows
 from math import atan2, degrees, pi, floor
+from numpy import arctan2, degrees as array_degrees, floor as array_floor, where
 
 
 class Sphere(AbstractObject, ABC):
+    INTERSECTION_COST = 1.5
+
     def __init__(self, coordinate_system, radius):
         super().__init__(coordinate_system)
         self.radius = radius
 
+    @property
+    def radius(self):
+        return self.__radius
+
+    @radius.setter
+    def radius(self, radius):
+        self.__radius = radius
+        self.__radius_sq = radius * radius
+
     def normal_at(self, rel_position):
         return rel_position.unit
 
+    def normals_at(self, rel_positions):
+        return unit_rows(rel_positions)
+
     def easier_intersection(self, ray_p0, ray_dir):
         a = 1  # Because ray direction is unit. Otherwise, should be ray.direction.length_sq
         b = 2 * ray_dir * ray_p0
-        c = ray_p0.length_sq - self.radius * self.radius
+        c = ray_p0.length_sq - self.__radius_sq
         return min_pos_root(a, b, c)
 
+    def easier_intersections(self, ray_p0s, ray_dirs):
+        return active_backend().sphere(ray_p0s, ray_dirs, self.__radius_sq)
+
+    def bounding_box(self):
+        center = self.coordinate_system.origin
+        return BoundingBox((center.x - self.radius, center.y - self.radius, center.z - self.radius),
+                           (center.x + self.radius, center.y + self.radius, center.z + self.radius))
+
+    def bounding_sphere(self):
+        origin = self.coordinate_system.origin
+        return BoundingSphere((origin.x, origin.y, origin.z), self.radius)
+
     @abstractmethod
     def material_at(self, rel_position):
         return NotImplementedError("Must be overridden")
@@ -40,28 +69,40 @@ class SmoothSphere(Sphere):
 class BeachBall(Sphere):
     """Sphere with beach ball pattern"""
 
+    # Materials shared by all beach balls: top cap, bottom cap, and then the six stripes
+    __MATERIALS = [Material(diffuse_light_reflectivity=Color(.8, .2, 0)),
+                   Material(diffuse_light_reflectivity=Color(0, .8, .2))] + [
+                      Material(diffuse_light_reflectivity=color, specular_multiplier=.5, specular_coefficient=20)
+                      for color in (Color(.8, 0, 0), Color(0, .8, 0), Color(0, 0, .8), Color(.8, .8, .8),
+                                    Color(.8, 0, .8), Color(0, .8, .8))]
+    __TOP_CAP, __BOTTOM_CAP, __FIRST_STRIPE, __NUM_STRIPES = 0, 1, 2, 6
+
     def __init__(self, coordinate_system, radius):
         super().__init__(coordinate_system, radius)
 
     @staticmethod
     def __stripe(angle):
-        colors = [Color(.8, 0, 0), Color(0, .8, 0), Color(0, 0, .8), Color(.8, .8, .8), Color(.8, 0, .8),
-                  Color(0, .8, .8)]
-        materials = []
-        for i in range(6):
-            materials.append(
-                Material(diffuse_light_reflectivity=colors[i], specular_multiplier=.5, specular_coefficient=20))
+        """Index of the stripe at given angle"""
         offset_angle = angle + pi / 2
         angle_degrees = degrees(offset_angle)
-        angle_index = floor(angle_degrees / 60)
-        return materials[angle_index]
+        angle_index = floor(angle_degrees / 60) % BeachBall.__NUM_STRIPES
+        return BeachBall.__FIRST_STRIPE + angle_index
+
+    @property
+    def material_table(self):
+        return BeachBall.__MATERIALS
 
     def material_at(self, rel_position):
-        top_cap = Material(diffuse_light_reflectivity=Color(.8, .2, 0))
-        bottom_cap = Material(diffuse_light_reflectivity=Color(0, .8, .2))
         if rel_position.z > 0.9 * self.radius:
-            return top_cap
+            return BeachBall.__MATERIALS[BeachBall.__TOP_CAP]
         elif rel_position.z < -0.9 * self.radius:
-            return bottom_cap
+            return BeachBall.__MATERIALS[BeachBall.__BOTTOM_CAP]
         angle = atan2(rel_position.x, rel_position.y)
-        return BeachBall.__stripe(angle)
+        return BeachBall.__MATERIALS[BeachBall.__stripe(angle)]
+
+    def material_indexes_at(self, rel_positions):
+        angle_degrees = array_degrees(arctan2(rel_positions[:, 0], rel_positions[:, 1]) + pi / 2)
+        stripes = BeachBall.__FIRST_STRIPE + (array_floor(angle_degrees / 60) % BeachBall.__NUM_STRIPES).astype(int)
+        heights = rel_positions[:, 2]
+        return where(heights > 0.9 * self.radius, BeachBall.__TOP_CAP,
+                     where(heights < -0.9 * self.radius, BeachBall.__BOTTOM_CAP, stripes))
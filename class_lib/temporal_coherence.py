@@ -0,0 +1,138 @@
+from numpy import array, full, nonzero, zeros
+
+from class_lib.imaging import Image
+from class_lib.parallel import split_into_tiles, render_tiles_in_parallel
+from class_lib.ray_packets import PacketTracer
+from class_lib.tile_cache import RayExtent, scene_settings_hash, stable_hash
+from class_lib.useful_functions import as_array
+
+
+class _SecondaryRayExtent(RayExtent):
+    """
+    Extent of the reflected, refracted and shadow rays of a tile. Primary rays are left out, since the pixels whose
+    primary rays can meet an object are found more precisely by projecting the object on the screen
+    """
+
+    def record_segments(self, initial_points, directions, lengths, label):
+        if label != 'primary':
+            super().record_segments(initial_points, directions, lengths, label)
+
+
+class _PixelTracer:
+    """
+    Picklable function tracing some pixels of a tile with the packet engine, given as (tile, rows, columns)
+    Returns their colors and the extent of their secondary rays
+    """
+
+    def __init__(self, scene):
+        self.__scene = scene
+
+    def __call__(self, task):
+        _, rows, columns = task
+        extent = _SecondaryRayExtent()
+        directions = self.__scene.camera.pixel_ray_directions(rows, columns)
+        initial_points = full(directions.shape, as_array(self.__scene.camera.position))
+        colors = PacketTracer(self.__scene, ray_recorder=extent).ray_trace(initial_points, directions)
+        return colors, extent.as_arrays()
+
+
+class TemporalCoherentRenderer:
+    """
+    Renders the consecutive frames of an animation, only re-tracing the pixels which may differ from the previous frame.
+    Objects which differ from the previous frame (moved or changed in any other way) are found by comparing hashes. A
+    pixel is re-traced if the box around the old or new version of such an object projects onto it, or if the
+    reflected, refracted or shadow rays of its tile could have met either box. Other pixels are copied, so every frame
+    is identical to a full render with the packet engine
+    """
+
+    def __init__(self, tile_size=8, num_workers=1):
+        """
+        Initialize renderer
+        :param tile_size: Side of the square tiles whose secondary rays are tracked together. Smaller tiles re-trace
+        fewer pixels, but take more time to check
+        :param num_workers: Number of processes tracing pixels
+        """
+        self.__tile_size = tile_size
+        self.__num_workers = num_workers
+        self.__settings_hash = None
+        self.__object_hashes = []
+        self.__boxes = []
+        self.__pixels = None
+        self.__tile_extents = {}
+        self.retraced_pixels = 0  # Number of pixels re-traced in the last frame
+
+    def __changed_boxes(self, object_hashes, boxes):
+        """
+        Boxes around the old and new versions of the objects which changed since the last frame
+        Returns None if every pixel must be re-traced
+        """
+        if self.__pixels is None or len(object_hashes) != len(self.__object_hashes):
+            return None
+        changed_boxes = []
+        for old_hash, new_hash, old_box, new_box in zip(self.__object_hashes, object_hashes, self.__boxes, boxes):
+            if old_hash != new_hash:
+                if old_box is None or new_box is None:
+                    return None
+                changed_boxes.extend([old_box, new_box])
+        return changed_boxes
+
+    @staticmethod
+    def __box_vertices(box):
+        return array([(x, y, z) for x in (box.minimum_corner[0], box.maximum_corner[0])
+                      for y in (box.minimum_corner[1], box.maximum_corner[1])
+                      for z in (box.minimum_corner[2], box.maximum_corner[2])])
+
+    def render(self, scene):
+        """Render the next frame of the animation. Returns an Image"""
+        camera = scene.camera
+        height, width = camera.image_height, camera.image_width
+        tiles = split_into_tiles(height, width, self.__tile_size)
+        settings_hash = scene_settings_hash(scene)
+        object_hashes = [stable_hash(obj) for obj in scene.objects]
+        boxes = [obj.bounding_box() for obj in scene.objects]
+        changed_boxes = self.__changed_boxes(object_hashes, boxes) if settings_hash == self.__settings_hash else None
+
+        # Pixels to re-trace, and tiles whose secondary rays are all re-traced (so their old extent is discarded)
+        retrace = zeros((height, width), dtype=bool)
+        whole_tiles = set()
+        if changed_boxes is None:
+            retrace[:] = True
+            whole_tiles.update(tiles)
+            self.__pixels = zeros((height, width, 3))
+        else:
+            for box in changed_boxes:
+                tile = camera.pixels_around_points(TemporalCoherentRenderer.__box_vertices(box))
+                if tile is not None:
+                    top, left, bottom, right = tile
+                    retrace[top:bottom, left:right] = True
+            for tile in tiles:
+                if any(self.__tile_extents[tile].intersects(box) for box in changed_boxes):
+                    top, left, bottom, right = tile
+                    retrace[top:bottom, left:right] = True
+                    whole_tiles.add(tile)
+
+        tasks = []
+        for tile in tiles:
+            top, left, bottom, right = tile
+            rows, columns = nonzero(retrace[top:bottom, left:right])
+            if len(rows) > 0:
+                tasks.append((tile, rows + top, columns + left))
+        trace_pixels = _PixelTracer(scene)
+        if self.__num_workers > 1:
+            traced = render_tiles_in_parallel(trace_pixels, tasks, self.__num_workers)
+        else:
+            traced = ((task, trace_pixels(task)) for task in tasks)
+
+        for (tile, rows, columns), (colors, (box_corners, sweeps)) in traced:
+            self.__pixels[rows, columns] = colors
+            extent = RayExtent.from_arrays(box_corners, sweeps)
+            if tile not in whole_tiles:
+                # Secondary rays of the pixels which were not re-traced are still in the old extent
+                extent = self.__tile_extents[tile].union(extent)
+            self.__tile_extents[tile] = extent
+
+        self.retraced_pixels = int(retrace.sum())
+        self.__settings_hash, self.__object_hashes, self.__boxes = settings_hash, object_hashes, boxes
+        image = Image(height, width)
+        image.set_tile((0, 0, height, width), self.__pixels)
+        return image
@@ -0,0 +1,267 @@
+from collections import Counter
+from hashlib import sha256
+from json import dump, load
+from math import inf
+from os import listdir, makedirs, remove, utime
+from os.path import getmtime, getsize, isfile, join
+
+from basics import Vector
+from numpy import array, errstate, float32, full, isinf, load as load_arrays, maximum, minimum, ndarray, \
+    savez_compressed
+
+from class_lib.bounding_volumes import BoundingBox
+from class_lib.parallel import render_tiles_in_parallel
+from class_lib.ray_packets import PacketTracer
+from globals import MAX_RECURSION_COUNTER, MIN_DIST
+
+CACHE_FORMAT_VERSION = 2  # Must be increased whenever a change in the code changes rendered colors
+
+
+def _canonical(value):
+    """String uniquely describing a value, which is the same in every process (unlike hash or id)"""
+    if value is None or isinstance(value, (bool, int, str)):
+        return repr(value)
+    if isinstance(value, float):
+        return value.hex()
+    if isinstance(value, Vector):
+        return 'Vector' + _canonical([float(value.x), float(value.y), float(value.z)])
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(_canonical(item) for item in value) + ']'
+    if isinstance(value, dict):
+        return '{' + ','.join(f'{_canonical(k)}:{_canonical(v)}' for k, v in sorted(value.items())) + '}'
+    if isinstance(value, ndarray):
+        return f'array({value.dtype},{value.shape},{sha256(value.tobytes()).hexdigest()})'
+    # Any other object is described by its class and attributes
+    state = getattr(value, '__getstate__', lambda: getattr(value, '__dict__', {}))()  # Without cached values
+    attributes = dict(state) if isinstance(state, dict) else {}
+    for cls in type(value).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if name.startswith('__') and not name.endswith('__'):
+                name = f'_{cls.__name__.lstrip("_")}{name}'  # Private slots are stored under their mangled names
+            if hasattr(value, name):
+                attributes[name] = getattr(value, name)
+    return f'{type(value).__module__}.{type(value).__qualname__}{_canonical(attributes)}'
+
+
+def stable_hash(*values):
+    """Hash of the given values, which is the same in every process and every run"""
+    return sha256(_canonical(list(values)).encode()).hexdigest()[:32]
+
+
+def scene_settings_hash(scene):
+    """Hash of everything, except the objects, on which the colors of the pixels of a scene depend"""
+    camera = scene.camera
+    camera_parameters = ((camera.image_height, camera.image_width), camera.position, camera.direction, camera.zoom,
+                         camera.tilt_angle)
+    return stable_hash(CACHE_FORMAT_VERSION, MAX_RECURSION_COUNTER, MIN_DIST, camera_parameters, scene.illumination,
+                       scene.background_color, scene.min_ray_weight, scene.russian_roulette, scene.roulette_seed)
+
+
+class RayExtent:
+    """
+    Region of space crossed by the rays traced for a tile, so that it can be known whether an object placed somewhere
+    could have been hit by any of them:
+    - A box containing every finite ray segment
+    - For rays that go on forever, one sweep per kind of ray: a box containing their initial points, swept along
+    every direction inside a box of directions
+    """
+
+    def __init__(self, box_corners=None, sweeps=None):
+        self.box_corners = box_corners if box_corners is not None else array([full(3, inf), full(3, -inf)])
+        self.sweeps = sweeps if sweeps is not None else {}
+
+    def record_segments(self, initial_points, directions, lengths, label):
+        """Add ray segments to the extent. Segments with infinite length are added to the sweep with given label"""
+        if len(initial_points) == 0:
+            return
+        infinite = isinf(lengths)
+        with errstate(invalid='ignore'):
+            end_points = initial_points + directions * lengths[:, None]
+        for points in (initial_points[~infinite], end_points[~infinite]):
+            if len(points) > 0:
+                self.record_box(array([points.min(axis=0), points.max(axis=0)]))
+        if infinite.any():
+            self.record_sweep(array([initial_points[infinite].min(axis=0), initial_points[infinite].max(axis=0),
+                                     directions[infinite].min(axis=0), directions[infinite].max(axis=0)]), label)
+
+    def record_box(self, box_corners):
+        """Add a box (minimum and maximum corners) to the box containing finite segments"""
+        self.box_corners = array([minimum(self.box_corners[0], box_corners[0]),
+                                  maximum(self.box_corners[1], box_corners[1])])
+
+    def record_sweep(self, sweep, label):
+        """Merge a sweep (minimum and maximum initial points, minimum and maximum directions) into the one with label"""
+        old_sweep = self.sweeps.get(label)
+        if old_sweep is not None:
+            sweep = array([minimum(old_sweep[0], sweep[0]), maximum(old_sweep[1], sweep[1]),
+                           minimum(old_sweep[2], sweep[2]), maximum(old_sweep[3], sweep[3])])
+        self.sweeps[label] = sweep
+
+    def intersects(self, box):
+        """True if any ray of the extent could have crossed given BoundingBox"""
+        lower, upper = array(box.minimum_corner), array(box.maximum_corner)
+        if (self.box_corners[0] <= upper).all() and (self.box_corners[1] >= lower).all():
+            return True
+        return any(RayExtent.__sweep_intersects(sweep, lower, upper) for sweep in self.sweeps.values())
+
+    @staticmethod
+    def __sweep_intersects(sweep, lower, upper):
+        """
+        True if there is a distance t >= 0 at which the swept box could overlap the given box. On each axis, points
+        at distance t lie between origin_min + t * direction_min and origin_max + t * direction_max
+        """
+        origin_min, origin_max, direction_min, direction_max = sweep
+        t_min, t_max = 0, inf
+        # Each condition is a + t * b <= c
+        conditions = [(origin_min[k], direction_min[k], upper[k]) for k in range(3)] + \
+                     [(-origin_max[k], -direction_max[k], -lower[k]) for k in range(3)]
+        for a, b, c in conditions:
+            if b == 0:
+                if a > c:
+                    return False
+            elif b > 0:
+                t_max = min(t_max, (c - a) / b)
+            else:
+                t_min = max(t_min, (c - a) / b)
+        return t_min <= t_max
+
+    def union(self, other):
+        """Extent containing the rays of both extents. Sweeps with the same label are merged"""
+        extent = RayExtent(self.box_corners.copy(), dict(self.sweeps))
+        extent.record_box(other.box_corners)
+        for label, sweep in other.sweeps.items():
+            extent.record_sweep(sweep, label)
+        return extent
+
+    def as_arrays(self):
+        sweeps = array(list(self.sweeps.values())) if self.sweeps else full((0, 4, 3), 0.0)
+        return self.box_corners, sweeps
+
+    @staticmethod
+    def from_arrays(box_corners, sweeps):
+        return RayExtent(box_corners, {i: sweep for i, sweep in enumerate(sweeps)})
+
+
+class _RecordingTileRenderer:
+    """Picklable function rendering a tile with the packet engine, returning its colors and the extent of its rays"""
+
+    def __init__(self, scene):
+        self.__scene = scene
+
+    def __call__(self, tile):
+        extent = RayExtent()
+        colors = PacketTracer(self.__scene, ray_recorder=extent).render_tile(tile)
+        return colors, extent.as_arrays()
+
+
+class TileCache:
+    """
+    Cache of rendered tiles on local disk, so that re-rendering a scene after a small change only traces the tiles
+    which could be affected by it
+    A tile is reused when the camera, illumination and tile are the same, and no object that was added, removed or
+    modified since it was rendered lies where the rays of the tile could have hit it. Least recently used tiles are
+    evicted when the cache grows larger than its maximum size
+    """
+
+    def __init__(self, directory='render_cache', max_size=512 * 2 ** 20):
+        """
+        Initialize tile cache
+        :param directory: Directory where cached tiles are stored
+        :param max_size: Maximum size of the cache, in bytes
+        """
+        self.__tiles_directory = join(directory, 'tiles')
+        self.__object_sets_directory = join(directory, 'object_sets')
+        self.__max_size = max_size
+        makedirs(self.__tiles_directory, exist_ok=True)
+        makedirs(self.__object_sets_directory, exist_ok=True)
+
+    def __save_object_set(self, object_hashes, boxes):
+        """Save the hashes and bounding boxes of the objects of a scene. Returns the key of the set"""
+        object_set_key = stable_hash(object_hashes)
+        file_name = join(self.__object_sets_directory, object_set_key + '.json')
+        if isfile(file_name):
+            utime(file_name)
+        else:
+            with open(file_name, 'w') as object_set_file:
+                dump([[h, [box.minimum_corner, box.maximum_corner] if box else None]
+                      for h, box in zip(object_hashes, boxes)], object_set_file)
+        return object_set_key
+
+    def __changed_boxes(self, object_set_key, object_hashes, boxes):
+        """
+        Bounding boxes of the objects which differ between a saved object set and the current objects (both the old
+        and the new versions of modified objects). Returns None if the set is missing or an unbounded object changed
+        """
+        file_name = join(self.__object_sets_directory, object_set_key + '.json')
+        if not isfile(file_name):
+            return None
+        with open(file_name) as object_set_file:
+            saved_objects = load(object_set_file)
+        saved_counts = Counter(h for h, _ in saved_objects)
+        current_counts = Counter(object_hashes)
+        saved_boxes = {h: box for h, box in saved_objects}
+        current_boxes = dict(zip(object_hashes, boxes))
+        changed_boxes = []
+        for h in saved_counts - current_counts:
+            if saved_boxes[h] is None:
+                return None
+            changed_boxes.append(BoundingBox(*saved_boxes[h], padding=0))
+        for h in current_counts - saved_counts:
+            if current_boxes[h] is None:
+                return None
+            changed_boxes.append(current_boxes[h])
+        return changed_boxes
+
+    def render_tiles(self, scene, tiles, num_workers=1):
+        """
+        Yields each tile with the array of its pixel colors, taken from the cache when possible
+        Tiles that need to be traced are rendered with the packet engine, possibly in a pool of worker processes
+        """
+        object_hashes = [stable_hash(obj) for obj in scene.objects]
+        boxes = [obj.bounding_box() for obj in scene.objects]
+        object_set_key = self.__save_object_set(object_hashes, boxes)
+        changed_boxes_by_set = {}
+        settings_hash = scene_settings_hash(scene)
+
+        tiles_to_render = {}
+        for tile in tiles:
+            tile_key = stable_hash(settings_hash, tile)
+            file_name = join(self.__tiles_directory, tile_key + '.npz')
+            if isfile(file_name):
+                with load_arrays(file_name) as cached:
+                    saved_set_key = str(cached['object_set'])
+                    if saved_set_key not in changed_boxes_by_set:
+                        changed_boxes_by_set[saved_set_key] = self.__changed_boxes(saved_set_key, object_hashes,
+                                                                                   boxes)
+                    changed_boxes = changed_boxes_by_set[saved_set_key]
+                    extent = RayExtent.from_arrays(cached['box_corners'], cached['sweeps'])
+                    if changed_boxes is not None and not any(extent.intersects(box) for box in changed_boxes):
+                        colors = cached['colors']
+                        utime(file_name)  # Most recently used
+                        yield tile, colors
+                        continue
+            tiles_to_render[tile] = file_name
+
+        print(f"Reused {len(tiles) - len(tiles_to_render)}/{len(tiles)} cached tiles.")
+        render_tile = _RecordingTileRenderer(scene)
+        if num_workers > 1:
+            rendered_tiles = render_tiles_in_parallel(render_tile, list(tiles_to_render), num_workers)
+        else:
+            rendered_tiles = ((tile, render_tile(tile)) for tile in tiles_to_render)
+        for tile, (colors, (box_corners, sweeps)) in rendered_tiles:
+            with open(tiles_to_render[tile], 'wb') as tile_file:
+                savez_compressed(tile_file, colors=colors.astype(float32), box_corners=box_corners, sweeps=sweeps,
+                                 object_set=object_set_key)
+            yield tile, colors
+        self.__evict()
+
+    def __evict(self):
+        """Remove least recently used tiles until the cache fits in its maximum size"""
+        files = [join(self.__tiles_directory, name) for name in listdir(self.__tiles_directory)]
+        files += [join(self.__object_sets_directory, name) for name in listdir(self.__object_sets_directory)]
+        total_size = sum(getsize(file_name) for file_name in files)
+        for file_name in sorted(files, key=getmtime):
+            if total_size <= self.__max_size:
+                break
+            total_size -= getsize(file_name)
+            remove(file_name)
@@ -1,42 +1,91 @@
 from basics import Vector
-from math import sqrt
+from math import sqrt, inf
+from struct import pack, unpack
+from numpy import array, errstate, minimum, maximum, where, nan, broadcast_arrays, asarray, sqrt as array_sqrt, \
+    einsum, ascontiguousarray, full, uint64
+from numpy.linalg import norm
 from globals import MIN_DIST
 
 
-def all_pos_roots(a, b, c):
-    """Positive roots of a quadratic polynomial, already in order"""
-    roots = []
+def ordered_pos_root_pair(a, b, c):
+    """
+    Smallest and largest root of ax²+bx+c = 0 which are at least MIN_DIST, inf where there is no such root
+    Only uses what Numba can compile, since the reference intersection kernels are built on it (see class_lib.kernels)
+    """
     if a == 0:
         if b == 0:
-            return None
+            return inf, inf
         r = -c / b
-        if r >= MIN_DIST:
-            roots.append(r)
-        return roots
+        return (r, inf) if r >= MIN_DIST else (inf, inf)
 
     delta = b * b - 4 * a * c
     if delta < 0:
-        return None
+        return inf, inf
 
     delta = sqrt(delta)
     r1 = (-b + delta) / (2 * a)
     r2 = (-b - delta) / (2 * a)
-
+    if r1 > r2:
+        r1, r2 = r2, r1
     if r1 >= MIN_DIST:
-        roots.append(r1)
+        return r1, r2
     if r2 >= MIN_DIST:
-        roots.append(r2)
-    if len(roots) > 1:
-        roots.sort()
-    return roots
+        return r2, inf
+    return inf, inf
 
 
 def min_pos_root(a, b, c):
     """Returns the minimum positive root for the function ax²+bx+c = 0. If no positive roots exist, returns None"""
-    roots = all_pos_roots(a, b, c)
-    if not roots or len(roots) == 0:
-        return None
-    return roots[0]
+    root = ordered_pos_root_pair(a, b, c)[0]
+    return root if root < inf else None
+
+
+def ordered_pos_roots(a, b, c):
+    """
+    Vectorized version of ordered_pos_root_pair, for arrays of quadratic polynomials
+    """
+    a, b, c = broadcast_arrays(asarray(a, dtype=float), asarray(b, dtype=float), asarray(c, dtype=float))
+    with errstate(divide='ignore', invalid='ignore'):
+        delta = array_sqrt(b * b - 4 * a * c)  # NaN if delta < 0
+        r1 = (-b + delta) / (2 * a)
+        r2 = (-b - delta) / (2 * a)
+        linear_root = -c / b
+    is_linear = a == 0
+    r1 = where(is_linear, linear_root, r1)
+    r2 = where(is_linear, nan, r2)
+    # Comparisons with NaN are false, so invalid roots are discarded as well
+    r1 = where(r1 >= MIN_DIST, r1, inf)
+    r2 = where(r2 >= MIN_DIST, r2, inf)
+    return minimum(r1, r2), maximum(r1, r2)
+
+
+def min_pos_roots(a, b, c):
+    """Vectorized version of min_pos_root. Returns inf where there are no positive roots"""
+    return ordered_pos_roots(a, b, c)[0]
+
+
+def as_array(v):
+    """Converts vector or color to a numpy array"""
+    if isinstance(v, Vector):
+        return array((v.x, v.y, v.z), dtype=float)
+    return array((v.red, v.green, v.blue), dtype=float)
+
+
+def dot_rows(u, v):
+    """Dot product between each row of u and the corresponding row of v"""
+    return einsum('ij,ij->i', u, v)
+
+
+def unit_rows(u):
+    """Each row of u scaled to unit length"""
+    return u / norm(u, axis=1)[:, None]
+
+
+def reflected_vectors(v, axis):
+    """Vectorized version of reflected_vector, for arrays of vectors (one per row)"""
+    unit_axis = unit_rows(axis)
+    gama = unit_axis * dot_rows(v, unit_axis)[:, None]
+    return 2 * gama - v
 
 
 def reflected_vector(v, axis):
@@ -54,3 +103,47 @@ def attenuate_by_distance_sq(distance_sq):
         return 1 / distance_sq
     else:
         return 10
+
+
+def attenuate_by_distances_sq(distances_sq):
+    """Vectorized version of attenuate_by_distance_sq"""
+    with errstate(divide='ignore'):
+        return where(distances_sq > 0.1, 1 / distances_sq, 10.0)
+
+
+_UINT64_MASK = 2 ** 64 - 1
+_GOLDEN_GAMMA = 0x9e3779b97f4a7c15
+
+
+def _mix(h):
+    """Mixes the bits of a 64-bit int (finalizer of SplitMix64)"""
+    h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & _UINT64_MASK
+    h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & _UINT64_MASK
+    return h ^ (h >> 31)
+
+
+def hashed_random(seed, *values):
+    """
+    Number between 0 and 1 which looks random, but only depends on the seed and the given floats, so that it is the
+    same whatever the order in which, and the process where, it is computed
+    """
+    h = seed & _UINT64_MASK
+    for bits in unpack(f'<{len(values)}Q', pack(f'<{len(values)}d', *values)):
+        h = _mix(((h ^ bits) + _GOLDEN_GAMMA) & _UINT64_MASK)
+    return (h >> 11) / 2 ** 53
+
+
+def _mix_array(h):
+    """Vectorized version of _mix, for an array of 64-bit unsigned ints (multiplications wrap around)"""
+    h = (h ^ (h >> uint64(30))) * uint64(0xbf58476d1ce4e5b9)
+    h = (h ^ (h >> uint64(27))) * uint64(0x94d049bb133111eb)
+    return h ^ (h >> uint64(31))
+
+
+def hashed_randoms(seed, values):
+    """Vectorized version of hashed_random, for an array of floats with the values of each number in a row"""
+    bits = ascontiguousarray(values, dtype=float).view(uint64)
+    h = full(len(bits), seed & _UINT64_MASK, dtype=uint64)
+    for column in bits.T:
+        h = _mix_array((h ^ column) + uint64(_GOLDEN_GAMMA))
+    return (h >> uint64(11)) / 2 ** 53
@@ -1,9 +1,110 @@
 """
 py-cgi - A python ray tracing program
 Tomas Tamantini 2020
+Render a scene with: python main.py phone_background --resolution 190x90 --output output/test.png
+List the scenes with: python main.py --list
 """
-from pre_cooked_scenes.phone_background import scene
+from argparse import ArgumentParser, BooleanOptionalAction
+from sys import exit
+from time import perf_counter
 
-im = scene.render_image()
-im.save_as_png('output/test.png')
-print("Image saved.")
+from class_lib.scene_registry import get_scene, scene_names
+
+# Quality levels: 'draft' only traces one pixel every 4 rows and columns and interpolates the others, 'preview' then
+# refines the image where samples differ (see Scene.render_progressively), and 'final' traces every pixel
+QUALITIES = ('draft', 'preview', 'final')
+
+
+def parse_resolution(text):
+    """Resolution given as 'HEIGHTxWIDTH'"""
+    height, width = (int(n) for n in text.lower().split('x'))
+    return height, width
+
+
+def render(scene, quality, num_workers, vectorized, max_samples=1):
+    if quality == 'final' and max_samples > 1:
+        return scene.render_antialiased(max_samples=max_samples, vectorized=vectorized)
+    if quality == 'final':
+        return scene.render_image(num_workers=num_workers, vectorized=vectorized)
+    image = None
+    for image in scene.render_progressively(initial_step=4, vectorized=vectorized):
+        if quality == 'draft':
+            break
+    return image
+
+
+def save_image(image, file_name):
+    if file_name.lower().endswith('.ppm'):
+        image.save_as_ppm(file_name, binary=True)
+    else:
+        image.save_as_png(file_name)
+
+
+def main(arguments=None):
+    parser = ArgumentParser(description="Render a scene with a ray tracer")
+    parser.add_argument('scene', nargs='?', default='phone_background',
+                        help="Name of a module of pre_cooked_scenes, or a scene file saved with class_lib.scene_files")
+    parser.add_argument('--list', action='store_true', help="List the scenes and exit")
+    parser.add_argument('--resolution', type=parse_resolution,
+                        help="Resolution as HEIGHTxWIDTH (the scene's own resolution by default)")
+    parser.add_argument('--output', default='output/test.png', help="Image file (.png or .ppm, or .npy with --stream)")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes rendering the image (0 for one "
+                                                               "per CPU core). Only used with final quality")
+    parser.add_argument('--quality', choices=QUALITIES, default='final')
+    parser.add_argument('--engine', choices=('scalar', 'vectorized'), default='scalar',
+                        help="Trace rays one at a time, or tiles of rays as NumPy arrays")
+    # Options of the scene are only changed when given, so that those saved in a scene file are kept otherwise
+    parser.add_argument('--kernels', help="Backend of the intersection kernels of the vectorized engine: 'numpy' (the "
+                                          "default), 'python' or 'numba' (which falls back to numpy if it is not "
+                                          "installed). See class_lib.kernels")
+    parser.add_argument('--min-ray-weight', type=float,
+                        help="Do not trace reflected and refracted rays whose contribution to the color of their pixel "
+                             "is below this fraction (0, the default for scene modules, traces them all, and about "
+                             "0.002 only drops rays which could not change an 8-bit color)")
+    parser.add_argument('--russian-roulette', action=BooleanOptionalAction,
+                        help="Trace some of the rays below the minimum weight at random, boosting their color, so that "
+                             "colors are right on average")
+    parser.add_argument('--roulette-seed', type=int, help="Seed of the random choices of the Russian roulette")
+    parser.add_argument('--antialias', type=int, default=1, metavar='MAX_SAMPLES',
+                        help="Anti-alias edges with up to this many rays per pixel, only where neighbouring pixels see "
+                             "different objects, normals or colors. Only used with final quality, in a single process")
+    parser.add_argument('--stream', action='store_true',
+                        help="Write bands of rows to the output file as soon as they are rendered, so that memory use does "
+                             "not grow with the image height. Only used with final quality")
+    parser.add_argument('--bvh', action=BooleanOptionalAction, help="Use a bounding volume hierarchy")
+    parser.add_argument('--frame', type=int, default=0, help="Frame to render, for scenes describing an animation")
+    parser.add_argument('--seed', type=int, help="Seed the random choices made by the scene module")
+    arguments = parser.parse_args(arguments)
+
+    if arguments.list:
+        print('\n'.join(scene_names()))
+        return 0
+    start_time = perf_counter()
+    try:
+        scene = get_scene(arguments.scene, arguments.frame, arguments.seed)
+    except ValueError as error:
+        parser.error(str(error))
+    from class_lib.kernels import backend_names  # Not imported at the top, so that listing scenes does not import NumPy
+    if arguments.kernels is not None and arguments.kernels not in backend_names():
+        parser.error(f"Unknown kernel backend: '{arguments.kernels}'. Use one of {', '.join(backend_names())}")
+    options = {'use_bvh': arguments.bvh, 'min_ray_weight': arguments.min_ray_weight,
+               'russian_roulette': arguments.russian_roulette, 'roulette_seed': arguments.roulette_seed,
+               'kernel_backend': arguments.kernels}
+    if arguments.resolution:
+        options['camera'] = scene.camera.with_resolution(arguments.resolution)
+    scene = scene.with_options(**{name: value for name, value in options.items() if value is not None})
+    load_time = perf_counter() - start_time
+
+    if arguments.stream and arguments.quality == 'final':
+        scene.render_to_file(arguments.output, num_workers=arguments.workers or None,
+                             vectorized=arguments.engine == 'vectorized')
+    else:
+        save_image(render(scene, arguments.quality, arguments.workers or None, arguments.engine == 'vectorized',
+                          arguments.antialias), arguments.output)
+    print(f"Image saved to {arguments.output} (scene loaded in {load_time:.2f} s, "
+          f"rendered in {perf_counter() - start_time - load_time:.2f} s).")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
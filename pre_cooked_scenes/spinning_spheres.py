@@ -0,0 +1,55 @@
+from math import pi, sqrt, sin, cos
+
+from class_lib.color import *
+from class_lib.imaging import Camera, Scene
+from class_lib.light import *
+from class_lib.solid_objects import Material
+from class_lib.solids.sphere import SmoothSphere
+
+# Animation of three spheres spinning on top of a big one. Render it with:
+# render_animation(scene_at_frame, NUM_FRAMES, 'output/animation/animation_test.gif')
+
+HEIGHT = 500
+WIDTH = 600
+NUM_FRAMES = 30
+
+RADIUS = 1
+BIG_RADIUS = 10
+DEGREES_120 = pi * 2 / 3
+
+
+def scene_at_frame(frame_index):
+    """Scene of given frame of the animation"""
+    theta = 2 * pi * frame_index / NUM_FRAMES
+    camera_position = Vector(7, 0, 6)
+
+    d_small = RADIUS * 2 / sqrt(3)
+    d_big = sqrt(BIG_RADIUS * BIG_RADIUS + 2 * BIG_RADIUS * RADIUS)
+
+    c1 = Vector(d_small * cos(theta), d_small * sin(theta), RADIUS)
+    c2 = Vector(d_small * cos(theta + DEGREES_120), d_small * sin(theta + DEGREES_120), RADIUS)
+    c3 = Vector(d_small * cos(theta - DEGREES_120), d_small * sin(theta - DEGREES_120), RADIUS)
+    cb = Vector(0, 0, RADIUS - d_big)
+
+    m1 = Material(diffuse_light_reflectivity=Color(0, 0.2, 0.2), specular_multiplier=0.5, reflective_index=0.3,
+                  refractive_index=1.08,
+                  refractive_attenuation=Color(0.01, 0.01, 0))
+    m2 = Material(diffuse_light_reflectivity=WHITE * 0.4, specular_multiplier=0.2)
+    m3 = Material(diffuse_light_reflectivity=GRAPE, specular_multiplier=0.5, reflective_index=0.4)
+    mb = Material(diffuse_light_reflectivity=WHITE * 0.2, specular_multiplier=0.5, reflective_index=0.5)
+
+    s1 = SmoothSphere(c1, RADIUS, m1)
+    s2 = SmoothSphere(c2, RADIUS, m2)
+    s3 = SmoothSphere(c3, RADIUS, m3)
+    base = SmoothSphere(cb, BIG_RADIUS, mb)
+
+    solid_objects = [s1, s2, s3, base]
+
+    l1 = LightSourceAtInfinity(intensity=Color('#ffffff'), direction=Vector(2, -1, 3))
+    l2 = PointLightSource(intensity=Color('#ffff00'), intensity_booster=4, position=Vector(2, 2, 3))
+    illumination = Illumination(ambient_light=AmbientLight(intensity=WHITE * 0.3), light_sources=[l1, l2])
+
+    camera = Camera(resolution=(HEIGHT, WIDTH), position=camera_position, direction=-camera_position, zoom=1,
+                    tilt_angle=0)
+
+    return Scene(camera, solid_objects, illumination)
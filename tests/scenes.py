@@ -0,0 +1,29 @@
+"""Small scenes, cheap enough to render in tests"""
+from basics import Vector
+
+from class_lib.color import Color, WHITE
+from class_lib.coordinate_system import CoordinateSystem
+from class_lib.imaging import Camera, Scene
+from class_lib.light import AmbientLight, Illumination, LightSourceAtInfinity, PointLightSource
+from class_lib.solid_objects import Material
+from class_lib.solids.ellipsoid import Ellipsoid
+from class_lib.solids.plane import SmoothPlane
+
+
+def candies_scene(candy_color=Color(0.8, 0.1, 0.2), light_intensity=WHITE, candy_x=0.0, resolution=(24, 32)):
+    """Two candies on a reflective floor, lit by a point light and a light at infinity"""
+    floor = SmoothPlane(CoordinateSystem(), Material(diffuse_light_reflectivity=WHITE * 0.3, reflective_index=.15))
+    candy = Ellipsoid(CoordinateSystem(origin=Vector(candy_x, -0.3, 0.5)),
+                      Material(diffuse_light_reflectivity=candy_color, specular_multiplier=0.5), width=0.5)
+    lens = Ellipsoid(CoordinateSystem(origin=Vector(0, 0.4, 0.5)),
+                     Material(diffuse_light_reflectivity=WHITE * 0.01, specular_multiplier=.85,
+                              specular_coefficient=20, reflective_index=0.3, refractive_index=1.1,
+                              refractive_attenuation=Color(0.03, 0.01, 0.01)), width=0.5)
+    illumination = Illumination(ambient_light=AmbientLight(intensity=WHITE * 0.2),
+                                light_sources=[LightSourceAtInfinity(intensity=light_intensity,
+                                                                     direction=Vector(2, 3, 3)),
+                                               PointLightSource(intensity=Color(0, 1, 0), intensity_booster=2,
+                                                                position=Vector(0, 1, 2))])
+    camera_position = Vector(3, 0.5, 1.5)
+    camera = Camera(resolution=resolution, position=camera_position, direction=-camera_position + Vector(0, 0, 0.3))
+    return Scene(camera, [floor, candy, lens], illumination)
@@ -0,0 +1,12 @@
+from pytest import mark, skip
+
+from class_lib.kernels import backend_names, backend_parity_errors, get_backend
+
+
+@mark.parametrize('name', backend_names())
+def test_backend_finds_the_same_hits_as_the_reference(name):
+    try:
+        get_backend(name)
+    except ImportError as error:
+        skip(f"Backend {name} cannot be loaded: {error}")
+    assert backend_parity_errors(names=[name]) == []
@@ -0,0 +1,16 @@
+from contextlib import redirect_stdout
+from io import StringIO
+
+from pytest import mark
+
+from tests.scenes import candies_scene
+
+
+@mark.parametrize('use_bvh', (False, True))
+def test_engines_count_the_same_rays_and_depths(use_bvh):
+    scene = candies_scene().with_options(use_bvh=use_bvh)
+    with redirect_stdout(StringIO()):
+        _, scalar_stats = scene.render_image(collect_stats=True)
+        _, packet_stats = scene.render_image(collect_stats=True, vectorized=True)
+    assert scalar_stats.as_dict()['rays'] == packet_stats.as_dict()['rays']
+    assert scalar_stats.depth_histogram == packet_stats.depth_histogram
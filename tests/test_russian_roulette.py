@@ -0,0 +1,32 @@
+from contextlib import redirect_stdout
+from io import StringIO
+
+from numpy import array_equal
+
+from class_lib.imaging import Scene
+from tests.scenes import candies_scene
+
+
+def roulette_scene(roulette_seed=0):
+    scene = candies_scene()
+    return Scene(scene.camera, scene.objects, scene.illumination, min_ray_weight=0.2, russian_roulette=True,
+                 roulette_seed=roulette_seed)
+
+
+def render(scene, **options):
+    with redirect_stdout(StringIO()):
+        return scene.render_image(**options).pixels
+
+
+def test_scalar_renders_do_not_depend_on_tiles_or_processes():
+    pixels = render(roulette_scene())
+    assert array_equal(render(roulette_scene()), pixels)
+    assert array_equal(render(roulette_scene(), num_workers=2, tile_size=8), pixels)
+    assert not array_equal(render(roulette_scene(roulette_seed=1)), pixels)
+
+
+def test_packet_renders_do_not_depend_on_tiles_or_processes():
+    pixels = render(roulette_scene(), vectorized=True, tile_size=32)
+    assert array_equal(render(roulette_scene(), vectorized=True, tile_size=8), pixels)
+    assert array_equal(render(roulette_scene(), vectorized=True, tile_size=8, num_workers=2), pixels)
+    assert not array_equal(render(roulette_scene(roulette_seed=1), vectorized=True), pixels)
@@ -0,0 +1,50 @@
+from pickle import dumps, loads
+
+from basics import Vector
+from numpy import array
+
+from class_lib.color import WHITE
+from class_lib.coordinate_system import CoordinateSystem
+from class_lib.light import Ray
+from class_lib.solid_objects import Material
+from class_lib.solids.ellipsoid import Ellipsoid
+from class_lib.solids.sphere import SmoothSphere
+from class_lib.tile_cache import stable_hash
+
+MATERIAL = Material(diffuse_light_reflectivity=WHITE)
+
+
+def distances(obj, ray):
+    packet_distance = obj.intersection_distances(array([[ray.initial_point.x, ray.initial_point.y,
+                                                         ray.initial_point.z]]),
+                                                 array([[ray.direction.x, ray.direction.y, ray.direction.z]]))[0]
+    return obj.intersection_distance(ray), packet_distance
+
+
+def test_changed_dimensions_are_used():
+    ray = Ray(Vector(10, 0, 0), Vector(-1, 0, 0))
+    sphere = SmoothSphere(Vector(0, 0, 0), 1, MATERIAL)
+    assert distances(sphere, ray) == (9, 9)
+    sphere.radius = 2
+    assert distances(sphere, ray) == (8, 8)
+
+    ellipsoid = Ellipsoid(CoordinateSystem(), MATERIAL, width=1, length=1, height=1)
+    assert distances(ellipsoid, ray) == (9.5, 9.5)
+    ellipsoid.width = 4
+    assert distances(ellipsoid, ray) == (8, 8)
+
+
+def test_moved_coordinate_system_is_used():
+    sphere = SmoothSphere(Vector(0, 0, 0), 1, MATERIAL)
+    ray = Ray(Vector(10, 5, 0), Vector(-1, 0, 0))
+    assert distances(sphere, ray)[0] is None
+    sphere.coordinate_system.origin = Vector(0, 5, 0)
+    assert distances(sphere, ray) == (9, 9)
+
+
+def test_hash_does_not_depend_on_cached_values():
+    sphere = SmoothSphere(Vector(0, 0, 0), 1, MATERIAL)
+    hash_before_use = stable_hash(sphere)
+    distances(sphere, Ray(Vector(10, 0, 0), Vector(-1, 0, 0)))
+    assert stable_hash(sphere) == hash_before_use
+    assert stable_hash(loads(dumps(sphere))) == hash_before_use
@@ -0,0 +1,30 @@
+from contextlib import redirect_stdout
+from io import StringIO
+
+from numpy import array_equal
+
+from class_lib.color import Color
+from class_lib.temporal_coherence import TemporalCoherentRenderer
+from tests.scenes import candies_scene
+
+
+def full_render(scene):
+    with redirect_stdout(StringIO()):
+        return scene.render_image(tile_size=8, vectorized=True).pixels
+
+
+def test_frames_match_full_renders():
+    renderer = TemporalCoherentRenderer(tile_size=8)
+    frames = [candies_scene(), candies_scene(candy_x=0.2), candies_scene(candy_x=0.2)]
+    for frame in frames:
+        assert array_equal(renderer.render(frame).pixels, full_render(frame))
+    assert renderer.retraced_pixels == 0
+
+
+def test_color_changes_are_retraced():
+    renderer = TemporalCoherentRenderer(tile_size=8)
+    renderer.render(candies_scene())
+    for changed_frame in (candies_scene(candy_color=Color(0.1, 0.8, 0.2)),
+                          candies_scene(candy_color=Color(0.1, 0.8, 0.2), light_intensity=Color(0.5, 0.5, 1))):
+        assert array_equal(renderer.render(changed_frame).pixels, full_render(changed_frame))
+        assert renderer.retraced_pixels > 0
@@ -0,0 +1,32 @@
+from contextlib import redirect_stdout
+from io import StringIO
+
+from numpy import array_equal
+
+from class_lib.color import Color
+from class_lib.tile_cache import TileCache, stable_hash
+from tests.scenes import candies_scene
+
+
+def render(scene, tile_cache=None):
+    with redirect_stdout(StringIO()):
+        return scene.render_image(tile_size=8, vectorized=True, tile_cache=tile_cache).pixels
+
+
+def test_colors_have_different_hashes():
+    assert stable_hash(Color(1, 0, 0)) != stable_hash(Color(0, 1, 0))
+
+
+def test_unchanged_scene_is_reused(tmp_path):
+    tile_cache = TileCache(str(tmp_path))
+    first_pixels = render(candies_scene(), tile_cache)
+    assert array_equal(render(candies_scene(), tile_cache), first_pixels)
+
+
+def test_changes_invalidate_the_cache(tmp_path):
+    tile_cache = TileCache(str(tmp_path))
+    render(candies_scene(), tile_cache)
+    for changed_scene in (candies_scene(candy_color=Color(0.1, 0.8, 0.2)),
+                          candies_scene(light_intensity=Color(0.5, 0.5, 1)),
+                          candies_scene(candy_x=0.3)):
+        assert array_equal(render(changed_scene, tile_cache), render(changed_scene))